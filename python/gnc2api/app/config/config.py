@@ -2,19 +2,52 @@
 应用程序配置模块
 """
 
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 from app.core.constants import (
+    DEFAULT_ADAPTIVE_DEADLINE_MULTIPLIER,
     API_VERSION,
+    DEFAULT_AFFINITY_LOAD_FACTOR,
+    DEFAULT_AFFINITY_LOAD_HALF_LIFE,
+    DEFAULT_AFFINITY_VIRTUAL_NODES,
+    DEFAULT_BATCH_CONCURRENCY,
+    DEFAULT_BATCH_INTERACTIVE_THRESHOLD,
+    DEFAULT_BATCH_MAX_FILE_SIZE,
+    DEFAULT_BATCH_STORAGE_DIR,
+    DEFAULT_CONTEXT_CACHE_MIN_HITS,
+    DEFAULT_CREATE_IMAGE_MODEL,
+    DEFAULT_CONTEXT_CACHE_MIN_TOKENS,
+    DEFAULT_CONTEXT_CACHE_TTL,
     DEFAULT_FILTER_MODELS,
+    DEFAULT_MAX_CONCURRENT_STREAMS,
+    DEFAULT_MAX_INLINE_MEDIA_BYTES,
+    DEFAULT_MEDIA_OFFLOAD_MIN_BYTES,
     DEFAULT_MODEL,
+    DEFAULT_MODEL_CATALOG_REFRESH_INTERVAL,
+    DEFAULT_PROVIDER_DRAIN_TIMEOUT,
+    DEFAULT_RATE_LIMIT_BURST,
+    DEFAULT_RATE_LIMIT_RPM,
+    DEFAULT_SERVER_BACKLOG,
+    DEFAULT_SERVER_GRACEFUL_SHUTDOWN_TIMEOUT,
+    DEFAULT_SERVER_HOST,
+    DEFAULT_SERVER_KEEPALIVE_TIMEOUT,
+    DEFAULT_SERVER_PORT,
+    DEFAULT_REQUEST_LOG_MAX_BYTES,
     DEFAULT_STREAM_CHUNK_SIZE,
     DEFAULT_STREAM_LONG_TEXT_THRESHOLD,
     DEFAULT_STREAM_MAX_DELAY,
     DEFAULT_STREAM_MIN_DELAY,
     DEFAULT_STREAM_SHORT_TEXT_THRESHOLD,
     DEFAULT_TIMEOUT,
+    DEFAULT_UPSTREAM_CONNECT_TIMEOUT,
+    DEFAULT_UPSTREAM_FIRST_BYTE_TIMEOUT,
+    DEFAULT_UPSTREAM_IDLE_TIMEOUT,
+    DEFAULT_TRAFFIC_CAPTURE_FILE,
+    DEFAULT_TRAFFIC_CAPTURE_SAMPLE_RATE,
+    DEFAULT_TRACING_SAMPLE_RATE,
+    DEFAULT_TRACING_SLOW_BUFFER_SIZE,
+    DEFAULT_TRACING_SLOW_THRESHOLD,
     DEFAULT_X_GOOG_API_CLIENT,
 )
 
@@ -41,11 +74,23 @@ class Settings(BaseSettings):
     TOOLS_CODE_EXECUTION_ENABLED: bool = False
 
     MAX_FAILURES: int = 3
+    # 热更新移除Provider时，等待其进行中请求结束的最长时间（秒）
+    PROVIDER_DRAIN_TIMEOUT: int = DEFAULT_PROVIDER_DRAIN_TIMEOUT
+    # 上游请求的总时长上限（秒）
     MAX_TIMEOUT: int = DEFAULT_TIMEOUT
+    # 上游请求分阶段的超时（秒）：建立连接、等待首个字节（流式请求）、流式分块之间的最长间隔，0 表示只受总时长限制
+    UPSTREAM_CONNECT_TIMEOUT: float = DEFAULT_UPSTREAM_CONNECT_TIMEOUT
+    UPSTREAM_FIRST_BYTE_TIMEOUT: float = DEFAULT_UPSTREAM_FIRST_BYTE_TIMEOUT
+    UPSTREAM_IDLE_TIMEOUT: float = DEFAULT_UPSTREAM_IDLE_TIMEOUT
+    # 按各Provider和模型观测到的延迟分布收紧首字节和分块间隔超时，取 p99 的 ADAPTIVE_DEADLINE_MULTIPLIER 倍
+    ADAPTIVE_DEADLINES_ENABLED: bool = False
+    ADAPTIVE_DEADLINE_MULTIPLIER: float = DEFAULT_ADAPTIVE_DEADLINE_MULTIPLIER
     X_GOOG_API_CLIENT: str = ""
     BASE_URL: str = f"https://generativelanguage.googleapis.com/{API_VERSION}"
 
     # 图像生成相关配置
+    # /v1/images/generations 使用的模型，请求的模型不在 IMAGE_MODELS 中时使用
+    CREATE_IMAGE_MODEL: str = DEFAULT_CREATE_IMAGE_MODEL
     UPLOAD_PROVIDER: str = "smms"
     SMMS_SECRET_TOKEN: str = ""
     PICGO_API_KEY: str = ""
@@ -60,6 +105,79 @@ class Settings(BaseSettings):
     STREAM_LONG_TEXT_THRESHOLD: int = DEFAULT_STREAM_LONG_TEXT_THRESHOLD
     STREAM_CHUNK_SIZE: int = DEFAULT_STREAM_CHUNK_SIZE
 
+    # 准入控制配置，按访问令牌限制请求速率、并发流数量和每日token用量，0 表示不限制
+    RATE_LIMIT_ENABLED: bool = False
+    RATE_LIMIT_RPM: int = DEFAULT_RATE_LIMIT_RPM
+    RATE_LIMIT_BURST: int = DEFAULT_RATE_LIMIT_BURST
+    MAX_CONCURRENT_STREAMS: int = DEFAULT_MAX_CONCURRENT_STREAMS
+    DAILY_TOKEN_QUOTA: int = 0
+    # 单个令牌的限额覆盖，如 {"sk-xxx": {"rpm": 600, "streams": 16, "daily_tokens": 0}}
+    TOKEN_LIMITS: Dict[str, Dict[str, int]] = {}
+
+    # 单个请求中内嵌媒体（base64 图片等）解码后的总字节数上限，0 表示不限制
+    MAX_INLINE_MEDIA_BYTES: int = DEFAULT_MAX_INLINE_MEDIA_BYTES
+
+    # 内嵌媒体卸载配置，超过 MEDIA_OFFLOAD_MIN_BYTES 的媒体上传到 Files API 后以文件 URI 引用
+    MEDIA_OFFLOAD_ENABLED: bool = False
+    MEDIA_OFFLOAD_MIN_BYTES: int = DEFAULT_MEDIA_OFFLOAD_MIN_BYTES
+
+    # 离线批处理（/v1/files、/v1/batches）配置
+    BATCH_STORAGE_DIR: str = DEFAULT_BATCH_STORAGE_DIR
+    BATCH_CONCURRENCY: int = DEFAULT_BATCH_CONCURRENCY
+    # 交互请求占用的上游连接数达到该值时暂停派发批处理请求，0 表示不让路
+    BATCH_INTERACTIVE_THRESHOLD: int = DEFAULT_BATCH_INTERACTIVE_THRESHOLD
+    BATCH_MAX_FILE_SIZE: int = DEFAULT_BATCH_MAX_FILE_SIZE
+
+    # 请求日志配置
+    REQUEST_LOGGING_ENABLED: bool = False
+    REQUEST_LOG_MAX_BYTES: int = DEFAULT_REQUEST_LOG_MAX_BYTES
+
+    # 会话亲和路由配置
+    AFFINITY_ROUTING_ENABLED: bool = False
+    AFFINITY_VIRTUAL_NODES: int = DEFAULT_AFFINITY_VIRTUAL_NODES
+    AFFINITY_LOAD_FACTOR: float = DEFAULT_AFFINITY_LOAD_FACTOR
+    AFFINITY_LOAD_HALF_LIFE: float = DEFAULT_AFFINITY_LOAD_HALF_LIFE
+
+    # 模型目录配置，按各Provider实际支持的模型路由请求
+    MODEL_CATALOG_ENABLED: bool = True
+    MODEL_CATALOG_REFRESH_INTERVAL: int = DEFAULT_MODEL_CATALOG_REFRESH_INTERVAL
+
+    # 上下文缓存（cachedContents）配置
+    CONTEXT_CACHE_ENABLED: bool = False
+    CONTEXT_CACHE_MIN_TOKENS: int = DEFAULT_CONTEXT_CACHE_MIN_TOKENS
+    CONTEXT_CACHE_MIN_HITS: int = DEFAULT_CONTEXT_CACHE_MIN_HITS
+    CONTEXT_CACHE_TTL: int = DEFAULT_CONTEXT_CACHE_TTL
+
+    # 服务进程配置，python -m app.main 启动时使用
+    SERVER_HOST: str = DEFAULT_SERVER_HOST
+    SERVER_PORT: int = DEFAULT_SERVER_PORT
+    # worker 进程数，大于 1 时由主进程预先 fork，收到 SIGHUP 时逐个重启 worker
+    SERVER_WORKERS: int = 1
+    SERVER_BACKLOG: int = DEFAULT_SERVER_BACKLOG
+    SERVER_KEEPALIVE_TIMEOUT: int = DEFAULT_SERVER_KEEPALIVE_TIMEOUT
+    SERVER_GRACEFUL_SHUTDOWN_TIMEOUT: int = DEFAULT_SERVER_GRACEFUL_SHUTDOWN_TIMEOUT
+    # 每个 worker 的最大并发连接数，超过时返回 503；worker 处理指定数量的请求后重启，0 表示不限制
+    SERVER_LIMIT_CONCURRENCY: int = 0
+    SERVER_LIMIT_MAX_REQUESTS: int = 0
+    SERVER_ACCESS_LOG: bool = False
+    # 启动时预先建立到各Provider的连接
+    PROVIDER_WARMUP_ENABLED: bool = True
+
+    # 流量录制配置，用于离线回放和性能回归测试
+    TRAFFIC_CAPTURE_ENABLED: bool = False
+    TRAFFIC_CAPTURE_FILE: str = DEFAULT_TRAFFIC_CAPTURE_FILE
+    TRAFFIC_CAPTURE_SAMPLE_RATE: float = DEFAULT_TRAFFIC_CAPTURE_SAMPLE_RATE
+
+    # 链路追踪配置，记录请求各阶段的耗时
+    TRACING_ENABLED: bool = False
+    # 按比例采样导出到 OTLP/HTTP 收集器（如 http://localhost:4318/v1/traces）或 JSON Lines 文件
+    TRACING_SAMPLE_RATE: float = DEFAULT_TRACING_SAMPLE_RATE
+    TRACING_EXPORT_ENDPOINT: str = ""
+    TRACING_EXPORT_FILE: str = ""
+    # 耗时超过阈值（秒）的请求无论是否被采样都保存完整时间线，0 表示不记录
+    TRACING_SLOW_THRESHOLD: float = DEFAULT_TRACING_SLOW_THRESHOLD
+    TRACING_SLOW_BUFFER_SIZE: int = DEFAULT_TRACING_SLOW_BUFFER_SIZE
+
     def __init__(self):
         super().__init__()
         if not self.AUTH_TOKEN:
@@ -11,8 +11,12 @@ from app.log.logger import get_application_logger
 from app.middleware.middleware import setup_middlewares
 from app.exception.exceptions import setup_exception_handlers
 from app.router.routes import setup_routers
+from app.service.batch.batch_manager import batch_manager
+from app.service.client.client_pool import client_pool
 from app.service.provider.provider_manager import get_provider_manager_instance
 from app.core.initialization import initialize_app
+from app.core.tracing import tracer
+from app.core.reload import install_reload_signal_handler, remove_reload_signal_handler
 
 logger = get_application_logger()
 
@@ -29,16 +33,39 @@ async def lifespan(app: FastAPI):
     logger.info("Application starting up...")
     try:
         # 初始化ProviderManager
-        await get_provider_manager_instance(settings.API_PROVIDERS)
+        provider_manager = await get_provider_manager_instance(settings.API_PROVIDERS)
         logger.info("ProviderManager initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize ProviderManager: {str(e)}")
         raise
 
+    # 预先建立到各Provider的连接
+    if settings.PROVIDER_WARMUP_ENABLED:
+        await provider_manager.warm_up()
+
+    # 后台刷新各Provider支持的模型列表
+    provider_manager.start_model_catalog()
+
+    # 恢复未完成的批处理
+    await batch_manager.start(provider_manager)
+
+    # 定期导出被采样的追踪
+    if settings.TRACING_ENABLED:
+        tracer.exporter.start()
+
+    # 收到 SIGHUP 时热更新Provider和令牌
+    if install_reload_signal_handler():
+        logger.info("Send SIGHUP to reload providers and tokens")
+
     yield  # 应用程序运行期间
 
     # 关闭事件
     logger.info("Application shutting down...")
+    remove_reload_signal_handler()
+    await batch_manager.stop()
+    await tracer.exporter.stop()
+    await provider_manager.stop_model_catalog()
+    await client_pool.close()
 
 
 def create_app() -> FastAPI:
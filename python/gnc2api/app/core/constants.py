@@ -6,6 +6,25 @@
 API_VERSION = "v1beta"
 DEFAULT_TIMEOUT = 300  # 秒
 
+# 服务进程相关常量
+DEFAULT_SERVER_HOST = "0.0.0.0"
+DEFAULT_SERVER_PORT = 8001
+DEFAULT_SERVER_BACKLOG = 2048
+DEFAULT_SERVER_KEEPALIVE_TIMEOUT = 75  # 秒，长于常见负载均衡器 60 秒的空闲超时，避免复用已关闭的连接
+DEFAULT_SERVER_GRACEFUL_SHUTDOWN_TIMEOUT = 30  # 秒，重启 worker 时等待进行中的请求结束
+SERVER_MAX_REQUESTS_JITTER = 0.1  # limit-max-requests 的随机抖动比例，避免所有 worker 同时重启
+PROVIDER_WARMUP_TIMEOUT = 5  # 秒
+
+# 上游请求分阶段超时相关常量
+DEFAULT_UPSTREAM_CONNECT_TIMEOUT = 10  # 秒
+DEFAULT_UPSTREAM_FIRST_BYTE_TIMEOUT = 120  # 秒，思考模型的首个流式分块可能需要较长时间
+DEFAULT_UPSTREAM_IDLE_TIMEOUT = 60  # 秒
+DEFAULT_ADAPTIVE_DEADLINE_MULTIPLIER = 3.0
+ADAPTIVE_DEADLINE_WINDOW = 256  # 每个Provider和模型保留的最近样本数
+ADAPTIVE_DEADLINE_MIN_SAMPLES = 20  # 样本不足时使用配置的超时
+ADAPTIVE_DEADLINE_QUANTILE = 0.99
+ADAPTIVE_DEADLINE_FLOOR = 5  # 秒，自适应超时的下限
+
 # 模型相关常量
 SUPPORTED_ROLES = ["user", "model", "system"]
 DEFAULT_MODEL = "gemini-1.5-flash"
@@ -24,6 +43,11 @@ DEFAULT_FILTER_MODELS = [
 # 图像生成相关常量
 VALID_IMAGE_RATIOS = ["1:1", "3:4", "4:3", "9:16", "16:9"]
 
+# 图片生成相关常量
+DEFAULT_CREATE_IMAGE_MODEL = "gemini-2.0-flash-exp"
+IMAGE_GENERATION_MAX_N = 4
+IMAGE_GENERATION_MAX_ATTEMPTS = 2
+
 # 上传提供商
 UPLOAD_PROVIDERS = ["smms", "picgo", "cloudflare_imgbed"]
 DEFAULT_UPLOAD_PROVIDER = "smms"
@@ -35,9 +59,82 @@ DEFAULT_STREAM_SHORT_TEXT_THRESHOLD = 10
 DEFAULT_STREAM_LONG_TEXT_THRESHOLD = 50
 DEFAULT_STREAM_CHUNK_SIZE = 5
 
+# 会话亲和路由相关常量
+DEFAULT_AFFINITY_VIRTUAL_NODES = 160
+DEFAULT_AFFINITY_LOAD_FACTOR = 1.25
+DEFAULT_AFFINITY_LOAD_HALF_LIFE = 60  # 秒
+DEFAULT_AFFINITY_MIN_CAPACITY = 8
+
+# 上下文缓存相关常量
+DEFAULT_CONTEXT_CACHE_MIN_TOKENS = 4096
+DEFAULT_CONTEXT_CACHE_MIN_HITS = 2
+DEFAULT_CONTEXT_CACHE_TTL = 600  # 秒
+DEFAULT_CONTEXT_CACHE_REFRESH_MARGIN = 120  # 秒
+DEFAULT_CONTEXT_CACHE_FAILURE_COOLDOWN = 300  # 秒
+DEFAULT_CONTEXT_CACHE_MAX_ENTRIES = 1024
+DEFAULT_CONTEXT_CACHE_PRUNE_INTERVAL = 60  # 秒
+
+# 上游连接池相关常量
+DEFAULT_UPSTREAM_MAX_KEEPALIVE = 64
+DEFAULT_UPSTREAM_KEEPALIVE_EXPIRY = 60  # 秒
+DEFAULT_PROVIDER_DRAIN_TIMEOUT = 600  # 秒
+
+# 模型目录相关常量
+DEFAULT_MODEL_CATALOG_REFRESH_INTERVAL = 600  # 秒
+
+# 准入控制相关常量
+DEFAULT_RATE_LIMIT_RPM = 60
+DEFAULT_RATE_LIMIT_BURST = 10
+DEFAULT_MAX_CONCURRENT_STREAMS = 4
+
+# 批处理相关常量
+DEFAULT_BATCH_STORAGE_DIR = "data/batches"
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_BATCH_INTERACTIVE_THRESHOLD = 8
+DEFAULT_BATCH_MAX_FILE_SIZE = 200 * 1024 * 1024  # 字节
+BATCH_MAX_REQUESTS = 50000
+BATCH_CHECKPOINT_INTERVAL = 2  # 秒
+BATCH_LANE_POLL_INTERVAL = 0.2  # 秒
+BATCH_OWNER_POLL_INTERVAL = 2  # 秒
+BATCH_OWNER_LOCK_FILE = ".owner.lock"
+
+# 内嵌媒体相关常量
+DEFAULT_MAX_INLINE_MEDIA_BYTES = 20 * 1024 * 1024  # 单个请求解码后的字节数
+DATA_URL_HEADER_MAX_LENGTH = 256  # 只在 data URL 开头的这段范围内查找元信息
+INLINE_MEDIA_MIN_LENGTH = 4096  # 超过该长度的 base64 数据分块发送
+INLINE_MEDIA_CHUNK_SIZE = 256 * 1024
+LOG_MAX_INLINE_LENGTH = 256  # 日志中内嵌数据超过该长度时只记录长度
+
+# 内嵌媒体卸载（Files API）相关常量
+DEFAULT_MEDIA_OFFLOAD_MIN_BYTES = 1024 * 1024
+MEDIA_OFFLOAD_DEFAULT_EXPIRY = 47 * 3600  # 秒，上游未返回过期时间时使用，Files API 保留文件 48 小时
+MEDIA_OFFLOAD_EXPIRY_MARGIN = 3600  # 秒，文件剩余有效期不足时重新上传
+MEDIA_OFFLOAD_FAILURE_COOLDOWN = 300  # 秒
+MEDIA_OFFLOAD_PROCESSING_TIMEOUT = 30  # 秒
+
+# 请求日志相关常量
+DEFAULT_REQUEST_LOG_MAX_BYTES = 4096
+
+# 流式续写相关常量，已发送文本的结尾与续写开头的重叠至少达到该长度才会被去掉
+STREAM_CONTINUATION_MIN_OVERLAP = 8
+STREAM_CONTINUATION_MAX_OVERLAP = 512
+
 # 正则表达式模式
 IMAGE_URL_PATTERN = r"!\[(.*?)\]\((.*?)\)"
-DATA_URL_PATTERN = r"data:([^;]+);base64,(.+)"
 
 # 谷歌API客户端版本
 DEFAULT_X_GOOG_API_CLIENT = "genai-js/0.21.0"
+
+# 流量录制相关常量
+DEFAULT_TRAFFIC_CAPTURE_FILE = "data/traffic.jsonl"
+DEFAULT_TRAFFIC_CAPTURE_SAMPLE_RATE = 1.0
+
+# 链路追踪相关常量
+TRACING_SERVICE_NAME = "gnc2api"
+DEFAULT_TRACING_SAMPLE_RATE = 0.01
+DEFAULT_TRACING_SLOW_THRESHOLD = 30.0  # 秒，0 表示不记录慢请求
+DEFAULT_TRACING_SLOW_BUFFER_SIZE = 100
+TRACING_MAX_SPANS = 512  # 每个请求最多记录的 span 数
+TRACING_EXPORT_INTERVAL = 5  # 秒
+TRACING_EXPORT_BATCH_SIZE = 256
+TRACING_EXPORT_QUEUE_SIZE = 4096  # 等待导出的追踪数上限，超过时丢弃最早的
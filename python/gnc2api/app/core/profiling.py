@@ -0,0 +1,119 @@
+"""
+启动性能分析模块，统计冷启动时各模块的导入耗时
+"""
+
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# 在独立的解释器中导入应用，避免受当前进程已加载模块的影响
+PROBE_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print("__STARTUP__" + json.dumps({"total": elapsed}))
+"""
+
+
+def _parse_importtime(output: str) -> List[Dict[str, Any]]:
+    """
+    解析 `python -X importtime` 的输出
+
+    每行格式: import time: self [us] | cumulative | imported package
+    """
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        try:
+            _, content = line.split(":", maxsplit=1)
+            self_us, cumulative_us, name = content.split("|", maxsplit=2)
+            records.append(
+                {
+                    "module": name.strip(),
+                    "depth": (len(name) - len(name.lstrip())) // 2,
+                    "self": int(self_us) / 1e6,
+                    "cumulative": int(cumulative_us) / 1e6,
+                }
+            )
+        except ValueError:
+            continue
+
+    return records
+
+
+def profile_startup(top: int = 20) -> Dict[str, Any]:
+    """
+    在子进程中导入应用并统计导入耗时
+
+    Args:
+        top: 报告中保留的耗时最多的模块数量
+
+    Returns:
+        Dict[str, Any]: 分析报告，包含总耗时、按顶层包汇总的耗时和耗时最多的模块
+    """
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE_SCRIPT],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Failed to import application: {process.stderr[-2000:]}")
+
+    total = 0.0
+    for line in process.stdout.splitlines():
+        if line.startswith("__STARTUP__"):
+            total = json.loads(line.removeprefix("__STARTUP__")).get("total", 0.0)
+
+    records = _parse_importtime(process.stderr)
+    packages = defaultdict(float)
+    for record in records:
+        packages[record["module"].split(".")[0]] += record["self"]
+
+    return {
+        "total": round(total, 4),
+        "imports": round(sum(r["self"] for r in records), 4),
+        "packages": sorted(
+            ({"package": k, "seconds": round(v, 4)} for k, v in packages.items()),
+            key=lambda x: x["seconds"],
+            reverse=True,
+        )[:top],
+        "modules": [
+            {"module": r["module"], "self": round(r["self"], 4), "cumulative": round(r["cumulative"], 4)}
+            for r in sorted(records, key=lambda x: x["cumulative"], reverse=True)[:top]
+        ],
+    }
+
+
+def print_startup_report(report: Dict[str, Any], budget: Optional[float] = None) -> bool:
+    """
+    打印启动分析报告
+
+    Args:
+        report: profile_startup 生成的报告
+        budget: 启动耗时预算（秒），超出时返回False
+
+    Returns:
+        bool: 是否在预算之内
+    """
+    print(f"Application import time: {report['total']:.3f}s (module imports: {report['imports']:.3f}s)")
+    print("\nTop packages by self time:")
+    for item in report["packages"]:
+        print(f"  {item['seconds']:>8.3f}s  {item['package']}")
+
+    print("\nTop modules by cumulative time:")
+    for item in report["modules"]:
+        print(f"  {item['cumulative']:>8.3f}s  {item['self']:>8.3f}s  {item['module']}")
+
+    if budget is not None and report["total"] > budget:
+        print(f"\nStartup time {report['total']:.3f}s exceeds budget {budget:.3f}s")
+        return False
+    return True
@@ -0,0 +1,119 @@
+"""
+配置热更新模块，无需重启进程即可更新API Provider和访问令牌
+"""
+
+import asyncio
+import os
+import signal
+from typing import Any, Dict, Optional
+
+from app.config.config import Settings, settings
+from app.core.security import get_security_service
+from app.log.logger import get_application_logger
+from app.service.admission.admission_controller import admission_controller
+from app.service.provider.provider_manager import get_provider_manager_instance
+
+logger = get_application_logger()
+
+_reload_lock = asyncio.Lock()
+_reload_tasks: set = set()
+
+# 多 worker 运行时由 run_server 设置为 uvicorn 主进程的 pid，worker 进程继承该环境变量
+MASTER_PID_ENV = "SERVER_MASTER_PID"
+
+
+def master_pid() -> Optional[int]:
+    """当前进程是多 worker 中的一个时返回主进程的 pid，否则返回None"""
+    pid = os.environ.get(MASTER_PID_ENV, "")
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return None
+    return int(pid)
+
+
+def restart_workers() -> bool:
+    """
+    多 worker 运行时向主进程发送 SIGHUP，由主进程逐个重启 worker，新 worker 重新读取配置
+
+    只在收到请求的 worker 内热更新会导致各 worker 的配置不一致
+
+    Returns:
+        bool: 是否已通知主进程，单进程或不支持 SIGHUP 的平台返回False
+    """
+    pid = master_pid()
+    if pid is None or not hasattr(signal, "SIGHUP"):
+        return False
+
+    os.kill(pid, signal.SIGHUP)
+    logger.info(f"Sent SIGHUP to master process {pid}, workers will be restarted with the new configuration")
+    return True
+
+
+async def reload_configuration() -> Dict[str, Any]:
+    """
+    重新读取配置（环境变量和 .env 文件），更新Provider列表和访问令牌
+
+    Returns:
+        Dict[str, Any]: Provider的变更情况和当前令牌数量
+    """
+    async with _reload_lock:
+        new_settings = Settings()
+
+        provider_manager = await get_provider_manager_instance()
+        providers = await provider_manager.reload(new_settings.API_PROVIDERS)
+
+        get_security_service().update_tokens(new_settings.ALLOWED_TOKENS, new_settings.AUTH_TOKEN)
+        admission_controller.update_limits(
+            enabled=new_settings.RATE_LIMIT_ENABLED,
+            rpm=new_settings.RATE_LIMIT_RPM,
+            burst=new_settings.RATE_LIMIT_BURST,
+            streams=new_settings.MAX_CONCURRENT_STREAMS,
+            daily_tokens=new_settings.DAILY_TOKEN_QUOTA,
+            overrides=new_settings.TOKEN_LIMITS,
+        )
+
+        # 同步全局配置，保证其他模块读取到的是最新值
+        settings.API_PROVIDERS = provider_manager.providers
+        settings.ALLOWED_TOKENS = new_settings.ALLOWED_TOKENS
+        settings.AUTH_TOKEN = new_settings.AUTH_TOKEN
+        settings.RATE_LIMIT_ENABLED = new_settings.RATE_LIMIT_ENABLED
+        settings.RATE_LIMIT_RPM = new_settings.RATE_LIMIT_RPM
+        settings.RATE_LIMIT_BURST = new_settings.RATE_LIMIT_BURST
+        settings.MAX_CONCURRENT_STREAMS = new_settings.MAX_CONCURRENT_STREAMS
+        settings.DAILY_TOKEN_QUOTA = new_settings.DAILY_TOKEN_QUOTA
+        settings.TOKEN_LIMITS = new_settings.TOKEN_LIMITS
+
+        return {"providers": providers, "tokens": len(new_settings.ALLOWED_TOKENS)}
+
+
+def _on_sighup() -> None:
+    async def reload():
+        try:
+            await reload_configuration()
+        except Exception as e:
+            logger.error(f"Failed to reload configuration: {str(e)}")
+
+    logger.info("Received SIGHUP, reloading configuration...")
+    task = asyncio.create_task(reload())
+    _reload_tasks.add(task)
+    task.add_done_callback(_reload_tasks.discard)
+
+
+def install_reload_signal_handler() -> bool:
+    """注册 SIGHUP 信号处理器，不支持的平台（如Windows）返回False"""
+    if not hasattr(signal, "SIGHUP"):
+        return False
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _on_sighup)
+        return True
+    except (NotImplementedError, RuntimeError, ValueError) as e:
+        logger.warning(f"Unable to install SIGHUP handler: {str(e)}")
+        return False
+
+
+def remove_reload_signal_handler() -> None:
+    if hasattr(signal, "SIGHUP"):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
@@ -3,26 +3,34 @@ from typing import Optional
 from fastapi import Header, HTTPException
 
 from app.config.config import settings
+from app.core.tracing import traced
 from app.log.logger import get_security_logger
 
 logger = get_security_logger()
 
 
 def verify_auth_token(token: str) -> bool:
-    return token == settings.AUTH_TOKEN
+    return token == get_security_service().auth_token
 
 
 class SecurityService:
     def __init__(self, allowed_tokens: list, auth_token: str):
-        self.allowed_tokens = allowed_tokens
+        # 使用集合保存令牌，校验时为 O(1) 的哈希查找
+        self.allowed_tokens = frozenset(allowed_tokens)
         self.auth_token = auth_token
 
+    def update_tokens(self, allowed_tokens: list, auth_token: str):
+        """热更新令牌配置，正在处理的请求不受影响"""
+        self.allowed_tokens, self.auth_token = frozenset(allowed_tokens), auth_token
+        logger.info(f"Security tokens reloaded, allowed tokens: {len(self.allowed_tokens)}")
+
     async def verify_key(self, key: str):
         if key not in self.allowed_tokens and key != self.auth_token:
             logger.error("Invalid key")
             raise HTTPException(status_code=401, detail="Invalid key")
         return key
 
+    @traced("auth")
     async def verify_authorization(self, authorization: Optional[str] = Header(None)) -> str:
         if not authorization:
             logger.error("Missing Authorization header")
@@ -39,6 +47,7 @@ class SecurityService:
 
         return token
 
+    @traced("auth")
     async def verify_goog_api_key(self, x_goog_api_key: Optional[str] = Header(None)) -> str:
         """验证Google API Key"""
         if not x_goog_api_key:
@@ -62,6 +71,7 @@ class SecurityService:
 
         return token
 
+    @traced("auth")
     async def verify_key_or_goog_api_key(
         self, key: Optional[str] = None , x_goog_api_key: Optional[str] = Header(None)
     ) -> str:
@@ -79,4 +89,16 @@ class SecurityService:
             logger.error("Invalid key and invalid x-goog-api-key")
             raise HTTPException(status_code=401, detail="Invalid key and invalid x-goog-api-key")
         
-        return x_goog_api_key
\ No newline at end of file
+        return x_goog_api_key
+
+
+_security_service: Optional[SecurityService] = None
+
+
+def get_security_service() -> SecurityService:
+    """获取 SecurityService 单例，所有路由共享同一份令牌配置"""
+    global _security_service
+
+    if _security_service is None:
+        _security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN)
+    return _security_service
@@ -0,0 +1,101 @@
+"""
+服务进程启动模块，根据配置以单进程或多 worker 方式运行 uvicorn
+
+多 worker 时由 uvicorn 主进程预先 fork 出 worker 并负责监控：worker 异常退出或达到
+SERVER_LIMIT_MAX_REQUESTS 后自动拉起新的 worker；向主进程发送 SIGHUP 会逐个重启 worker，
+重启期间其余 worker 继续处理请求，新 worker 重新读取配置。单进程时 SIGHUP 由应用自身处理，热更新Provider和令牌。
+多 worker 时 /v1/providers/reload 同样转为向主进程发送 SIGHUP；批处理由持有存储目录文件锁的 worker 独自执行。
+"""
+
+import importlib.util
+import inspect
+import os
+from typing import Any, Dict, Optional
+
+import uvicorn
+
+from app.config.config import settings
+from app.core.constants import SERVER_MAX_REQUESTS_JITTER
+from app.core.reload import MASTER_PID_ENV
+from app.log.logger import get_main_logger
+
+logger = get_main_logger()
+
+APP_IMPORT_PATH = "app.main:app"
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _accepts(option: str) -> bool:
+    """已安装的 uvicorn 是否支持该启动参数，limit_max_requests_jitter 等参数只在较新的版本中提供"""
+    return option in inspect.signature(uvicorn.run).parameters
+
+
+def server_options(
+    workers: Optional[int] = None, host: Optional[str] = None, port: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    生成 uvicorn 的启动参数
+
+    已安装 uvloop 和 httptools 时使用它们代替标准事件循环和 h11 解析器
+
+    Args:
+        workers: worker 数量，默认使用 SERVER_WORKERS
+        host: 监听地址，默认使用 SERVER_HOST
+        port: 监听端口，默认使用 SERVER_PORT
+    """
+    workers = max(1, workers or settings.SERVER_WORKERS)
+    options = {
+        "host": host or settings.SERVER_HOST,
+        "port": port or settings.SERVER_PORT,
+        "workers": workers,
+        "loop": "uvloop" if _available("uvloop") else "asyncio",
+        "http": "httptools" if _available("httptools") else "h11",
+        "backlog": settings.SERVER_BACKLOG,
+        "timeout_keep_alive": settings.SERVER_KEEPALIVE_TIMEOUT,
+        "timeout_graceful_shutdown": settings.SERVER_GRACEFUL_SHUTDOWN_TIMEOUT or None,
+        "limit_concurrency": settings.SERVER_LIMIT_CONCURRENCY or None,
+        "access_log": settings.SERVER_ACCESS_LOG,
+    }
+
+    if settings.SERVER_LIMIT_MAX_REQUESTS > 0:
+        if workers > 1:
+            options["limit_max_requests"] = settings.SERVER_LIMIT_MAX_REQUESTS
+            if _accepts("limit_max_requests_jitter"):
+                jitter = int(settings.SERVER_LIMIT_MAX_REQUESTS * SERVER_MAX_REQUESTS_JITTER)
+                options["limit_max_requests_jitter"] = jitter
+            else:
+                logger.warning(
+                    "Installed uvicorn does not support limit_max_requests_jitter, workers may restart at once"
+                )
+        else:
+            # 单进程没有主进程负责拉起新的 worker，达到上限后服务会直接退出
+            logger.warning("SERVER_LIMIT_MAX_REQUESTS is ignored when running a single worker")
+    return options
+
+
+def run_server(app: Any, workers: Optional[int] = None, host: Optional[str] = None, port: Optional[int] = None) -> None:
+    """
+    启动服务
+
+    Args:
+        app: 单进程时直接使用的应用实例，多 worker 时各 worker 按 APP_IMPORT_PATH 自行导入
+        workers: worker 数量，默认使用 SERVER_WORKERS
+        host: 监听地址，默认使用 SERVER_HOST
+        port: 监听端口，默认使用 SERVER_PORT
+    """
+    options = server_options(workers, host, port)
+    logger.info(
+        f"Starting server on {options['host']}:{options['port']} with {options['workers']} worker(s), "
+        f"loop: {options['loop']}, http: {options['http']}"
+    )
+    if options["workers"] > 1:
+        # 限流、会话亲和和上下文缓存等状态保存在各 worker 进程内，不在 worker 之间共享
+        logger.warning("Rate limits, affinity and caches are tracked per worker process")
+        # worker 由主进程启动并继承环境变量，热更新请求通过该 pid 通知主进程重启 worker
+        os.environ[MASTER_PID_ENV] = str(os.getpid())
+        uvicorn.run(APP_IMPORT_PATH, **options)
+    else:
+        uvicorn.run(app, **options)
@@ -0,0 +1,519 @@
+"""
+请求链路追踪模块
+
+为每个请求记录一棵 span 树，覆盖认证、消息转换、图片下载、选择Provider、上游连接、等待首字节、响应转换和图片上传等阶段。
+按 TRACING_SAMPLE_RATE 采样的请求以 OTLP/HTTP JSON 格式导出到收集器或文件；耗时超过 TRACING_SLOW_THRESHOLD
+的请求无论是否被采样，完整的时间线都保存在内存中的环形缓冲区，供 /v1/traces/slow 查看。
+
+当前请求未在追踪时 span() 只有一次 ContextVar 查找的开销。
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from app.config.config import settings
+from app.core.constants import (
+    TRACING_EXPORT_BATCH_SIZE,
+    TRACING_EXPORT_INTERVAL,
+    TRACING_EXPORT_QUEUE_SIZE,
+    TRACING_MAX_SPANS,
+    TRACING_SERVICE_NAME,
+)
+from app.log.logger import get_tracing_logger
+
+logger = get_tracing_logger()
+
+# OTLP 中的 span 类型和状态码
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# httpx 底层连接事件对应的 span，响应体的读取由上游调用的 span 自身覆盖
+HTTPX_TRACE_SPANS = {
+    "connect_tcp": "upstream.connect",
+    "start_tls": "upstream.tls",
+    "send_request_body": "upstream.send",
+    "receive_response_headers": "upstream.wait_headers",
+}
+
+
+class Span:
+    """一个阶段的起止时间、属性和事件"""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "kind", "start", "end", "attributes", "events", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start = time.perf_counter_ns()
+        self.end: Optional[int] = None
+        self.attributes = attributes
+        self.events: List[tuple] = []
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def event(self, name: str, **attributes) -> None:
+        self.events.append((time.perf_counter_ns(), name, attributes))
+
+    def fail(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"[:500]
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter_ns()
+
+
+class _NullSpan:
+    """当前请求未在追踪时使用的空 span"""
+
+    __slots__ = ()
+    trace = None
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def event(self, name: str, **attributes) -> None:
+        pass
+
+    def fail(self, error: BaseException) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一个请求的全部 span"""
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        # perf_counter 的起点对应的 Unix 时间，导出时换算为绝对时间，计算耗时不受系统时钟调整影响
+        self.epoch_ns = time.time_ns()
+        self.origin_ns = time.perf_counter_ns()
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    @property
+    def root(self) -> Optional[Span]:
+        return self.spans[0] if self.spans else None
+
+    def start_span(
+        self, name: str, parent_id: Optional[str], kind: int = SPAN_KIND_INTERNAL, attributes=None
+    ) -> Optional[Span]:
+        # 长时间的流式请求可能产生大量 span，超过上限后只计数
+        if len(self.spans) >= TRACING_MAX_SPANS:
+            self.dropped += 1
+            return None
+        span = Span(self, name, parent_id, kind, attributes or {})
+        self.spans.append(span)
+        return span
+
+    def duration(self) -> float:
+        """请求耗时（秒）"""
+        root = self.root
+        if root is None:
+            return 0.0
+        return ((root.end or time.perf_counter_ns()) - root.start) / 1e9
+
+    def _unix_ns(self, value: int) -> int:
+        return self.epoch_ns + value - self.origin_ns
+
+    def timeline(self) -> Dict[str, Any]:
+        """以根 span 开始时间为起点的时间线，按开始时间排序，depth 为在 span 树中的层级"""
+        root = self.root
+        end = root.end or time.perf_counter_ns()
+        depths: Dict[str, int] = {}
+        spans = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            depth = depths[span.span_id] = depths.get(span.parent_id, -1) + 1 if span is not root else 0
+            spans.append(
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "depth": depth,
+                    "offset_ms": round((span.start - root.start) / 1e6, 3),
+                    "duration_ms": round(((span.end or end) - span.start) / 1e6, 3),
+                    "finished": span.end is not None,
+                    "attributes": span.attributes,
+                    "events": [
+                        {"name": name, "offset_ms": round((at - root.start) / 1e6, 3), "attributes": attributes}
+                        for at, name, attributes in span.events
+                    ],
+                    "error": span.error,
+                }
+            )
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._unix_ns(root.start) / 1e9)),
+            "duration_ms": round((end - root.start) / 1e6, 3),
+            "status_code": root.attributes.get("http.status_code"),
+            "sampled": self.sampled,
+            "dropped_spans": self.dropped,
+            "spans": spans,
+        }
+
+    def to_otlp(self) -> List[Dict[str, Any]]:
+        """转换为 OTLP JSON 格式的 span 列表"""
+        end = self.root.end or time.perf_counter_ns()
+        result = []
+        for span in self.spans:
+            item = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": span.kind,
+                "startTimeUnixNano": str(self._unix_ns(span.start)),
+                "endTimeUnixNano": str(self._unix_ns(span.end or end)),
+                "attributes": _otlp_attributes(span.attributes),
+                "status": {"code": STATUS_ERROR, "message": span.error} if span.error else {"code": STATUS_OK},
+            }
+            if span.parent_id:
+                item["parentSpanId"] = span.parent_id
+            if span.events:
+                item["events"] = [
+                    {"timeUnixNano": str(self._unix_ns(at)), "name": name, "attributes": _otlp_attributes(attributes)}
+                    for at, name, attributes in span.events
+                ]
+            result.append(item)
+        return result
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP JSON 中的 64 位整数以字符串表示
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def otlp_payload(traces: List[Trace]) -> Dict[str, Any]:
+    """OTLP/HTTP JSON 格式的导出请求体"""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _otlp_attributes({"service.name": TRACING_SERVICE_NAME})},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": TRACING_SERVICE_NAME},
+                        "spans": [span for trace in traces for span in trace.to_otlp()],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+# 当前正在执行的 span，由 TracingMiddleware 设置根 span
+current_span: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+class _SpanScope:
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span, activate: bool):
+        self.span = span
+        self.token = current_span.set(span) if activate else None
+
+    def __enter__(self) -> Span:
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if isinstance(exc, Exception):
+            self.span.fail(exc)
+        elif exc is not None:
+            # 客户端断开或任务被取消
+            self.span.set("aborted", True)
+        self.span.finish()
+        if self.token is not None:
+            try:
+                current_span.reset(self.token)
+            except ValueError:
+                # 异步生成器在其他上下文中被关闭
+                pass
+
+
+class _NullScope:
+    __slots__ = ()
+
+    def __enter__(self) -> _NullSpan:
+        return NULL_SPAN
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NULL_SCOPE = _NullScope()
+
+
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, parent: Optional[Span] = None, activate: bool = True, **attributes):
+    """
+    在当前请求的追踪中记录一个阶段，用法: with span("convert_messages") as s: ...
+
+    Args:
+        name: 阶段名称
+        kind: OTLP span 类型
+        parent: 父 span，默认为当前 span
+        activate: 是否设为当前 span。在异步生成器中跨越 yield 的 span 应传 False，避免影响消费方创建的 span
+        attributes: span 属性
+    """
+    parent = parent if parent is not None else current_span.get()
+    if parent is None or parent.trace is None:
+        return _NULL_SCOPE
+    child = parent.trace.start_span(name, parent.span_id, kind, attributes)
+    if child is None:
+        return _NULL_SCOPE
+    return _SpanScope(child, activate)
+
+
+def traced(name: str, **attributes):
+    """把整个异步函数记录为一个 span 的装饰器，可用于 FastAPI 依赖"""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_event(name: str, **attributes) -> None:
+    """在当前 span 上记录一个事件"""
+    active = current_span.get()
+    if active is not None:
+        active.event(name, **attributes)
+
+
+def httpx_extensions(parent: Any) -> Optional[Dict[str, Callable]]:
+    """
+    为上游请求生成 httpx 的 trace 扩展，把建立连接、TLS 握手、发送请求体和等待响应头记录为 parent 的子 span
+
+    连接池复用连接时没有 upstream.connect，未在追踪时返回None，不产生额外开销
+    """
+    if not isinstance(parent, Span):
+        return None
+    trace, opened = parent.trace, {}
+
+    async def hook(event: str, info: Dict[str, Any]) -> None:
+        # 事件名形如 http11.receive_response_headers.started
+        _, _, rest = event.partition(".")
+        operation, _, stage = rest.rpartition(".")
+        name = HTTPX_TRACE_SPANS.get(operation)
+        if name is None:
+            return
+        if stage == "started":
+            child = trace.start_span(name, parent.span_id, SPAN_KIND_INTERNAL)
+            if child is not None:
+                opened[operation] = child
+            return
+        child = opened.pop(operation, None)
+        if child is not None:
+            if stage == "failed" and isinstance(info.get("exception"), BaseException):
+                child.fail(info["exception"])
+            child.finish()
+
+    return {"trace": hook}
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """解析 W3C traceparent 请求头，返回 (trace_id, parent_id, sampled)"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        if int(parts[1], 16) == 0 or int(parts[2], 16) == 0:
+            return None
+        return parts[1].lower(), parts[2].lower(), bool(int(parts[3][:2], 16) & 1)
+    except ValueError:
+        return None
+
+
+class TraceExporter:
+    """
+    批量导出被采样的追踪
+
+    请求结束时只把追踪放入队列，由后台任务定期转换为 OTLP JSON 并发送到 TRACING_EXPORT_ENDPOINT
+    或追加写入 TRACING_EXPORT_FILE；队列满时丢弃最早的追踪，不阻塞请求
+    """
+
+    def __init__(self, endpoint: str, file_path: str):
+        self.endpoint = endpoint
+        self.file_path = file_path
+        self.queue: Deque[Trace] = deque(maxlen=TRACING_EXPORT_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.exported = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.endpoint or self.file_path)
+
+    def add(self, trace: Trace) -> None:
+        self.queue.append(trace)
+
+    def start(self) -> None:
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(TRACING_EXPORT_INTERVAL)
+            await self.flush()
+
+    def _write(self, line: str) -> None:
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def flush(self) -> None:
+        while self.queue:
+            batch = [self.queue.popleft() for _ in range(min(len(self.queue), TRACING_EXPORT_BATCH_SIZE))]
+            # 序列化在线程中执行，避免大批量的追踪阻塞事件循环
+            body = await asyncio.to_thread(
+                lambda: json.dumps(otlp_payload(batch), ensure_ascii=False, separators=(",", ":"))
+            )
+            try:
+                if self.file_path:
+                    await asyncio.to_thread(self._write, body)
+                if self.endpoint:
+                    if self.client is None:
+                        self.client = httpx.AsyncClient(timeout=10)
+                    response = await self.client.post(
+                        self.endpoint, content=body, headers={"Content-Type": "application/json"}
+                    )
+                    if response.status_code >= 300:
+                        raise Exception(f"collector returned status code {response.status_code}")
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.warning(f"Failed to export {len(batch)} traces: {str(e)}")
+
+
+class Tracer:
+    """决定哪些请求需要追踪，并在请求结束时导出或保存慢请求"""
+
+    def __init__(self, sample_rate: float, slow_threshold: float, slow_buffer_size: int, exporter: TraceExporter):
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.slow_threshold = max(0.0, slow_threshold)
+        self.exporter = exporter
+        self.slow: Deque[Trace] = deque(maxlen=max(1, slow_buffer_size))
+
+    def begin(self, name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+        """
+        开始追踪一个请求，返回根 span，由调用方设为当前 span
+
+        请求头带有 traceparent 时沿用其 trace id 和采样决定；既未被采样又未开启慢请求记录时返回None
+        """
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        sampled = sampled and self.exporter.enabled
+        if not sampled and not self.slow_threshold:
+            return None
+
+        return Trace(trace_id, sampled).start_span(name, parent_id, SPAN_KIND_SERVER, attributes)
+
+    def end(self, root: Span) -> None:
+        """结束请求，导出被采样的追踪，耗时超过阈值的追踪放入慢请求缓冲区"""
+        root.finish()
+        trace = root.trace
+        if trace.sampled:
+            self.exporter.add(trace)
+        duration = trace.duration()
+        if self.slow_threshold and duration >= self.slow_threshold:
+            self.slow.append(trace)
+            logger.info(f"Captured slow request {root.name} ({duration:.2f}s), trace id: {trace.trace_id}")
+
+    def slow_requests(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近的慢请求摘要，按时间倒序"""
+        result = []
+        for trace in list(reversed(self.slow))[: max(0, limit)]:
+            root = trace.root
+            result.append(
+                {
+                    "trace_id": trace.trace_id,
+                    "name": root.name,
+                    "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(trace._unix_ns(root.start) / 1e9)),
+                    "duration_ms": round(trace.duration() * 1000, 3),
+                    "status_code": root.attributes.get("http.status_code"),
+                    "spans": len(trace.spans),
+                    "errors": sum(1 for s in trace.spans if s.error),
+                }
+            )
+        return result
+
+    def find(self, trace_id: str) -> Optional[Trace]:
+        for trace in self.slow:
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_threshold": self.slow_threshold,
+            "slow_captured": len(self.slow),
+            "export_queue": len(self.exporter.queue),
+            "exported": self.exporter.exported,
+            "export_failed": self.exporter.failed,
+        }
+
+
+tracer = Tracer(
+    sample_rate=settings.TRACING_SAMPLE_RATE,
+    slow_threshold=settings.TRACING_SLOW_THRESHOLD,
+    slow_buffer_size=settings.TRACING_SLOW_BUFFER_SIZE,
+    exporter=TraceExporter(settings.TRACING_EXPORT_ENDPOINT, settings.TRACING_EXPORT_FILE),
+)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from app.core.constants import DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_TOP_K, DEFAULT_TOP_P
 
@@ -30,3 +30,10 @@ class ImageGenerationRequest(BaseModel):
     quality: Optional[str] = ""
     style: Optional[str] = ""
     response_format: Optional[str] = "url"
+
+
+class BatchRequest(BaseModel):
+    input_file_id: str
+    endpoint: str = "/v1/chat/completions"
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, str]] = None
@@ -54,6 +54,43 @@ class ModelNotSupportedError(APIError):
         )
 
 
+class RateLimitExceededError(APIError):
+    """请求速率超过限制"""
+
+    def __init__(self, detail: str = "Rate limit exceeded", retry_after: int = 1):
+        super().__init__(status_code=429, detail=detail, error_code="rate_limit_exceeded")
+        self.retry_after = retry_after
+
+
+class QuotaExceededError(APIError):
+    """令牌配额已用完"""
+
+    def __init__(self, detail: str = "Daily token quota exceeded", retry_after: int = None):
+        super().__init__(status_code=429, detail=detail, error_code="quota_exceeded")
+        self.retry_after = retry_after
+
+
+class PayloadTooLargeError(APIError):
+    """请求内容超过大小限制"""
+
+    def __init__(self, detail: str = "Request payload too large"):
+        super().__init__(status_code=413, detail=detail, error_code="payload_too_large")
+
+
+class UpstreamDeadlineError(APIError):
+    """上游请求在某个阶段超过时限"""
+
+    def __init__(self, provider: str, phase: str, limit: float):
+        super().__init__(
+            status_code=504,
+            detail=f"Upstream {provider} exceeded the {phase} deadline of {limit:.1f}s",
+            error_code="upstream_timeout",
+        )
+        self.provider = provider
+        self.phase = phase
+        self.limit = limit
+
+
 class APIKeyError(APIError):
     """API密钥错误"""
 
@@ -80,9 +117,11 @@ def setup_exception_handlers(app: FastAPI) -> None:
     async def api_error_handler(request: Request, exc: APIError):
         """处理API错误"""
         logger.error(f"API Error: {exc.detail} (Code: {exc.error_code})")
+        retry_after = getattr(exc, "retry_after", None)
         return JSONResponse(
             status_code=exc.status_code,
             content={"error": {"code": exc.error_code, "message": exc.detail}},
+            headers={"Retry-After": str(retry_after)} if retry_after else None,
         )
 
     @app.exception_handler(StarletteHTTPException)
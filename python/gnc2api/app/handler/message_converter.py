@@ -2,10 +2,12 @@ from abc import ABC, abstractmethod
 import json
 import re
 from typing import Any, Dict, List, Optional
-import requests
 import base64
 
-from app.core.constants import DATA_URL_PATTERN, IMAGE_URL_PATTERN, SUPPORTED_ROLES
+from app.core.constants import IMAGE_URL_PATTERN, SUPPORTED_ROLES
+from app.core.tracing import span
+from app.service.provider.affinity_router import build_conversation_key
+from app.utils.inline_media import parse_data_url
 
 
 class MessageConverter(ABC):
@@ -16,33 +18,10 @@ class MessageConverter(ABC):
         pass
 
 
-def _get_mime_type_and_data(base64_string):
-    """
-    从 base64 字符串中提取 MIME 类型和数据。
-
-    参数:
-        base64_string (str): 可能包含 MIME 类型信息的 base64 字符串
-
-    返回:
-        tuple: (mime_type, encoded_data)
-    """
-    # 检查字符串是否以 "data:" 格式开始
-    if base64_string.startswith("data:"):
-        # 提取 MIME 类型和数据
-        pattern = DATA_URL_PATTERN
-        match = re.match(pattern, base64_string)
-        if match:
-            mime_type = "image/jpeg" if match.group(1) == "image/jpg" else match.group(1)
-            encoded_data = match.group(2)
-            return mime_type, encoded_data
-
-    # 如果不是预期格式，假定它只是数据部分
-    return None, base64_string
-
-
 def _convert_image(image_url: str) -> Dict[str, Any]:
     if image_url.startswith("data:image"):
-        mime_type, encoded_data = _get_mime_type_and_data(image_url)
+        # 数据部分以引用的形式传递，不复制可能长达数 MB 的字符串
+        mime_type, encoded_data = parse_data_url(image_url)
         return {"inline_data": {"mime_type": mime_type, "data": encoded_data}}
     else:
         encoded_data = _convert_image_to_base64(image_url)
@@ -57,7 +36,12 @@ def _convert_image_to_base64(url: str) -> str:
     Returns:
         str: base64编码的图片数据
     """
-    response = requests.get(url)
+    import requests
+
+    with span("fetch_image") as fetch:
+        response = requests.get(url)
+        fetch.set("http.status_code", response.status_code)
+        fetch.set("bytes", len(response.content))
     if response.status_code == 200:
         # 将图片内容转换为base64
         img_data = base64.b64encode(response.content).decode("utf-8")
@@ -97,6 +81,29 @@ def _process_text_with_image(text: str) -> List[Dict[str, Any]]:
 class OpenAIMessageConverter(MessageConverter):
     """OpenAI消息格式转换器"""
 
+    def conversation_key(self, messages: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        生成会话标识，取值为转换后的系统指令与首条用户消息
+
+        为避免在选择Provider前拉取远程图片，这里直接使用原始内容，
+        与 convert 生成的 systemInstruction 及首条 user 消息一一对应
+        """
+        if not messages or not isinstance(messages, list):
+            return None
+
+        system_parts, first_user_parts = [], None
+        for msg in messages:
+            if not isinstance(msg, dict) or not msg.get("content"):
+                continue
+
+            role = msg.get("role", "")
+            if role == "system":
+                system_parts.append(msg["content"])
+            elif role == "user" and first_user_parts is None:
+                first_user_parts = [msg["content"]]
+
+        return build_conversation_key(first_user_parts, system_parts)
+
     def convert(self, messages: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
         converted_messages = []
         system_instruction_parts = []
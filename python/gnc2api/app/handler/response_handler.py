@@ -7,7 +7,7 @@ from typing import Dict, Any, List, Optional
 import time
 import uuid
 from app.config.config import settings
-from app.utils.uploader import ImageUploaderFactory
+from app.core.tracing import span
 
 
 class ResponseHandler(ABC):
@@ -31,6 +31,21 @@ class GeminiResponseHandler(ResponseHandler):
         return _handle_gemini_normal_response(response, model, stream)
 
 
+def _convert_usage(response: Dict[str, Any]) -> Dict[str, Any]:
+    """将Gemini的 usageMetadata 转换为OpenAI格式的 usage"""
+    usage_metadata = response.get("usageMetadata") or {}
+    prompt_tokens = usage_metadata.get("promptTokenCount", 0)
+    completion_tokens = usage_metadata.get("candidatesTokenCount", 0) + usage_metadata.get("thoughtsTokenCount", 0)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": usage_metadata.get("totalTokenCount", prompt_tokens + completion_tokens),
+    }
+    if usage_metadata.get("cachedContentTokenCount"):
+        usage["prompt_tokens_details"] = {"cached_tokens": usage_metadata["cachedContentTokenCount"]}
+    return usage
+
+
 def _handle_openai_stream_response(response: Dict[str, Any], model: str, finish_reason: str) -> Dict[str, Any]:
     text, tool_calls = _extract_result(response, model, stream=True, gemini_format=False)
     if not text and not tool_calls:
@@ -40,13 +55,17 @@ def _handle_openai_stream_response(response: Dict[str, Any], model: str, finish_
         if tool_calls:
             delta["tool_calls"] = tool_calls
 
-    return {
+    chunk = {
         "id": f"chatcmpl-{uuid.uuid4()}",
         "object": "chat.completion.chunk",
         "created": int(time.time()),
         "model": model,
         "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
     }
+    # 最后一个块附带整个流的用量
+    if finish_reason and response.get("usageMetadata"):
+        chunk["usage"] = _convert_usage(response)
+    return chunk
 
 
 def _handle_openai_normal_response(response: Dict[str, Any], model: str, finish_reason: str) -> Dict[str, Any]:
@@ -63,7 +82,7 @@ def _handle_openai_normal_response(response: Dict[str, Any], model: str, finish_
                 "finish_reason": finish_reason,
             }
         ],
-        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        "usage": _convert_usage(response),
     }
 
 
@@ -179,26 +198,18 @@ def _extract_result(
 
 
 def _extract_image_data(part: dict) -> str:
-    image_uploader = None
-    if settings.UPLOAD_PROVIDER == "smms":
-        image_uploader = ImageUploaderFactory.create(
-            provider=settings.UPLOAD_PROVIDER, api_key=settings.SMMS_SECRET_TOKEN
-        )
-    elif settings.UPLOAD_PROVIDER == "picgo":
-        image_uploader = ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER, api_key=settings.PICGO_API_KEY)
-    elif settings.UPLOAD_PROVIDER == "cloudflare_imgbed":
-        image_uploader = ImageUploaderFactory.create(
-            provider=settings.UPLOAD_PROVIDER,
-            base_url=settings.CLOUDFLARE_IMGBED_URL,
-            auth_code=settings.CLOUDFLARE_IMGBED_AUTH_CODE,
-        )
+    # 图片上传依赖仅在生成图片时才需要，延迟加载以缩短启动时间
+    from app.utils.uploader import create_configured_uploader
+
+    image_uploader = create_configured_uploader()
     current_date = time.strftime("%Y/%m/%d")
     filename = f"{current_date}/{uuid.uuid4().hex[:8]}.png"
     base64_data = part["inlineData"]["data"]
 
     # 将base64_data转成bytes数组
     bytes_data = base64.b64decode(base64_data)
-    upload_response = image_uploader.upload(bytes_data, filename)
+    with span("upload_image", uploader=settings.UPLOAD_PROVIDER, bytes=len(bytes_data)):
+        upload_response = image_uploader.upload(bytes_data, filename)
     if upload_response.success:
         text = f"\n\n![image]({upload_response.data.url})\n\n"
     else:
@@ -1,12 +1,19 @@
 from functools import wraps
-from typing import Callable, TypeVar
+from typing import Any, Callable, Dict, Optional, TypeVar
 
+from app.core.tracing import add_event
+from app.exception.exceptions import ModelNotSupportedError
 from app.log.logger import get_retry_logger
 
 T = TypeVar("T")
 logger = get_retry_logger()
 
 
+def _get_model(kwargs: Dict[str, Any]) -> Optional[str]:
+    """从路由参数中获取请求的模型，Gemini路由为 model_name，OpenAI路由为 request.model"""
+    return kwargs.get("model_name") or getattr(kwargs.get("request"), "model", None)
+
+
 class RetryHandler:
     """重试处理装饰器"""
 
@@ -22,6 +29,9 @@ class RetryHandler:
             for attempt in range(self.max_retries):
                 try:
                     return await func(*args, **kwargs)
+                except ModelNotSupportedError:
+                    # 没有Provider支持该模型，重试没有意义
+                    raise
                 except Exception as e:
                     last_exception = e
                     logger.warning(f"API call failed with error: {str(e)}. Attempt {attempt + 1} of {self.max_retries}")
@@ -30,8 +40,11 @@ class RetryHandler:
                     provider_manager = kwargs.get("provider_manager")
                     if provider_manager:
                         old_provider = kwargs.get(self.key_arg)
-                        new_provider = await provider_manager.handle_api_failure(old_provider)
+                        new_provider = await provider_manager.handle_request_failure(
+                            old_provider, _get_model(kwargs), e
+                        )
                         kwargs[self.key_arg] = new_provider
+                        add_event("retry", attempt=attempt + 1, provider=new_provider)
                         logger.info(f"Switched to new API Provider: {new_provider}")
 
             logger.error(f"All retry attempts failed, raising final exception: {str(last_exception)}")
@@ -0,0 +1,92 @@
+from typing import Any, Dict, Optional
+
+from app.core.constants import STREAM_CONTINUATION_MAX_OVERLAP, STREAM_CONTINUATION_MIN_OVERLAP
+
+
+def _overlap(emitted: str, text: str) -> int:
+    """emitted 的结尾与 text 的开头重叠的长度，短于最小长度的重叠视为巧合"""
+    for size in range(min(len(emitted), len(text), STREAM_CONTINUATION_MAX_OVERLAP), 0, -1):
+        if size < STREAM_CONTINUATION_MIN_OVERLAP:
+            break
+        if emitted.endswith(text[:size]):
+            return size
+    return 0
+
+
+class StreamContinuation:
+    """
+    流式响应的续写状态
+
+    记录已经发送给客户端的文本。上游流中途断开时，把这部分文本作为 model 内容追加到请求末尾，
+    让下一个Provider接着生成；续写的输出如果从头重新生成或与已发送的结尾重叠，只输出新的部分。
+    """
+
+    def __init__(self):
+        self.emitted = ""
+        # 已经在失败的请求中生成的token数，用于扣减 maxOutputTokens
+        self.generated_tokens = 0
+        # 已经输出了工具调用等非文本内容时无法续写
+        self.resumable = True
+        # 续写请求的开头，尚未确定是否与已发送的文本重复
+        self.pending: Optional[str] = None
+
+    def feed(self, text: str) -> str:
+        """
+        处理上游返回的文本，返回应该发送给客户端的部分
+
+        续写请求的开头如果仍是已发送文本的前缀，先缓存起来，直到能判断它是重新生成还是新内容
+        """
+        if self.pending is None:
+            self.emitted += text
+            return text
+
+        self.pending += text
+        if self.emitted.startswith(self.pending):
+            return ""
+
+        if self.pending.startswith(self.emitted):
+            # 上游忽略了已有的回复，从头重新生成
+            new_text = self.pending[len(self.emitted) :]
+        else:
+            new_text = self.pending[_overlap(self.emitted, self.pending) :]
+
+        self.pending = None
+        self.emitted += new_text
+        return new_text
+
+    def resume(self, usage_metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        上游流中断后准备续写
+
+        Args:
+            usage_metadata: 中断的请求最后返回的用量
+
+        Returns:
+            bool: 是否可以续写，已经输出工具调用时返回False
+        """
+        if usage_metadata:
+            self.generated_tokens += usage_metadata.get("candidatesTokenCount", 0)
+        if self.emitted:
+            self.pending = ""
+        return self.resumable
+
+    def build_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """在原始请求末尾追加已发送的文本，构造续写请求"""
+        if not self.emitted:
+            return payload
+
+        contents = list(payload.get("contents", []))
+        if contents and contents[-1].get("role") == "model":
+            last = contents.pop()
+            contents.append({**last, "parts": [*last.get("parts", []), {"text": self.emitted}]})
+        else:
+            contents.append({"role": "model", "parts": [{"text": self.emitted}]})
+
+        payload = {**payload, "contents": contents}
+        generation_config = payload.get("generationConfig") or {}
+        if generation_config.get("maxOutputTokens") and self.generated_tokens:
+            payload["generationConfig"] = {
+                **generation_config,
+                "maxOutputTokens": max(1, generation_config["maxOutputTokens"] - self.generated_tokens),
+            }
+        return payload
@@ -147,3 +147,35 @@ def get_middleware_logger():
 
 def get_routes_logger():
     return Logger.setup_logger("routes")
+
+
+def get_context_cache_logger():
+    return Logger.setup_logger("context_cache")
+
+
+def get_media_offload_logger():
+    return Logger.setup_logger("media_offload")
+
+
+def get_capture_logger():
+    return Logger.setup_logger("capture")
+
+
+def get_admission_logger():
+    return Logger.setup_logger("admission")
+
+
+def get_batch_logger():
+    return Logger.setup_logger("batch")
+
+
+def get_image_create_logger():
+    return Logger.setup_logger("image_create")
+
+
+def get_deadline_logger():
+    return Logger.setup_logger("deadline")
+
+
+def get_tracing_logger():
+    return Logger.setup_logger("tracing")
@@ -2,7 +2,9 @@
 应用程序入口模块
 """
 
-import uvicorn
+import argparse
+import json
+import sys
 
 from app.core.application import create_app
 from app.log.logger import get_main_logger
@@ -14,5 +16,26 @@ app = create_app()
 logger = get_main_logger()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gemini Balance API")
+    parser.add_argument("--profile-startup", action="store_true", help="print import time breakdown and exit")
+    parser.add_argument("--startup-budget", type=float, default=None, help="fail when startup exceeds seconds")
+    parser.add_argument("--profile-output", type=str, default="", help="save startup report as json")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (SERVER_WORKERS)")
+    parser.add_argument("--host", type=str, default=None, help="listen host (SERVER_HOST)")
+    parser.add_argument("--port", type=int, default=None, help="listen port (SERVER_PORT)")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        from app.core.profiling import print_startup_report, profile_startup
+
+        report = profile_startup()
+        if args.profile_output:
+            with open(args.profile_output, "w", encoding="utf8") as f:
+                json.dump(report, f, indent=2)
+
+        sys.exit(0 if print_startup_report(report, args.startup_budget) else 1)
+
+    from app.core.server import run_server
+
     logger.info("Starting application server...")
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    run_server(app, workers=args.workers, host=args.host, port=args.port)
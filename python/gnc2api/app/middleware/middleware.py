@@ -2,44 +2,63 @@
 中间件配置模块，负责设置和配置应用程序的中间件
 """
 
-from fastapi import FastAPI, Request
+import re
+
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-# from app.middleware.request_logging_middleware import RequestLoggingMiddleware
+from app.config.config import settings
 from app.core.constants import API_VERSION
 from app.core.security import verify_auth_token
 from app.log.logger import get_middleware_logger
+from app.middleware.request_logging_middleware import RequestLoggingMiddleware
+from app.middleware.tracing_middleware import TracingMiddleware
+from app.middleware.traffic_capture_middleware import TrafficCaptureMiddleware
 
 logger = get_middleware_logger()
 
+# 允许绕过身份验证的完整路径
+PUBLIC_PATHS = ["/", "/auth"]
+
+# 允许绕过身份验证的路径前缀
+PUBLIC_PREFIXES = ["/static", "/gemini", "/v1", f"/{API_VERSION}", "/health", "/hf"]
+
+# 预编译的路径匹配器，避免每个请求逐个比较前缀
+PUBLIC_PATH_MATCHER = re.compile(
+    r"^(?:(?:{})$|{})".format(
+        "|".join(re.escape(p) for p in PUBLIC_PATHS),
+        "|".join(re.escape(p) for p in PUBLIC_PREFIXES),
+    )
+)
+
 
-class AuthMiddleware(BaseHTTPMiddleware):
+class AuthMiddleware:
     """
     认证中间件，处理未经身份验证的请求
+
+    纯 ASGI 实现，不额外创建任务，也不会缓冲请求体和流式响应
     """
 
-    async def dispatch(self, request: Request, call_next):
-        # 允许特定路径绕过身份验证
-        if (
-            request.url.path not in ["/", "/auth"]
-            and not request.url.path.startswith("/static")
-            and not request.url.path.startswith("/gemini")
-            and not request.url.path.startswith("/v1")
-            and not request.url.path.startswith(f"/{API_VERSION}")
-            and not request.url.path.startswith("/health")
-            and not request.url.path.startswith("/hf")
-        ):
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-            auth_token = request.cookies.get("auth_token")
-            if not auth_token or not verify_auth_token(auth_token):
-                logger.warning(f"Unauthorized access attempt to {request.url.path}")
-                return RedirectResponse(url="/")
-            logger.debug("Request authenticated successfully")
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or PUBLIC_PATH_MATCHER.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
 
-        response = await call_next(request)
-        return response
+        auth_token = HTTPConnection(scope).cookies.get("auth_token")
+        if not auth_token or not verify_auth_token(auth_token):
+            logger.warning(f"Unauthorized access attempt to {scope['path']}")
+            response = RedirectResponse(url="/")
+            await response(scope, receive, send)
+            return
+
+        logger.debug("Request authenticated successfully")
+        await self.app(scope, receive, send)
 
 
 def setup_middlewares(app: FastAPI) -> None:
@@ -52,8 +71,21 @@ def setup_middlewares(app: FastAPI) -> None:
     # 添加认证中间件
     app.add_middleware(AuthMiddleware)
 
-    # 添加请求日志中间件（可选，默认注释掉）
-    # app.add_middleware(RequestLoggingMiddleware)
+    # 添加请求日志中间件（可选，默认关闭）
+    if settings.REQUEST_LOGGING_ENABLED:
+        app.add_middleware(RequestLoggingMiddleware, max_body_bytes=settings.REQUEST_LOG_MAX_BYTES)
+
+    # 添加流量录制中间件（可选，默认关闭）
+    if settings.TRAFFIC_CAPTURE_ENABLED:
+        from app.service.capture.traffic_recorder import traffic_recorder
+
+        app.add_middleware(TrafficCaptureMiddleware, recorder=traffic_recorder)
+
+    # 添加链路追踪中间件（可选，默认关闭），放在认证之外，根 span 包含整个请求的耗时
+    if settings.TRACING_ENABLED:
+        from app.core.tracing import tracer
+
+        app.add_middleware(TracingMiddleware, tracer=tracer)
 
     # 配置CORS中间件
     app.add_middleware(
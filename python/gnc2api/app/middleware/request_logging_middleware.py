@@ -1,38 +1,77 @@
 import json
+import re
 
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.constants import DEFAULT_REQUEST_LOG_MAX_BYTES
 from app.log.logger import get_request_logger
 
 logger = get_request_logger()
 
+# 日志中的 base64 图片数据只保留前缀
+BASE64_DATA_PATTERN = re.compile(r"(data:[\w/+.-]+;base64,)[A-Za-z0-9+/=]{32,}")
+
 
 # 添加中间件类
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+class RequestLoggingMiddleware:
+    """
+    请求日志中间件
+
+    纯 ASGI 实现，在请求体流经时仅复制前 max_body_bytes 字节用于记录，
+    不会把完整的请求体（例如携带多张图片的请求）读入内存，也无需回填请求体
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int = DEFAULT_REQUEST_LOG_MAX_BYTES):
+        self.app = app
+        self.max_body_bytes = max(0, max_body_bytes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # 记录请求路径
-        logger.info(f"Request path: {request.url.path}")
+        logger.info(f"Request path: {scope['path']}")
+
+        captured, total, logged = bytearray(), 0, False
+
+        async def receive_wrapper() -> Message:
+            nonlocal total, logged
+
+            message = await receive()
+            if message["type"] != "http.request" or logged:
+                return message
+
+            body = message.get("body", b"")
+            total += len(body)
+            remaining = self.max_body_bytes - len(captured)
+            if remaining > 0 and body:
+                captured.extend(body[:remaining])
+
+            if not message.get("more_body", False):
+                logged = True
+                self._log_body(bytes(captured), total)
+
+            return message
+
+        await self.app(scope, receive_wrapper, send)
+
+    def _log_body(self, body: bytes, total: int) -> None:
+        if not total:
+            return
 
-        # 获取并记录请求体
         try:
-            body = await request.body()
-            if body:
-                body_str = body.decode()
+            body_str = body.decode(errors="ignore")
+            if total <= len(body):
                 # 尝试格式化JSON
                 try:
-                    formatted_body = json.loads(body_str)
-                    logger.info(f"Formatted request body:\n{json.dumps(formatted_body, indent=2, ensure_ascii=False)}")
+                    formatted_body = json.dumps(json.loads(body_str), indent=2, ensure_ascii=False)
+                    formatted_body = BASE64_DATA_PATTERN.sub(r"\1...", formatted_body)
+                    logger.info(f"Formatted request body:\n{formatted_body}")
                 except json.JSONDecodeError:
                     logger.info("Request body is not valid JSON.")
+            else:
+                preview = BASE64_DATA_PATTERN.sub(r"\1...", body_str)
+                logger.info(f"Request body ({total} bytes, first {len(body)} bytes shown):\n{preview}")
         except Exception as e:
-            logger.error(f"Error reading request body: {str(e)}")
-
-        # 重置请求的接收器，以便后续处理器可以继续读取请求体
-        async def receive():
-            return {"type": "http.request", "body": body, "more_body": False}
-
-        request._receive = receive
-
-        response = await call_next(request)
-        return response
+            logger.error(f"Error logging request body: {str(e)}")
@@ -0,0 +1,60 @@
+import re
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.tracing import Tracer, current_span
+
+# 需要追踪的接口：聊天、内容生成、向量和图片生成
+TRACE_PATH_MATCHER = re.compile(
+    r".*(?:/chat/completions|:generateContent|:streamGenerateContent|/embeddings|/images/generations)$"
+)
+
+
+class TracingMiddleware:
+    """
+    链路追踪中间件
+
+    为需要追踪的请求创建根 span 并设为当前 span，流式响应发送完毕后才结束，
+    被追踪的请求在响应头中返回 X-Trace-Id，便于在慢请求列表中查找
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not TRACE_PATH_MATCHER.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers", []):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        root = self.tracer.begin(
+            f"{scope['method']} {scope['path']}",
+            traceparent,
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+                root.event("response_start")
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", root.trace.trace_id.encode())]
+            await send(message)
+
+        token = current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            root.fail(e)
+            raise
+        finally:
+            current_span.reset(token)
+            self.tracer.end(root)
@@ -0,0 +1,54 @@
+import asyncio
+import re
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.service.capture.traffic_recorder import TrafficRecorder, current_record
+
+# 需要录制的接口：聊天、内容生成和向量接口
+CAPTURE_PATH_MATCHER = re.compile(r".*(?:/chat/completions|:generateContent|:streamGenerateContent|/embeddings)$")
+
+# 查询参数中的密钥不写入录制文件
+KEY_QUERY_PATTERN = re.compile(r"(?:^|&)key=[^&]*")
+
+
+class TrafficCaptureMiddleware:
+    """
+    流量录制中间件
+
+    复制完整请求体并在响应结束后写入录制文件，上游调用的时序由 GeminiApiClient 登记到同一条记录
+    """
+
+    def __init__(self, app: ASGIApp, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not CAPTURE_PATH_MATCHER.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        query = KEY_QUERY_PATTERN.sub("", scope.get("query_string", b"").decode("latin-1")).lstrip("&")
+        record = self.recorder.begin(scope["method"], scope["path"], query)
+        if record is None:
+            await self.app(scope, receive, send)
+            return
+
+        body = bytearray()
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                record.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            current_record.set(None)
+            await asyncio.to_thread(self.recorder.write, record, bytes(body))
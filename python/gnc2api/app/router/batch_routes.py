@@ -0,0 +1,112 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi.responses import FileResponse
+
+from app.core.security import get_security_service
+from app.domain.openai_models import BatchRequest
+from app.exception.exceptions import ResourceNotFoundError
+from app.log.logger import get_batch_logger
+from app.service.admission.admission_controller import AdmissionTicket, require_admission
+from app.service.batch.batch_manager import batch_manager
+from app.service.batch.file_store import hash_token
+
+router = APIRouter()
+logger = get_batch_logger()
+
+security_service = get_security_service()
+
+
+@router.post("/v1/files")
+@router.post("/hf/v1/files")
+async def upload_file(
+    file: UploadFile = File(...),
+    purpose: str = Form(...),
+    token: str = Depends(security_service.verify_authorization),
+):
+    """上传文件，目前用于批处理的输入"""
+    logger.info("-" * 50 + "upload_file" + "-" * 50)
+    try:
+        return await batch_manager.files.save(file, purpose, hash_token(token))
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e)) from e
+
+
+@router.get("/v1/files")
+@router.get("/hf/v1/files")
+async def list_files(purpose: Optional[str] = None, token: str = Depends(security_service.verify_authorization)):
+    return {"object": "list", "data": batch_manager.files.list(hash_token(token), purpose)}
+
+
+@router.get("/v1/files/{file_id}")
+@router.get("/hf/v1/files/{file_id}")
+async def get_file(file_id: str, token: str = Depends(security_service.verify_authorization)):
+    meta = batch_manager.files.get(file_id, hash_token(token))
+    if meta is None:
+        raise ResourceNotFoundError(f"File {file_id} not found")
+    return meta
+
+
+@router.get("/v1/files/{file_id}/content")
+@router.get("/hf/v1/files/{file_id}/content")
+async def get_file_content(file_id: str, token: str = Depends(security_service.verify_authorization)):
+    meta = batch_manager.files.get(file_id, hash_token(token))
+    if meta is None:
+        raise ResourceNotFoundError(f"File {file_id} not found")
+    return FileResponse(batch_manager.files.path(file_id), media_type="application/jsonl", filename=meta["filename"])
+
+
+@router.delete("/v1/files/{file_id}")
+@router.delete("/hf/v1/files/{file_id}")
+async def delete_file(file_id: str, token: str = Depends(security_service.verify_authorization)):
+    if not batch_manager.files.delete(file_id, hash_token(token)):
+        raise ResourceNotFoundError(f"File {file_id} not found")
+    return {"id": file_id, "object": "file", "deleted": True}
+
+
+@router.post("/v1/batches")
+@router.post("/hf/v1/batches")
+async def create_batch(
+    request: BatchRequest,
+    ticket: AdmissionTicket = Depends(require_admission(security_service.verify_authorization, stream=False)),
+):
+    """创建批处理，请求在后台执行"""
+    logger.info("-" * 50 + "create_batch" + "-" * 50)
+    try:
+        return await batch_manager.create(request, ticket.token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+@router.get("/v1/batches")
+@router.get("/hf/v1/batches")
+async def list_batches(
+    limit: int = 20, after: Optional[str] = None, token: str = Depends(security_service.verify_authorization)
+):
+    batches = batch_manager.list(token, limit=limit + 1, after=after)
+    has_more, batches = len(batches) > limit, batches[:limit]
+    return {
+        "object": "list",
+        "data": batches,
+        "first_id": batches[0]["id"] if batches else None,
+        "last_id": batches[-1]["id"] if batches else None,
+        "has_more": has_more,
+    }
+
+
+@router.get("/v1/batches/{batch_id}")
+@router.get("/hf/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, token: str = Depends(security_service.verify_authorization)):
+    batch = batch_manager.get(batch_id, token)
+    if batch is None:
+        raise ResourceNotFoundError(f"Batch {batch_id} not found")
+    return batch
+
+
+@router.post("/v1/batches/{batch_id}/cancel")
+@router.post("/hf/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, token: str = Depends(security_service.verify_authorization)):
+    batch = await batch_manager.cancel(batch_id, token)
+    if batch is None:
+        raise ResourceNotFoundError(f"Batch {batch_id} not found")
+    return batch
@@ -2,17 +2,22 @@ import base64
 from copy import deepcopy
 from app.config.config import settings
 from app.log.logger import get_gemini_logger
-from app.core.security import SecurityService
+from app.service.admission.admission_controller import AdmissionTicket, check_inline_media, require_admission
+from app.core.security import get_security_service
+from app.core.tracing import span
 from app.domain.gemini_models import GeminiContent, GeminiRequest
+from app.exception.exceptions import ModelNotSupportedError, UpstreamDeadlineError
 from app.service.chat.gemini_chat_service import GeminiChatService
-from app.service.model.model_service import ModelService
+from app.service.model.model_service import get_model_service
 from app.handler.retry_handler import RetryHandler
 from app.core.constants import API_VERSION
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 
 from app.service.key.key_generator import get_key
+from app.utils.helpers import format_json_response, read_json_body, redact_inline_data
+from app.service.provider.affinity_router import extract_gemini_conversation_key
 from app.service.provider.provider_manager import ProviderManager, get_provider_manager_instance
 
 # 路由设置
@@ -21,19 +26,26 @@ router_v1beta = APIRouter(prefix=f"/{API_VERSION}")
 logger = get_gemini_logger()
 
 # 初始化服务
-security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN)
-model_service = ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS)
+security_service = get_security_service()
+model_service = get_model_service()
 
 
 async def get_provider_manager():
     return await get_provider_manager_instance()
 
 
-async def get_next_working_provider_wrapper(provider_manager: ProviderManager = Depends(get_provider_manager)):
-    return await provider_manager.get_next_working_provider()
-
+async def get_next_working_provider_wrapper(
+    request: Request, provider_manager: ProviderManager = Depends(get_provider_manager)
+):
+    affinity_key = None
+    if settings.AFFINITY_ROUTING_ENABLED:
+        affinity_key = extract_gemini_conversation_key(await read_json_body(request))
 
-model_service = ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS)
+    model = request.path_params.get("model_name")
+    with span("select_provider") as selection:
+        provider = await provider_manager.get_next_working_provider(model=model, affinity_key=affinity_key)
+        selection.set("provider", provider)
+    return provider
 
 
 @router.get("/models")
@@ -92,18 +104,20 @@ async def generate_content(
     model_name: str,
     request: GeminiRequest,
     _=Depends(security_service.verify_key_or_goog_api_key),
+    _media=Depends(check_inline_media),
     provider: str = Depends(get_next_working_provider_wrapper),
+    ticket: AdmissionTicket = Depends(require_admission(security_service.verify_key_or_goog_api_key, stream=False)),
     api_key: str = Depends(get_key),
     provider_manager: ProviderManager = Depends(get_provider_manager),
 ):
     """非流式生成内容"""
     logger.info("-" * 50 + "gemini_generate_content" + "-" * 50)
     logger.info(f"Handling Gemini content generation request for model: {model_name}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
+    logger.info(f"Request: \n{format_json_response(redact_inline_data(request.model_dump()))}")
     logger.info(f"Using API Provider: {provider}, API Key: {api_key}")
 
     if not model_service.check_model_support(model_name):
-        raise HTTPException(status_code=400, detail=f"Model {model_name} is not supported")
+        raise ModelNotSupportedError(model_name)
 
     try:
         chat_service = GeminiChatService(provider_manager)
@@ -114,6 +128,8 @@ async def generate_content(
             api_key=api_key,
         )
         return response
+    except UpstreamDeadlineError:
+        raise
     except Exception as e:
         logger.error(f"Chat completion failed after retries: {str(e)}")
         raise HTTPException(status_code=500, detail="Chat completion failed") from e
@@ -126,18 +142,21 @@ async def stream_generate_content(
     model_name: str,
     request: GeminiRequest,
     _=Depends(security_service.verify_key_or_goog_api_key),
+    _media=Depends(check_inline_media),
     provider: str = Depends(get_next_working_provider_wrapper),
+    ticket: AdmissionTicket = Depends(require_admission(security_service.verify_key_or_goog_api_key, stream=True)),
     api_key: str = Depends(get_key),
     provider_manager: ProviderManager = Depends(get_provider_manager),
 ):
     """流式生成内容"""
     logger.info("-" * 50 + "gemini_stream_generate_content" + "-" * 50)
     logger.info(f"Handling Gemini streaming content generation for model: {model_name}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
+    logger.info(f"Request: \n{format_json_response(redact_inline_data(request.model_dump()))}")
     logger.info(f"Using API Provider: {provider}, API Key: {api_key}")
 
     if not model_service.check_model_support(model_name):
-        raise HTTPException(status_code=400, detail=f"Model {model_name} is not supported")
+        ticket.release()
+        raise ModelNotSupportedError(model_name)
 
     try:
         chat_service = GeminiChatService(provider_manager)
@@ -147,8 +166,9 @@ async def stream_generate_content(
             request=request,
             api_key=api_key,
         )
-        return StreamingResponse(response_stream, media_type="text/event-stream")
+        return StreamingResponse(ticket.track(response_stream), media_type="text/event-stream")
     except Exception as e:
+        ticket.release()
         logger.error(f"Streaming request failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Streaming request failed") from e
 
@@ -164,7 +184,7 @@ async def verify_provider(provider: str):
     try:
         base_url = base64.b64decode(provider).decode(encoding="utf8")
         gemini_requset = GeminiRequest(contents=[GeminiContent(role="user", parts=[{"text": "hi"}])])
-        response = chat_service.generate_content(base_url, settings.TEST_MODEL, gemini_requset, get_key())
+        response = await chat_service.generate_content(base_url, settings.TEST_MODEL, gemini_requset, get_key())
         if response:
             return JSONResponse({"status": "valid"})
         return JSONResponse({"status": "invalid"})
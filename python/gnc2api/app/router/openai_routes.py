@@ -1,24 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
 from app.config.config import settings
-from app.core.security import SecurityService
-from app.domain.openai_models import ChatRequest, EmbeddingRequest
+from app.core.reload import reload_configuration, restart_workers
+from app.core.security import get_security_service
+from app.core.tracing import span
+from app.domain.openai_models import ChatRequest, EmbeddingRequest, ImageGenerationRequest
+from app.exception.exceptions import ModelNotSupportedError, UpstreamDeadlineError
+from app.handler.message_converter import OpenAIMessageConverter
 from app.handler.retry_handler import RetryHandler
 from app.log.logger import get_openai_logger
+from app.service.admission.admission_controller import AdmissionTicket, check_inline_media, require_admission
 from app.service.chat.openai_chat_service import OpenAIChatService
 from app.service.embedding.embedding_service import EmbeddingService
-from app.service.model.model_service import ModelService
+from app.service.image.image_create_service import ImageCreateService
+from app.service.model.model_service import get_model_service
 
 from app.service.key.key_generator import get_key
+from app.utils.helpers import format_json_response, read_json_body, redact_inline_data
 from app.service.provider.provider_manager import ProviderManager, get_provider_manager_instance
 
 router = APIRouter()
 logger = get_openai_logger()
 
 # 初始化服务
-security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN)
-model_service = ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS)
+security_service = get_security_service()
+model_service = get_model_service()
 embedding_service = EmbeddingService()
 
 
@@ -26,8 +33,21 @@ async def get_provider_manager():
     return await get_provider_manager_instance()
 
 
-async def get_next_working_provider_wrapper(provider_manager: ProviderManager = Depends(get_provider_manager)):
-    return await provider_manager.get_next_working_provider()
+async def get_next_working_provider_wrapper(
+    request: Request, provider_manager: ProviderManager = Depends(get_provider_manager)
+):
+    body = await read_json_body(request)
+    if not isinstance(body, dict):
+        body = {}
+
+    affinity_key = None
+    if settings.AFFINITY_ROUTING_ENABLED:
+        affinity_key = OpenAIMessageConverter().conversation_key(body.get("messages"))
+
+    with span("select_provider") as selection:
+        provider = await provider_manager.get_next_working_provider(model=body.get("model"), affinity_key=affinity_key)
+        selection.set("provider", provider)
+    return provider
 
 
 @router.get("/v1/models")
@@ -52,28 +72,35 @@ async def list_models(
 async def chat_completion(
     request: ChatRequest,
     _=Depends(security_service.verify_authorization),
+    _media=Depends(check_inline_media),
     provider: str = Depends(get_next_working_provider_wrapper),
+    ticket: AdmissionTicket = Depends(require_admission(security_service.verify_authorization)),
     api_key: str = Depends(get_key),
     provider_manager: ProviderManager = Depends(get_provider_manager),
 ):
     chat_service = OpenAIChatService(provider_manager)
     logger.info("-" * 50 + "chat_completion" + "-" * 50)
     logger.info(f"Handling chat completion request for model: {request.model}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
+    logger.info(f"Request: \n{format_json_response(redact_inline_data(request.model_dump()))}")
     logger.info(f"Using API Provider: {provider}, API Key: {api_key}")
 
     if not model_service.check_model_support(request.model):
-        raise HTTPException(status_code=400, detail=f"Model {request.model} is not supported")
+        ticket.release()
+        raise ModelNotSupportedError(request.model)
 
     try:
         response = await chat_service.create_chat_completion(provider, request, api_key)
 
         # 处理流式响应
         if request.stream:
-            return StreamingResponse(response, media_type="text/event-stream")
+            return StreamingResponse(ticket.track(response), media_type="text/event-stream")
         logger.info("Chat completion request successful")
         return response
+    except UpstreamDeadlineError:
+        ticket.release()
+        raise
     except Exception as e:
+        ticket.release()
         logger.error(f"Chat completion failed after retries: {str(e)}")
         raise HTTPException(status_code=500, detail="Chat completion failed") from e
 
@@ -83,6 +110,7 @@ async def chat_completion(
 async def embedding(
     request: EmbeddingRequest,
     _=Depends(security_service.verify_authorization),
+    ticket: AdmissionTicket = Depends(require_admission(security_service.verify_authorization, stream=False)),
     provider_manager: ProviderManager = Depends(get_provider_manager),
 ):
     logger.info("-" * 50 + "embedding" + "-" * 50)
@@ -103,6 +131,45 @@ async def embedding(
         raise HTTPException(status_code=500, detail="Embedding request failed") from e
 
 
+@router.post("/v1/images/generations")
+@router.post("/hf/v1/images/generations")
+async def generate_images(
+    request: ImageGenerationRequest,
+    _=Depends(security_service.verify_authorization),
+    ticket: AdmissionTicket = Depends(require_admission(security_service.verify_authorization, stream=False)),
+    provider_manager: ProviderManager = Depends(get_provider_manager),
+):
+    """并发生成多张图片，部分失败时返回成功的图片"""
+    logger.info("-" * 50 + "generate_images" + "-" * 50)
+    logger.info(f"Handling image generation request, n: {request.n}, size: {request.size}")
+    try:
+        return await ImageCreateService(provider_manager).generate_images(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except ModelNotSupportedError:
+        raise
+    except Exception as e:
+        logger.error(f"Image generation failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Image generation failed") from e
+
+
+@router.post("/v1/providers/reload")
+@router.post("/hf/v1/providers/reload")
+async def reload_providers(_=Depends(security_service.verify_auth_token)):
+    """重新读取配置，热更新API Provider列表和访问令牌；多 worker 时由主进程逐个重启 worker"""
+    logger.info("-" * 50 + "reload_providers" + "-" * 50)
+    try:
+        if restart_workers():
+            return {"status": "success", "data": {"workers_restarting": True}}
+        result = await reload_configuration()
+        return {"status": "success", "data": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except Exception as e:
+        logger.error(f"Error reloading providers: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error while reloading providers") from e
+
+
 @router.get("/v1/providers/list")
 @router.get("/hf/v1/providers/list")
 async def get_keys_list(
@@ -118,6 +185,8 @@ async def get_keys_list(
             "data": {
                 "valid_providers": providers_status["valid_providers"],
                 "invalid_providers": providers_status["invalid_providers"],
+                # 各Provider按阶段统计的上游超时次数和自适应时限
+                "deadlines": providers_status["deadlines"],
             },
             "total": len(providers_status["valid_providers"]) + len(providers_status["invalid_providers"]),
         }
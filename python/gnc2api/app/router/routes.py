@@ -8,7 +8,7 @@ from fastapi.templating import Jinja2Templates
 
 from app.core.security import verify_auth_token
 from app.log.logger import get_routes_logger
-from app.router import gemini_routes, openai_routes
+from app.router import batch_routes, gemini_routes, openai_routes, tracing_routes
 from app.service.provider.provider_manager import get_provider_manager_instance
 
 logger = get_routes_logger()
@@ -28,6 +28,8 @@ def setup_routers(app: FastAPI) -> None:
     app.include_router(openai_routes.router)
     app.include_router(gemini_routes.router)
     app.include_router(gemini_routes.router_v1beta)
+    app.include_router(batch_routes.router)
+    app.include_router(tracing_routes.router)
 
     # 添加页面路由
     setup_page_routes(app)
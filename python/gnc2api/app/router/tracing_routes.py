@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends
+
+from app.core.security import get_security_service
+from app.core.tracing import otlp_payload, tracer
+from app.exception.exceptions import ResourceNotFoundError
+
+router = APIRouter()
+
+security_service = get_security_service()
+
+
+@router.get("/v1/traces/slow")
+@router.get("/hf/v1/traces/slow")
+async def list_slow_traces(limit: int = 50, _=Depends(security_service.verify_auth_token)):
+    """最近耗时超过 TRACING_SLOW_THRESHOLD 的请求，按时间倒序"""
+    return {"object": "list", "data": tracer.slow_requests(limit), "stats": tracer.stats()}
+
+
+@router.get("/v1/traces/slow/{trace_id}")
+@router.get("/hf/v1/traces/slow/{trace_id}")
+async def get_slow_trace(trace_id: str, format: str = "timeline", _=Depends(security_service.verify_auth_token)):
+    """慢请求的完整时间线，format=otlp 时返回 OTLP JSON，可直接导入支持 OTLP 的追踪系统"""
+    trace = tracer.find(trace_id)
+    if trace is None:
+        raise ResourceNotFoundError(f"Trace {trace_id} not found")
+    if format == "otlp":
+        return otlp_payload([trace])
+    return trace.timeline()
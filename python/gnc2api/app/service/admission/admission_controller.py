@@ -0,0 +1,266 @@
+import math
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+from fastapi import Depends, Request
+
+from app.config.config import settings
+from app.exception.exceptions import PayloadTooLargeError, QuotaExceededError, RateLimitExceededError
+from app.log.logger import get_admission_logger
+from app.utils.helpers import read_json_body
+from app.utils.inline_media import inline_media_size
+
+logger = get_admission_logger()
+
+
+def _mask(token: str) -> str:
+    return f"{token[:6]}***" if len(token) > 6 else "***"
+
+
+def _seconds_until_utc_midnight() -> int:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, math.ceil((midnight - now).total_seconds()))
+
+
+class TokenLimits:
+    """单个令牌的限额，0 表示不限制"""
+
+    __slots__ = ("rpm", "burst", "streams", "daily_tokens")
+
+    def __init__(self, rpm: int = 0, burst: int = 0, streams: int = 0, daily_tokens: int = 0):
+        self.rpm = max(0, rpm)
+        self.burst = max(0, burst) or self.rpm
+        self.streams = max(0, streams)
+        self.daily_tokens = max(0, daily_tokens)
+
+
+class ClientState:
+    """单个令牌的运行时状态：令牌桶余量、进行中的流数量和当日已用token数"""
+
+    __slots__ = ("allowance", "updated_at", "streams", "day", "used_tokens")
+
+    def __init__(self, capacity: int):
+        self.allowance = float(capacity)
+        self.updated_at = time.monotonic()
+        self.streams = 0
+        self.day = ""
+        self.used_tokens = 0
+
+
+class AdmissionTicket:
+    """一次请求的准入凭证，流式请求持有一个并发名额，直到流结束时释放"""
+
+    __slots__ = ("controller", "token", "stream", "held")
+
+    def __init__(self, controller: "AdmissionController", token: str, stream: bool, held: bool):
+        self.controller = controller
+        self.token = token
+        self.stream = stream
+        self.held = held
+
+    def release(self) -> None:
+        """释放并发名额，可以重复调用"""
+        if self.held:
+            self.held = False
+            self.controller.release_stream(self.token)
+
+    async def track(self, stream: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """包装流式响应，流结束、出错或客户端断开时释放并发名额"""
+        if not self.held and self.stream:
+            # 路由重试前已经释放过名额，重新占用
+            self.held = True
+            self.controller.acquire_stream(self.token)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self.release()
+
+
+current_ticket: ContextVar[Optional[AdmissionTicket]] = ContextVar("current_ticket", default=None)
+
+
+class AdmissionController:
+    """
+    按访问令牌的准入控制
+
+    - 令牌桶限制请求速率（RATE_LIMIT_RPM，允许 RATE_LIMIT_BURST 的突发）
+    - 限制同一令牌同时进行的流式请求数（MAX_CONCURRENT_STREAMS）
+    - 按上游返回的 usageMetadata 统计每个令牌当日（UTC）消耗的token数（DAILY_TOKEN_QUOTA）
+
+    所有检查都是同步的，在事件循环中天然互斥，不需要加锁。状态只保存在当前进程内。
+    """
+
+    def __init__(self):
+        self.states: Dict[str, ClientState] = {}
+        self.update_limits(
+            enabled=settings.RATE_LIMIT_ENABLED,
+            rpm=settings.RATE_LIMIT_RPM,
+            burst=settings.RATE_LIMIT_BURST,
+            streams=settings.MAX_CONCURRENT_STREAMS,
+            daily_tokens=settings.DAILY_TOKEN_QUOTA,
+            overrides=settings.TOKEN_LIMITS,
+        )
+
+    def update_limits(
+        self,
+        enabled: bool,
+        rpm: int,
+        burst: int,
+        streams: int,
+        daily_tokens: int,
+        overrides: Dict[str, Dict[str, int]],
+    ) -> None:
+        """更新限额配置，已有令牌的用量和进行中的流不受影响"""
+        self.enabled = enabled
+        self.default_limits = TokenLimits(rpm, burst, streams, daily_tokens)
+        self.overrides = {
+            token: TokenLimits(
+                rpm=values.get("rpm", rpm),
+                # 只覆盖 rpm 时突发量随 rpm 变化
+                burst=values.get("burst", 0 if "rpm" in values else burst),
+                streams=values.get("streams", streams),
+                daily_tokens=values.get("daily_tokens", daily_tokens),
+            )
+            for token, values in (overrides or {}).items()
+        }
+
+    def limits_for(self, token: str) -> TokenLimits:
+        return self.overrides.get(token, self.default_limits)
+
+    def _state(self, token: str, limits: TokenLimits) -> ClientState:
+        state = self.states.get(token)
+        if state is None:
+            state = self.states[token] = ClientState(limits.burst)
+        return state
+
+    def _refill(self, state: ClientState, limits: TokenLimits) -> None:
+        now = time.monotonic()
+        state.allowance = min(limits.burst, state.allowance + (now - state.updated_at) * limits.rpm / 60)
+        state.updated_at = now
+
+    def _rollover(self, state: ClientState) -> None:
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if state.day != today:
+            state.day, state.used_tokens = today, 0
+
+    def admit(self, token: str, stream: bool = False) -> AdmissionTicket:
+        """
+        检查令牌是否可以发起新的请求，通过时扣减令牌桶并占用流式并发名额
+
+        Raises:
+            RateLimitExceededError: 请求速率或并发流数量超过限制
+            QuotaExceededError: 当日token配额已用完
+        """
+        if not self.enabled:
+            return AdmissionTicket(self, token, stream, held=False)
+
+        limits = self.limits_for(token)
+        state = self._state(token, limits)
+
+        if self.quota_exhausted(token):
+            logger.warning(f"Daily token quota exhausted for {_mask(token)}: {state.used_tokens}")
+            raise QuotaExceededError(retry_after=_seconds_until_utc_midnight())
+
+        if stream and limits.streams and state.streams >= limits.streams:
+            logger.warning(f"Too many concurrent streams for {_mask(token)}: {state.streams}")
+            raise RateLimitExceededError(f"Too many concurrent streams, limit is {limits.streams}", retry_after=1)
+
+        if limits.rpm:
+            self._refill(state, limits)
+            if state.allowance < 1:
+                retry_after = math.ceil((1 - state.allowance) * 60 / limits.rpm)
+                logger.warning(f"Request rate limit exceeded for {_mask(token)}")
+                raise RateLimitExceededError(retry_after=retry_after)
+            state.allowance -= 1
+
+        if stream:
+            state.streams += 1
+        return AdmissionTicket(self, token, stream, held=stream)
+
+    def quota_exhausted(self, token: str) -> bool:
+        """令牌当日的token配额是否已用完，不扣减请求速率，供批处理在派发每个请求前检查"""
+        if not self.enabled:
+            return False
+
+        limits = self.limits_for(token)
+        if not limits.daily_tokens:
+            return False
+
+        state = self._state(token, limits)
+        self._rollover(state)
+        return state.used_tokens >= limits.daily_tokens
+
+    def acquire_stream(self, token: str) -> None:
+        state = self.states.get(token)
+        if state is not None:
+            state.streams += 1
+
+    def release_stream(self, token: str) -> None:
+        state = self.states.get(token)
+        if state is not None and state.streams > 0:
+            state.streams -= 1
+
+    def charge(self, token: str, tokens: int) -> None:
+        """按上游实际消耗的token数计入当日用量"""
+        if not self.enabled or tokens <= 0:
+            return
+
+        limits = self.limits_for(token)
+        state = self._state(token, limits)
+        self._rollover(state)
+        state.used_tokens += tokens
+
+
+def record_usage(usage_metadata: Optional[Dict[str, Any]]) -> None:
+    """将上游返回的 usageMetadata 计入当前请求令牌的当日用量"""
+    ticket = current_ticket.get()
+    if ticket is not None and usage_metadata:
+        ticket.controller.charge(ticket.token, usage_metadata.get("totalTokenCount", 0))
+
+
+def require_admission(verify, stream: Optional[bool] = None):
+    """
+    创建准入检查依赖，在鉴权之后、调用上游之前执行
+
+    Args:
+        verify: 鉴权依赖，返回请求使用的访问令牌
+        stream: 是否为流式请求，为None时从请求体的 stream 字段判断
+    """
+
+    async def dependency(request: Request, token: str = Depends(verify)) -> AdmissionTicket:
+        is_stream = stream
+        if is_stream is None:
+            body = await read_json_body(request)
+            is_stream = isinstance(body, dict) and bool(body.get("stream"))
+
+        ticket = admission_controller.admit(token, is_stream)
+        current_ticket.set(ticket)
+        return ticket
+
+    return dependency
+
+
+async def check_inline_media(request: Request) -> None:
+    """
+    拒绝内嵌媒体总大小超过 MAX_INLINE_MEDIA_BYTES 的请求
+
+    只读取各个 base64 字符串的长度，不解码也不复制数据；放在准入检查之前执行，被拒绝的请求不占用名额
+
+    Raises:
+        PayloadTooLargeError: 内嵌媒体超过限制
+    """
+    limit = settings.MAX_INLINE_MEDIA_BYTES
+    if not limit:
+        return
+
+    size = inline_media_size(await read_json_body(request))
+    if size > limit:
+        logger.warning(f"Rejected request with {size} bytes of inline media, limit is {limit}")
+        raise PayloadTooLargeError(f"Inline media is about {size} bytes, exceeding the limit of {limit} bytes")
+
+
+admission_controller = AdmissionController()
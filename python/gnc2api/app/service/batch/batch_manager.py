@@ -0,0 +1,544 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from app.config.config import settings
+from app.core.constants import (
+    BATCH_CHECKPOINT_INTERVAL,
+    BATCH_LANE_POLL_INTERVAL,
+    BATCH_MAX_REQUESTS,
+    BATCH_OWNER_LOCK_FILE,
+    BATCH_OWNER_POLL_INTERVAL,
+)
+from app.core.security import get_security_service
+from app.domain.openai_models import BatchRequest, ChatRequest
+from app.exception.exceptions import ModelNotSupportedError, QuotaExceededError
+from app.log.logger import get_batch_logger
+from app.service.admission.admission_controller import AdmissionTicket, admission_controller, current_ticket
+from app.service.batch.file_store import FileStore, hash_token, public, write_json_atomic
+from app.service.chat.openai_chat_service import OpenAIChatService
+from app.service.client.client_pool import client_pool
+from app.service.key.key_generator import get_key
+from app.service.provider.provider_manager import ProviderManager
+
+logger = get_batch_logger()
+
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+
+def _try_lock(file) -> bool:
+    """以非阻塞方式对文件加排他锁，进程退出时由操作系统释放"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _read_checkpoint(path: Path) -> Set[str]:
+    """读取已写出的结果，去掉进程退出时可能写了一半的最后一行"""
+    if not path.exists():
+        return set()
+
+    done, valid_size = set(), 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["custom_id"])
+            except (ValueError, KeyError):
+                break
+            valid_size += len(line)
+
+    if valid_size < path.stat().st_size:
+        with open(path, "r+b") as f:
+            f.truncate(valid_size)
+    return done
+
+
+class BatchManager:
+    """
+    OpenAI Batch API 兼容的离线批处理
+
+    输入文件中的请求在后台以有限并发执行，走与 /v1/chat/completions 相同的 OpenAIChatService，
+    每个请求单独选择可用的Provider。结果逐行追加到输出文件，输出文件本身就是检查点，
+    进程重启后跳过已有结果的请求继续执行。
+
+    批处理属于低优先级流量：交互请求占用的上游连接数达到 BATCH_INTERACTIVE_THRESHOLD 时，
+    暂停派发新的批处理请求，已经发出的请求不受影响。
+
+    多 worker 运行时，持有存储目录文件锁的进程负责执行所有批处理，其余进程从磁盘读取批处理元数据，
+    新建的批处理和取消请求写入磁盘后由所有者进程定期接收；所有者进程退出后由其他进程接管。
+
+    批处理和文件只对创建它们的令牌可见。每个请求派发前检查创建者的每日token配额，
+    配额用完时停止派发，等已发出的请求完成后以 failed 状态结束，已有结果照常输出。
+    """
+
+    def __init__(self, directory: str, concurrency: int, interactive_threshold: int, max_file_size: int):
+        self.directory = Path(directory)
+        self.files = FileStore(str(self.directory / "files"), max_file_size)
+        self.concurrency = max(1, concurrency)
+        self.interactive_threshold = interactive_threshold
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # 正在执行的批处理请求数，用于从上游连接总数中区分出交互请求
+        self.in_flight = 0
+        self.provider_manager: Optional[ProviderManager] = None
+        # 持有的存储目录文件锁，非空表示当前进程是批处理的所有者
+        self.lock_file = None
+        self.watcher: Optional[asyncio.Task] = None
+
+    @property
+    def is_owner(self) -> bool:
+        return self.lock_file is not None
+
+    def _valid_id(self, batch_id: str) -> bool:
+        return batch_id.startswith("batch_") and batch_id[6:].isalnum()
+
+    def _meta_path(self, batch_id: str) -> Path:
+        return self.directory / f"{batch_id}.json"
+
+    def _cancel_path(self, batch_id: str) -> Path:
+        return self.directory / f"{batch_id}.cancel"
+
+    def _output_path(self, batch_id: str, kind: str) -> Path:
+        return self.directory / f"{batch_id}.{kind}.jsonl"
+
+    def _save(self, batch: Dict[str, Any]) -> None:
+        write_json_atomic(self._meta_path(batch["id"]), batch)
+
+    def _read(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        if not self._valid_id(batch_id):
+            return None
+        try:
+            with open(self._meta_path(batch_id), encoding="utf-8") as f:
+                batch = json.load(f)
+            return batch if batch.get("id") == batch_id else None
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.error(f"Failed to load batch metadata {batch_id}: {str(e)}")
+            return None
+
+    def _scan(self) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """读取尚未加载的批处理（如其他 worker 新建的）和待处理的取消请求"""
+        created = []
+        for path in self.directory.glob("batch_*.json"):
+            if path.stem not in self.batches:
+                batch = self._read(path.stem)
+                if batch:
+                    created.append(batch)
+        cancelled = [path.stem for path in self.directory.glob("batch_*.cancel")]
+        return created, cancelled
+
+    def _acquire(self) -> bool:
+        """尝试取得存储目录的文件锁"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.directory / BATCH_OWNER_LOCK_FILE, "a+")
+        if not _try_lock(lock_file):
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def _release(self) -> None:
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def _owner_token(self, batch: Dict[str, Any]) -> Optional[str]:
+        """找到创建批处理的令牌，用于计入其token用量"""
+        owner = batch.get("_owner")
+        security_service = get_security_service()
+        for token in (*security_service.allowed_tokens, security_service.auth_token):
+            if token and hash_token(token) == owner:
+                return token
+        return None
+
+    async def start(self, provider_manager: ProviderManager) -> None:
+        """尝试成为批处理的所有者并恢复未完成的批处理，之后在后台定期同步"""
+        self.provider_manager = provider_manager
+        if not await self._take_over():
+            logger.info(f"Batch storage {self.directory} is owned by another worker")
+        self.watcher = asyncio.create_task(self._watch())
+
+    async def _take_over(self) -> bool:
+        """取得文件锁后加载磁盘上的批处理，并恢复未完成的批处理"""
+        if not await asyncio.to_thread(self._acquire):
+            return False
+
+        logger.info(f"Process {os.getpid()} owns batch storage {self.directory}")
+        await self._sync()
+        return True
+
+    async def _sync(self) -> None:
+        """所有者进程接收其他 worker 新建的批处理和取消请求"""
+        created, cancelled = await asyncio.to_thread(self._scan)
+        for batch in created:
+            if batch["id"] in self.batches:
+                continue
+            self.batches[batch["id"]] = batch
+            if batch["status"] in ACTIVE_STATUSES:
+                logger.info(f"Running batch {batch['id']}, status: {batch['status']}")
+                self._spawn(batch)
+
+        for batch_id in cancelled:
+            batch = self.batches.get(batch_id)
+            if batch is not None:
+                await self._cancel(batch)
+            self._cancel_path(batch_id).unlink(missing_ok=True)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(BATCH_OWNER_POLL_INTERVAL)
+            try:
+                if self.is_owner:
+                    await self._sync()
+                else:
+                    await self._take_over()
+            except Exception as e:
+                logger.error(f"Failed to sync batches: {str(e)}")
+
+    async def stop(self) -> None:
+        """停止后台任务并释放文件锁，进度已写入磁盘，由下一个所有者继续"""
+        tasks = list(self.tasks.values())
+        if self.watcher is not None:
+            tasks.append(self.watcher)
+            self.watcher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._release()
+
+    def _spawn(self, batch: Dict[str, Any]) -> None:
+        task = asyncio.create_task(self._run(batch))
+        self.tasks[batch["id"]] = task
+        task.add_done_callback(lambda _: self.tasks.pop(batch["id"], None))
+
+    async def create(self, request: BatchRequest, token: str) -> Dict[str, Any]:
+        """
+        创建批处理
+
+        Raises:
+            ValueError: 参数无效或输入文件不存在
+        """
+        if request.endpoint not in SUPPORTED_ENDPOINTS:
+            raise ValueError(f"Unsupported endpoint {request.endpoint}, supported: {', '.join(SUPPORTED_ENDPOINTS)}")
+        if request.completion_window != "24h":
+            raise ValueError("completion_window must be 24h")
+
+        owner = hash_token(token)
+        input_file = self.files.get(request.input_file_id, owner)
+        if input_file is None:
+            raise ValueError(f"Input file {request.input_file_id} not found")
+        if input_file["purpose"] != "batch":
+            raise ValueError(f"Input file {request.input_file_id} must have purpose batch")
+
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": request.endpoint,
+            "errors": None,
+            "input_file_id": request.input_file_id,
+            "completion_window": request.completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + 24 * 3600,
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.metadata,
+            "_owner": owner,
+        }
+        await asyncio.to_thread(self._save, batch)
+        if self.is_owner:
+            self.batches[batch["id"]] = batch
+            self._spawn(batch)
+        logger.info(f"Created batch {batch['id']} from file {request.input_file_id}")
+        return public(batch)
+
+    def _owned(self, batch_id: str, token: str) -> Optional[Dict[str, Any]]:
+        # 所有者进程内存中的状态最新，其余情况读取磁盘上的元数据
+        batch = self.batches.get(batch_id) or self._read(batch_id)
+        return batch if batch and batch.get("_owner") == hash_token(token) else None
+
+    def get(self, batch_id: str, token: str) -> Optional[Dict[str, Any]]:
+        """返回批处理，不存在或不属于该令牌时返回None"""
+        batch = self._owned(batch_id, token)
+        return public(batch) if batch else None
+
+    def list(self, token: str, limit: int = 20, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        owner = hash_token(token)
+        batches = {}
+        for path in self.directory.glob("batch_*.json"):
+            batch = self.batches.get(path.stem) or self._read(path.stem)
+            if batch and batch.get("_owner") == owner:
+                batches[batch["id"]] = batch
+        batches = sorted(batches.values(), key=lambda b: b["created_at"], reverse=True)
+        if after:
+            ids = [b["id"] for b in batches]
+            batches = batches[ids.index(after) + 1 :] if after in ids else []
+        return [public(b) for b in batches[:limit]]
+
+    async def cancel(self, batch_id: str, token: str) -> Optional[Dict[str, Any]]:
+        """取消批处理，已经完成的结果仍会写入输出文件"""
+        batch = self._owned(batch_id, token)
+        if batch is None:
+            return None
+
+        if self.is_owner and batch_id in self.batches:
+            await self._cancel(batch)
+        elif batch["status"] in ("validating", "in_progress"):
+            # 由所有者进程执行取消
+            await asyncio.to_thread(self._cancel_path(batch_id).touch)
+            batch = {**batch, "status": "cancelling", "cancelling_at": int(time.time())}
+        return public(batch)
+
+    async def _cancel(self, batch: Dict[str, Any]) -> None:
+        if batch["status"] in ("validating", "in_progress"):
+            batch["status"], batch["cancelling_at"] = "cancelling", int(time.time())
+            await asyncio.to_thread(self._save, batch)
+            task = self.tasks.get(batch["id"])
+            if task is not None:
+                task.cancel()
+
+    def _validate(self, batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """校验输入文件的每一行，返回错误列表"""
+        errors, custom_ids = [], set()
+        with open(self.files.path(batch["input_file_id"]), encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    errors.append({"code": "invalid_json_line", "message": "Line is not valid JSON", "line": line_no})
+                    continue
+
+                custom_id = item.get("custom_id") if isinstance(item, dict) else None
+                if not isinstance(custom_id, str) or not custom_id:
+                    errors.append({"code": "missing_custom_id", "message": "custom_id is required", "line": line_no})
+                elif custom_id in custom_ids:
+                    errors.append({"code": "duplicate_custom_id", "message": "Duplicate custom_id", "line": line_no})
+                elif item.get("method", "POST") != "POST" or item.get("url") != batch["endpoint"]:
+                    errors.append(
+                        {"code": "invalid_url", "message": f"url must be {batch['endpoint']}", "line": line_no}
+                    )
+                elif not isinstance(item.get("body"), dict):
+                    errors.append({"code": "invalid_body", "message": "body must be an object", "line": line_no})
+                custom_ids.add(custom_id)
+
+                if len(errors) >= 100:
+                    break
+
+        if not custom_ids and not errors:
+            errors.append({"code": "empty_file", "message": "Input file contains no requests", "line": None})
+        elif len(custom_ids) > BATCH_MAX_REQUESTS:
+            errors.append(
+                {"code": "too_many_requests", "message": f"Batch exceeds {BATCH_MAX_REQUESTS} requests", "line": None}
+            )
+
+        batch["request_counts"]["total"] = len(custom_ids)
+        return errors
+
+    async def _wait_for_lane(self) -> None:
+        """交互请求繁忙时让路"""
+        if self.interactive_threshold <= 0:
+            return
+        while client_pool.total_in_flight() - self.in_flight >= self.interactive_threshold:
+            await asyncio.sleep(BATCH_LANE_POLL_INTERVAL)
+
+    async def _execute(self, body: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """执行单个请求，返回 (response, error)"""
+        try:
+            request = ChatRequest(**{**body, "stream": False})
+        except ValidationError as e:
+            return None, {"code": "invalid_request", "message": str(e)}
+
+        chat_service = OpenAIChatService(self.provider_manager)
+        last_error = None
+        self.in_flight += 1
+        try:
+            provider = await self.provider_manager.get_next_working_provider(model=request.model)
+            for _ in range(3):
+                try:
+                    response = await chat_service.create_chat_completion(provider, request, get_key())
+                    return {"status_code": 200, "request_id": f"req_{uuid.uuid4().hex}", "body": response}, None
+                except Exception as e:
+                    last_error = e
+                    provider = await self.provider_manager.handle_request_failure(provider, request.model, e)
+        except ModelNotSupportedError as e:
+            return None, {"code": e.error_code, "message": e.detail}
+        finally:
+            self.in_flight -= 1
+
+        return None, {"code": "upstream_error", "message": str(last_error)}
+
+    async def _process(self, batch: Dict[str, Any], owner: Optional[str]) -> None:
+        """
+        执行批处理中尚未完成的请求
+
+        Raises:
+            QuotaExceededError: 创建者的每日token配额已用完，已发出的请求完成后抛出
+        """
+        batch_id = batch["id"]
+        counts = batch["request_counts"]
+        output_path, error_path = self._output_path(batch_id, "output"), self._output_path(batch_id, "error")
+
+        completed = await asyncio.to_thread(_read_checkpoint, output_path)
+        failed = await asyncio.to_thread(_read_checkpoint, error_path)
+        counts["completed"], counts["failed"] = len(completed), len(failed)
+        done = completed | failed
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: Set[asyncio.Task] = set()
+        last_saved = time.monotonic()
+        exhausted = False
+
+        async def run_one(item: Dict[str, Any]) -> None:
+            nonlocal last_saved
+            try:
+                response, error = await self._execute(item["body"])
+                result = {
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": item["custom_id"],
+                    "response": response,
+                    "error": error,
+                }
+                # 单行写入很小，直接在事件循环中写并刷新，保证检查点及时落盘
+                target = error_file if error else output_file
+                target.write(json.dumps(result, ensure_ascii=False) + "\n")
+                target.flush()
+                counts["failed" if error else "completed"] += 1
+
+                if time.monotonic() - last_saved >= BATCH_CHECKPOINT_INTERVAL:
+                    last_saved = time.monotonic()
+                    self._save(batch)
+            finally:
+                semaphore.release()
+
+        with open(output_path, "a", encoding="utf-8") as output_file, open(
+            error_path, "a", encoding="utf-8"
+        ) as error_file, open(self.files.path(batch["input_file_id"]), encoding="utf-8") as input_file:
+            try:
+                for line in input_file:
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    if item["custom_id"] in done:
+                        continue
+
+                    await semaphore.acquire()
+                    await self._wait_for_lane()
+                    if owner and admission_controller.quota_exhausted(owner):
+                        semaphore.release()
+                        exhausted = True
+                        break
+
+                    task = asyncio.create_task(run_one(item))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+
+                if pending:
+                    await asyncio.gather(*pending)
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if exhausted:
+            raise QuotaExceededError()
+
+    async def _finalize(self, batch: Dict[str, Any], status: str) -> None:
+        """把输出文件移入文件存储，更新批处理状态"""
+        batch_id = batch["id"]
+        if status == "completed":
+            batch["status"], batch["finalizing_at"] = "finalizing", int(time.time())
+            await asyncio.to_thread(self._save, batch)
+
+        for kind, key, count in (("output", "output_file_id", "completed"), ("error", "error_file_id", "failed")):
+            path = self._output_path(batch_id, kind)
+            if batch["request_counts"][count] and path.exists() and not batch[key]:
+                meta = await asyncio.to_thread(
+                    self.files.adopt, path, f"{batch_id}_{kind}.jsonl", f"batch_{kind}", batch["_owner"]
+                )
+                batch[key] = meta["id"]
+            else:
+                path.unlink(missing_ok=True)
+
+        batch["status"] = status
+        batch[f"{status}_at"] = int(time.time())
+        await asyncio.to_thread(self._save, batch)
+        logger.info(f"Batch {batch_id} {status}, request counts: {batch['request_counts']}")
+
+    async def _run(self, batch: Dict[str, Any]) -> None:
+        owner = self._owner_token(batch)
+        if owner:
+            # 批处理消耗的token计入创建者的每日配额
+            current_ticket.set(AdmissionTicket(admission_controller, owner, stream=False, held=False))
+
+        try:
+            if batch["status"] == "validating":
+                errors = await asyncio.to_thread(self._validate, batch)
+                if errors:
+                    batch["errors"] = {"object": "list", "data": errors}
+                    batch["status"], batch["failed_at"] = "failed", int(time.time())
+                    await asyncio.to_thread(self._save, batch)
+                    logger.warning(f"Batch {batch['id']} failed validation with {len(errors)} errors")
+                    return
+                batch["status"], batch["in_progress_at"] = "in_progress", int(time.time())
+                await asyncio.to_thread(self._save, batch)
+
+            if batch["status"] == "in_progress":
+                await self._process(batch, owner)
+
+            await self._finalize(batch, "cancelled" if batch["status"] == "cancelling" else "completed")
+        except QuotaExceededError as e:
+            logger.warning(f"Batch {batch['id']} stopped, owner's daily token quota is exhausted")
+            batch["errors"] = {"object": "list", "data": [{"code": e.error_code, "message": e.detail, "line": None}]}
+            await self._finalize(batch, "failed")
+        except asyncio.CancelledError:
+            if batch["status"] == "cancelling":
+                await self._finalize(batch, "cancelled")
+            else:
+                # 进程退出，保存进度后下次启动继续
+                await asyncio.to_thread(self._save, batch)
+                raise
+        except Exception as e:
+            logger.exception(f"Batch {batch['id']} failed: {str(e)}")
+            batch["errors"] = {"object": "list", "data": [{"code": "batch_failed", "message": str(e), "line": None}]}
+            batch["status"], batch["failed_at"] = "failed", int(time.time())
+            await asyncio.to_thread(self._save, batch)
+
+
+batch_manager = BatchManager(
+    directory=settings.BATCH_STORAGE_DIR,
+    concurrency=settings.BATCH_CONCURRENCY,
+    interactive_threshold=settings.BATCH_INTERACTIVE_THRESHOLD,
+    max_file_size=settings.BATCH_MAX_FILE_SIZE,
+)
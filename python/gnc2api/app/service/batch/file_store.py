@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fastapi import UploadFile
+
+from app.log.logger import get_batch_logger
+
+logger = get_batch_logger()
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_token(token: str) -> str:
+    """访问令牌的摘要，作为文件和批处理的所有者，不在磁盘上保存令牌原文"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def public(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉以下划线开头的内部字段"""
+    return {k: v for k, v in meta.items() if not k.startswith("_")}
+
+
+def write_json_atomic(path: Path, data: Dict[str, Any]) -> None:
+    """先写临时文件再替换，进程中途退出时不会留下写了一半的文件"""
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class FileStore:
+    """
+    OpenAI Files API 兼容的本地文件存储
+
+    每个文件保存为 <id>.jsonl，元数据保存在同名的 .json 文件中。
+    元数据记录上传者令牌的摘要，查询、下载和删除只对所有者可见
+    """
+
+    def __init__(self, directory: str, max_file_size: int):
+        self.directory = Path(directory)
+        self.max_file_size = max_file_size
+
+    def path(self, file_id: str) -> Path:
+        return self.directory / f"{file_id}.jsonl"
+
+    def _meta_path(self, file_id: str) -> Path:
+        return self.directory / f"{file_id}.json"
+
+    def _valid_id(self, file_id: str) -> bool:
+        return file_id.startswith("file-") and file_id[5:].isalnum()
+
+    def _register(self, file_id: str, filename: str, purpose: str, owner: str) -> Dict[str, Any]:
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": self.path(file_id).stat().st_size,
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "_owner": owner,
+        }
+        write_json_atomic(self._meta_path(file_id), meta)
+        return public(meta)
+
+    async def save(self, upload: UploadFile, purpose: str, owner: str) -> Dict[str, Any]:
+        """
+        分块写入上传的文件，不在内存中保留完整内容
+
+        Raises:
+            ValueError: 文件超过大小限制
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        file_id = f"file-{uuid.uuid4().hex}"
+        path = self.path(file_id)
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise ValueError(f"File exceeds the maximum size of {self.max_file_size} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+
+        meta = await asyncio.to_thread(self._register, file_id, upload.filename or file_id, purpose, owner)
+        logger.info(f"Stored file {file_id}, purpose: {purpose}, bytes: {size}")
+        return meta
+
+    def adopt(self, source: Path, filename: str, purpose: str, owner: str) -> Dict[str, Any]:
+        """把已经写好的文件（如批处理的输出）移入存储"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        file_id = f"file-{uuid.uuid4().hex}"
+        os.replace(source, self.path(file_id))
+        return self._register(file_id, filename, purpose, owner)
+
+    def _read(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not self._valid_id(file_id):
+            return None
+        try:
+            with open(self._meta_path(file_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def get(self, file_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        """返回文件元数据，文件不存在或不属于 owner 时返回None"""
+        meta = self._read(file_id)
+        if meta is None or meta.get("_owner") != owner:
+            return None
+        return public(meta)
+
+    def list(self, owner: str, purpose: Optional[str] = None) -> List[Dict[str, Any]]:
+        if not self.directory.exists():
+            return []
+
+        files = []
+        for meta_path in self.directory.glob("file-*.json"):
+            meta = self.get(meta_path.stem, owner)
+            if meta and (purpose is None or meta.get("purpose") == purpose):
+                files.append(meta)
+        return sorted(files, key=lambda m: m["created_at"], reverse=True)
+
+    def delete(self, file_id: str, owner: str) -> bool:
+        if self.get(file_id, owner) is None:
+            return False
+        self.path(file_id).unlink(missing_ok=True)
+        self._meta_path(file_id).unlink(missing_ok=True)
+        return True
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.config.config import settings
+from app.core.constants import (
+    DEFAULT_CONTEXT_CACHE_FAILURE_COOLDOWN,
+    DEFAULT_CONTEXT_CACHE_MAX_ENTRIES,
+    DEFAULT_CONTEXT_CACHE_PRUNE_INTERVAL,
+    DEFAULT_CONTEXT_CACHE_REFRESH_MARGIN,
+)
+from app.core.tracing import traced
+from app.log.logger import get_context_cache_logger
+from app.service.client.api_client import GeminiApiClient
+from app.service.provider.model_catalog import normalize_model
+from app.utils.inline_media import InlineMedia
+
+logger = get_context_cache_logger()
+
+# 可以放入缓存的前缀字段，请求引用缓存后不能再携带这些字段
+CACHEABLE_FIELDS = ("systemInstruction", "tools", "toolConfig")
+
+
+def _media_value(value: Any) -> str:
+    if isinstance(value, InlineMedia):
+        return value.value()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@dataclass
+class CacheEntry:
+    """上游 cachedContents 条目"""
+
+    name: str
+    expire_at: float
+    tokens: int
+
+
+class ContextCacheManager:
+    """
+    Gemini 上下文缓存管理器
+
+    对重复出现的长前缀（系统指令和工具声明）在每个API Provider上创建 cachedContents，
+    后续请求改为引用缓存名称，从而减少上游的首字延迟和输入token费用。
+    缓存按 TTL 管理，临近过期且仍在使用时自动续期；本地记录按 LRU 限制数量，并定期清理过期条目和空闲锁。
+    """
+
+    def __init__(
+        self,
+        api_client: GeminiApiClient,
+        min_tokens: int,
+        min_hits: int,
+        ttl: int,
+        refresh_margin: int = DEFAULT_CONTEXT_CACHE_REFRESH_MARGIN,
+        failure_cooldown: int = DEFAULT_CONTEXT_CACHE_FAILURE_COOLDOWN,
+        max_entries: int = DEFAULT_CONTEXT_CACHE_MAX_ENTRIES,
+        prune_interval: int = DEFAULT_CONTEXT_CACHE_PRUNE_INTERVAL,
+    ):
+        self.api_client = api_client
+        self.min_tokens = max(1, min_tokens)
+        self.min_hits = max(1, min_hits)
+        self.ttl = max(60, ttl)
+        self.refresh_margin = max(0, min(refresh_margin, self.ttl // 2))
+        self.failure_cooldown = max(0, failure_cooldown)
+        self.max_entries = max(1, max_entries)
+        self.prune_interval = max(1, prune_interval)
+        self.pruned_at = time.monotonic()
+
+        # (provider, digest) -> CacheEntry，按最近使用排序
+        self.entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        # digest -> (出现次数, 最近出现时间)，按最近出现排序
+        self.sightings: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        # (provider, digest) -> 创建失败后禁止重试的截止时间
+        self.failures: Dict[tuple[str, str], float] = {}
+        self.locks: Dict[tuple[str, str], asyncio.Lock] = {}
+        # (provider, digest) -> 正在持有或等待锁的协程数
+        self.lock_users: Dict[tuple[str, str], int] = {}
+
+    def _digest(self, model: str, prefix: Dict[str, Any]) -> Optional[str]:
+        """计算前缀摘要，前缀过短时返回None"""
+        # 系统指令中的内嵌图片（InlineMedia）按完整内容参与摘要
+        content = json.dumps(prefix, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=_media_value)
+
+        # 粗略估算token数量，约4个字符对应1个token
+        if len(content) // 4 < self.min_tokens:
+            return None
+
+        return hashlib.sha256(f"{model}\n{content}".encode("utf-8")).hexdigest()
+
+    def _seen_enough(self, digest: str, now: float) -> bool:
+        """记录前缀出现次数，只有在TTL窗口内重复出现才值得缓存"""
+        count, last_seen = self.sightings.get(digest, (0, 0.0))
+        count = count + 1 if now - last_seen <= self.ttl else 1
+        self.sightings[digest] = (count, now)
+        self.sightings.move_to_end(digest)
+
+        # 防止摘要记录无限增长，淘汰最久未出现的前缀
+        while len(self.sightings) > self.max_entries * 4:
+            self.sightings.popitem(last=False)
+
+        return count >= self.min_hits
+
+    def _prune(self, now: float) -> None:
+        """清理过期的缓存条目、失败冷却和摘要记录，并丢弃未被持有的锁"""
+        if now - self.pruned_at < self.prune_interval:
+            return
+        self.pruned_at = now
+
+        for key in [k for k, v in self.entries.items() if v.expire_at <= now]:
+            self.entries.pop(key, None)
+        for key in [k for k, v in self.failures.items() if v <= now]:
+            self.failures.pop(key, None)
+
+        # sightings 按最近出现排序，从头部清理超出 TTL 窗口的记录即可
+        while self.sightings and now - next(iter(self.sightings.values()))[1] > self.ttl:
+            self.sightings.popitem(last=False)
+
+        # 没有协程持有或等待的锁可以安全丢弃，下次使用时重新创建
+        for key in [k for k in self.locks if not self.lock_users.get(k)]:
+            self.locks.pop(key, None)
+
+    def _store(self, key: tuple[str, str], entry: CacheEntry) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        # 超出数量时淘汰最久未使用的条目，上游缓存由 TTL 自然过期
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _rewrite(self, payload: Dict[str, Any], entry: CacheEntry) -> Dict[str, Any]:
+        request_payload = {k: v for k, v in payload.items() if k not in CACHEABLE_FIELDS}
+        request_payload["cachedContent"] = entry.name
+        return request_payload
+
+    @traced("context_cache.create")
+    async def _create(self, base_url: str, model: str, prefix: Dict[str, Any], api_key: str, now: float) -> CacheEntry:
+        body = {"model": f"models/{normalize_model(model)}", "ttl": f"{self.ttl}s", **prefix}
+        response = await self.api_client.create_cached_content(base_url, body, api_key)
+
+        name = response.get("name", "")
+        if not name:
+            raise Exception(f"Invalid cachedContents response: {response}")
+
+        tokens = response.get("usageMetadata", {}).get("totalTokenCount", 0)
+        logger.info(f"Created cached content {name} on {base_url}, tokens: {tokens}")
+        return CacheEntry(name=name, expire_at=now + self.ttl, tokens=tokens)
+
+    @traced("context_cache.refresh")
+    async def _refresh(self, base_url: str, entry: CacheEntry, api_key: str, now: float) -> None:
+        try:
+            await self.api_client.update_cached_content(base_url, entry.name, f"{self.ttl}s", api_key)
+            entry.expire_at = now + self.ttl
+            logger.debug(f"Refreshed cached content {entry.name} on {base_url}")
+        except Exception as e:
+            logger.warning(f"Failed to refresh cached content {entry.name}: {str(e)}")
+
+    async def apply(self, base_url: str, model: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """
+        尝试将请求改写为引用上游缓存
+
+        Args:
+            base_url: API Provider地址
+            model: 模型名称
+            payload: 原始请求payload，不会被修改
+            api_key: API密钥
+
+        Returns:
+            Dict[str, Any]: 改写后的payload，不满足缓存条件或缓存不可用时返回原始payload
+        """
+        if not settings.CONTEXT_CACHE_ENABLED or not payload or payload.get("cachedContent"):
+            return payload
+
+        prefix = {k: payload[k] for k in CACHEABLE_FIELDS if payload.get(k)}
+        if not prefix.get("systemInstruction"):
+            return payload
+
+        digest = self._digest(model, prefix)
+        if not digest:
+            return payload
+
+        now, key = time.monotonic(), (base_url, digest)
+        self._prune(now)
+        if not self._seen_enough(digest, now) or self.failures.get(key, 0) > now:
+            return payload
+
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.lock_users[key] = self.lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                entry = self.entries.get(key)
+                if entry:
+                    self.entries.move_to_end(key)
+                if entry and entry.expire_at - now > self.refresh_margin:
+                    return self._rewrite(payload, entry)
+
+                if entry and entry.expire_at > now:
+                    await self._refresh(base_url, entry, api_key, now)
+                    if entry.expire_at > now:
+                        return self._rewrite(payload, entry)
+
+                try:
+                    entry = await self._create(base_url, model, prefix, api_key, now)
+                    self._store(key, entry)
+                    self.failures.pop(key, None)
+                    return self._rewrite(payload, entry)
+                except Exception as e:
+                    self.entries.pop(key, None)
+                    self.failures[key] = now + self.failure_cooldown
+                    logger.warning(f"Failed to create cached content on {base_url}: {str(e)}")
+                    return payload
+        finally:
+            users = self.lock_users.pop(key, 1) - 1
+            if users > 0:
+                self.lock_users[key] = users
+
+    def handle_error(self, base_url: str, payload: Dict[str, Any], error: Exception) -> bool:
+        """
+        上游报告缓存失效时移除对应条目，并在冷却期内不再为该前缀创建缓存
+
+        Args:
+            base_url: API Provider地址
+            payload: 实际发送的payload
+            error: 上游返回的异常
+
+        Returns:
+            bool: 失败是否由缓存失效引起，是则可以直接使用原始payload重试
+        """
+        name = payload.get("cachedContent") if payload else None
+        if not name or "cachedcontent" not in str(error).lower():
+            return False
+
+        now = time.monotonic()
+        for key, entry in list(self.entries.items()):
+            if key[0] == base_url and entry.name == name:
+                self.entries.pop(key, None)
+                self.failures[key] = now + self.failure_cooldown
+                logger.warning(f"Cached content {name} on {base_url} is no longer available")
+
+        return True
+
+
+context_cache_manager = ContextCacheManager(
+    api_client=GeminiApiClient(settings.X_GOOG_API_CLIENT, timeout=settings.MAX_TIMEOUT),
+    min_tokens=settings.CONTEXT_CACHE_MIN_TOKENS,
+    min_hits=settings.CONTEXT_CACHE_MIN_HITS,
+    ttl=settings.CONTEXT_CACHE_TTL,
+)
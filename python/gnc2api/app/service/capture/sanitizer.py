@@ -0,0 +1,114 @@
+"""
+流量录制的脱敏工具
+
+录制文件只保留请求的结构和大小：文本按字符替换为占位符，二进制数据只记录长度，
+回放时再按长度还原出等大的内容。该模块不依赖应用配置，可被模拟上游直接导入。
+"""
+
+import hashlib
+import json
+import re
+from typing import Any
+
+from app.utils.inline_media import InlineMedia
+
+# 保持原值的字段，这些字段决定请求的路由和处理逻辑，不包含用户内容
+PRESERVED_KEYS = frozenset(
+    {
+        "model",
+        "role",
+        "type",
+        "mime_type",
+        "mimeType",
+        "stream",
+        "finish_reason",
+        "finishReason",
+        "responseModalities",
+        "category",
+        "threshold",
+        "detail",
+        "encoding_format",
+        "response_format",
+        "size",
+        "quality",
+        "style",
+    }
+)
+
+# 二进制数据在录制文件中的占位符: <<blob:长度>>
+BLOB_PATTERN = re.compile(r"^<<blob:(\d+)>>$")
+DATA_URL_PATTERN = re.compile(r"^(data:[\w/+.-]+;base64,)")
+
+# 超过该长度且只由 base64 字符组成的字符串视为二进制数据
+BLOB_MIN_LENGTH = 256
+BASE64_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=")
+
+
+def _redact_text(text: str) -> str:
+    """保留长度和空白字符，其余字符统一替换，使回放请求与原始请求大小一致"""
+    return "".join(c if c.isspace() else "x" for c in text)
+
+
+def _sanitize_str(value: str) -> str:
+    if BLOB_PATTERN.match(value):
+        return value
+
+    match = DATA_URL_PATTERN.match(value)
+    if match:
+        return f"{match.group(1)}<<blob:{len(value) - match.end()}>>"
+
+    head = value[:BLOB_MIN_LENGTH]
+    if len(value) >= BLOB_MIN_LENGTH and BASE64_CHARS.issuperset(head) and head.strip("x"):
+        return f"<<blob:{len(value)}>>"
+
+    return _redact_text(value)
+
+
+def sanitize(payload: Any, key: str = "") -> Any:
+    """
+    脱敏请求内容
+
+    Args:
+        payload: 请求体（已解析的JSON）
+        key: 当前值所在的字段名
+
+    Returns:
+        Any: 脱敏后的请求体，结构和各字段长度与原始请求一致
+    """
+    if isinstance(payload, dict):
+        return {k: sanitize(v, k) for k, v in payload.items()}
+    if isinstance(payload, list):
+        return [sanitize(v, key) for v in payload]
+    if isinstance(payload, InlineMedia):
+        return f"<<blob:{len(payload)}>>"
+    if isinstance(payload, str) and key not in PRESERVED_KEYS:
+        return _sanitize_str(payload)
+    return payload
+
+
+def restore(payload: Any) -> Any:
+    """将脱敏数据中的二进制占位符还原为等长的 base64 内容"""
+    if isinstance(payload, dict):
+        return {k: restore(v) for k, v in payload.items()}
+    if isinstance(payload, list):
+        return [restore(v) for v in payload]
+    if isinstance(payload, str) and "<<blob:" in payload:
+        prefix, _, rest = payload.partition("<<blob:")
+        match = BLOB_PATTERN.match(f"<<blob:{rest}")
+        if match:
+            return prefix + "A" * int(match.group(1))
+    return payload
+
+
+def digest(payload: Any) -> str:
+    """
+    计算上游请求的摘要，用于回放时将上游请求与录制的时序对应起来
+
+    对原始请求和回放请求分别脱敏后得到的摘要相同
+    """
+    if isinstance(payload, dict):
+        # 缓存名称每次创建都不同，不参与摘要
+        payload = {k: v for k, v in payload.items() if k != "cachedContent"}
+
+    content = json.dumps(sanitize(payload), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=12).hexdigest()
@@ -0,0 +1,164 @@
+"""
+流量录制模块
+
+开启后记录每个请求脱敏后的请求体，以及该请求触发的上游调用时序（首字节时间、
+SSE 分块大小和分块间隔），以 JSON Lines 格式追加写入录制文件，供 benchmarks/replay.py 回放
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.config.config import settings
+from app.log.logger import get_capture_logger
+from app.service.capture.sanitizer import digest, sanitize
+
+logger = get_capture_logger()
+
+# 录制文件格式版本
+CAPTURE_FORMAT_VERSION = 1
+
+
+class UpstreamCapture:
+    """一次上游调用的时序记录"""
+
+    def __init__(self, model: str, payload: Dict[str, Any], stream: bool):
+        self.model = model
+        self.payload = payload
+        self.stream = stream
+        self.status = 0
+        self.started = time.perf_counter()
+        self.first_byte: Optional[float] = None
+        self.last_chunk: Optional[float] = None
+        self.chunks: List[int] = []
+        self.gaps: List[int] = []
+        self.duration = 0
+
+    def response(self, status: int) -> None:
+        """收到响应头"""
+        self.status = status
+
+    def chunk(self, size: int) -> None:
+        """收到一个响应分块"""
+        now = time.perf_counter()
+        if self.first_byte is None:
+            self.first_byte = now
+        else:
+            self.gaps.append(round((now - self.last_chunk) * 1000))
+
+        self.last_chunk = now
+        self.chunks.append(size)
+
+    def close(self) -> None:
+        self.duration = round((time.perf_counter() - self.started) * 1000)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ttfb = self.first_byte - self.started if self.first_byte is not None else 0
+        return {
+            "key": digest(self.payload),
+            "model": self.model,
+            "stream": self.stream,
+            "status": self.status,
+            "ttfb": round(ttfb * 1000),
+            "duration": self.duration,
+            "chunks": self.chunks,
+            "gaps": self.gaps,
+        }
+
+
+class CaptureRecord:
+    """一个客户端请求的录制记录"""
+
+    def __init__(self, method: str, path: str, query: str):
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.method = method
+        self.path = path
+        self.query = query
+        self.status = 0
+        self.upstream: List[UpstreamCapture] = []
+
+
+# 当前请求的录制记录，由 TrafficCaptureMiddleware 设置
+current_record: ContextVar[Optional[CaptureRecord]] = ContextVar("capture_record", default=None)
+
+
+class TrafficRecorder:
+    """
+    流量录制器
+
+    录制文件只追加写入，多个工作进程可以写同一个文件（单行写入在 O_APPEND 下是原子的）
+    """
+
+    def __init__(self, file_path: str, sample_rate: float = 1.0):
+        self.file_path = file_path
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.lock = threading.Lock()
+        self.records = 0
+
+    def begin(self, method: str, path: str, query: str) -> Optional[CaptureRecord]:
+        """开始录制一个请求，未被采样时返回None"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+
+        record = CaptureRecord(method, path, query)
+        current_record.set(record)
+        return record
+
+    def write(self, record: CaptureRecord, body: bytes) -> None:
+        """脱敏并写入录制记录，包含CPU密集的序列化操作，应在线程中调用"""
+        try:
+            payload = json.loads(body) if body else None
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logger.debug(f"Skip capturing non-JSON request to {record.path}")
+            return
+
+        line = json.dumps(
+            {
+                "v": CAPTURE_FORMAT_VERSION,
+                "ts": round(record.timestamp, 3),
+                "method": record.method,
+                "path": record.path,
+                "query": record.query,
+                "status": record.status,
+                "duration": round((time.perf_counter() - record.started) * 1000),
+                "body": sanitize(payload),
+                "upstream": [item.to_dict() for item in record.upstream],
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+        try:
+            with self.lock:
+                directory = os.path.dirname(self.file_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.records += 1
+        except OSError as e:
+            logger.error(f"Failed to write capture record: {str(e)}")
+
+
+def capture_upstream(model: str, payload: Dict[str, Any], stream: bool) -> Optional[UpstreamCapture]:
+    """
+    为当前请求登记一次上游调用
+
+    Returns:
+        Optional[UpstreamCapture]: 当前请求未在录制时返回None
+    """
+    record = current_record.get()
+    if record is None:
+        return None
+
+    capture = UpstreamCapture(model, payload, stream)
+    record.upstream.append(capture)
+    return capture
+
+
+traffic_recorder = TrafficRecorder(settings.TRAFFIC_CAPTURE_FILE, settings.TRAFFIC_CAPTURE_SAMPLE_RATE)
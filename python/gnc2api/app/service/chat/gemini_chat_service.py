@@ -2,12 +2,19 @@ import json
 from typing import Any, AsyncGenerator, Dict, List
 
 from app.config.config import settings
+from app.core.tracing import span
 from app.domain.gemini_models import GeminiRequest
+from app.exception.exceptions import ModelNotSupportedError
 from app.handler.response_handler import GeminiResponseHandler
+from app.handler.stream_continuation import StreamContinuation
 from app.handler.stream_optimizer import gemini_optimizer
 from app.log.logger import get_gemini_logger
+from app.service.admission.admission_controller import record_usage
+from app.service.cache.context_cache import context_cache_manager
 from app.service.client.api_client import GeminiApiClient
+from app.service.media.media_offload import media_offload_manager
 from app.service.provider.provider_manager import ProviderManager
+from app.utils.inline_media import wrap_inline_data
 
 logger = get_gemini_logger()
 
@@ -93,7 +100,8 @@ def _build_payload(model: str, request: GeminiRequest) -> Dict[str, Any]:
             request_dict["generationConfig"].pop("maxOutputTokens")
 
     payload = {
-        "contents": request_dict.get("contents", []),
+        # 较大的 base64 数据以引用的形式传递，发送时分块写出
+        "contents": wrap_inline_data(request_dict.get("contents", [])),
         "tools": _build_tools(model, request_dict),
         "safetySettings": _get_safety_settings(model),
         "generationConfig": request_dict.get("generationConfig", {}),
@@ -136,24 +144,57 @@ class GeminiChatService:
 
     async def generate_content(self, base_url: str, model: str, request: GeminiRequest, api_key: str) -> Dict[str, Any]:
         """生成内容"""
-        payload = _build_payload(model, request)
-        response = self.api_client.generate_content(base_url, payload, model, api_key)
-        return self.response_handler.handle_response(response, model, stream=False)
+        with span("build_payload"):
+            payload = _build_payload(model, request)
+        request_payload = await media_offload_manager.apply(base_url, payload, api_key)
+        request_payload = await context_cache_manager.apply(base_url, model, request_payload, api_key)
+        try:
+            response = await self.api_client.generate_content(base_url, request_payload, model, api_key)
+        except Exception as e:
+            stale_cache = context_cache_manager.handle_error(base_url, request_payload, e)
+            if not stale_cache and not media_offload_manager.handle_error(base_url, request_payload, e):
+                raise
+            # 缓存或上传的文件已失效，使用原始payload重试
+            response = await self.api_client.generate_content(base_url, payload, model, api_key)
+        record_usage(response.get("usageMetadata"))
+        with span("transform_response"):
+            return self.response_handler.handle_response(response, model, stream=False)
 
     async def stream_generate_content(
         self, base_url: str, model: str, request: GeminiRequest, api_key: str
     ) -> AsyncGenerator[str, None]:
-        """流式生成内容"""
+        """流式生成内容，上游中途失败时切换Provider续写，不重复已发送的内容"""
         retries = 0
         max_retries = 3
-        payload = _build_payload(model, request)
+        with span("build_payload"):
+            payload = _build_payload(model, request)
+        continuation = StreamContinuation()
+        reuploaded = False
         while retries < max_retries:
+            request_payload = payload
+            # 上游每个块的 usageMetadata 都是累计值，只需要保留最后一个
+            usage_metadata = None
             try:
-                async for line in self.api_client.stream_generate_content(base_url, payload, model, api_key):
+                request_payload = await media_offload_manager.apply(
+                    base_url, continuation.build_payload(payload), api_key
+                )
+                request_payload = await context_cache_manager.apply(base_url, model, request_payload, api_key)
+                async for line in self.api_client.stream_generate_content(base_url, request_payload, model, api_key):
                     if line.startswith("data:"):
-                        line = line[6:]
-                        response_data = self.response_handler.handle_response(json.loads(line), model, stream=True)
+                        chunk = json.loads(line[6:])
+                        usage_metadata = chunk.get("usageMetadata") or usage_metadata
+                        response_data = self.response_handler.handle_response(chunk, model, stream=True)
                         text = self._extract_text_from_response(response_data)
+                        if text:
+                            new_text = continuation.feed(text)
+                            if new_text != text:
+                                # 续写的开头与已发送的内容重复，只输出新的部分，结束块仍然需要发送
+                                if not new_text and not response_data["candidates"][0].get("finishReason"):
+                                    continue
+                                response_data = self._create_char_response(response_data, new_text)
+                            text = new_text
+                        elif '"functionCall"' in line:
+                            continuation.resumable = False
                         # 如果有文本内容，且开启了流式输出优化器，则使用流式输出优化器处理
                         if text and settings.STREAM_OPTIMIZER_ENABLED:
                             # 使用流式输出优化器处理文本输出
@@ -166,13 +207,33 @@ class GeminiChatService:
                         else:
                             # 如果没有文本内容（如工具调用等），整块输出
                             yield "data: " + json.dumps(response_data) + "\n\n"
+                record_usage(usage_metadata)
                 logger.info("Streaming completed successfully")
                 break
             except Exception as e:
+                # 中断的请求上游同样计费
+                record_usage(usage_metadata)
+                if context_cache_manager.handle_error(base_url, request_payload, e):
+                    # 缓存已失效，上游尚未返回任何内容，直接使用原始payload重试
+                    continue
+                if media_offload_manager.handle_error(base_url, request_payload, e) and not reuploaded:
+                    # 上传的文件已失效，重新上传后重试，每个请求只重新上传一次
+                    reuploaded = True
+                    continue
+
                 retries += 1
                 logger.warning(f"Streaming API call failed with error: {str(e)}. Attempt {retries} of {max_retries}")
-                base_url = await self.provider_manager.handle_api_failure(base_url)
+                try:
+                    base_url = await self.provider_manager.handle_request_failure(base_url, model, e)
+                except ModelNotSupportedError:
+                    logger.error(f"No provider supports model {model}")
+                    break
                 logger.info(f"Switched to new API provider: {base_url}")
                 if retries >= max_retries:
                     logger.error(f"Max retries ({max_retries}) reached for streaming. Raising error")
                     break
+                if not continuation.resume(usage_metadata):
+                    logger.error("Streaming failed after function calls were sent, unable to resume")
+                    break
+                if continuation.emitted:
+                    logger.info(f"Resuming stream after {len(continuation.emitted)} characters")
@@ -3,12 +3,18 @@ from copy import deepcopy
 from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 
 from app.config.config import settings
+from app.core.tracing import span
 from app.domain.openai_models import ChatRequest
+from app.exception.exceptions import ModelNotSupportedError
 from app.handler.message_converter import OpenAIMessageConverter
 from app.handler.response_handler import OpenAIResponseHandler
+from app.handler.stream_continuation import StreamContinuation
 from app.handler.stream_optimizer import openai_optimizer
 from app.log.logger import get_openai_logger
+from app.service.admission.admission_controller import record_usage
+from app.service.cache.context_cache import context_cache_manager
 from app.service.client.api_client import GeminiApiClient
+from app.service.media.media_offload import media_offload_manager
 from app.service.provider.provider_manager import ProviderManager
 
 logger = get_openai_logger()
@@ -163,42 +169,73 @@ class OpenAIChatService:
         api_key: str,
     ) -> Union[Dict[str, Any], AsyncGenerator[str, None]]:
         """创建聊天完成"""
-        # 转换消息格式
-        messages, instruction = self.message_converter.convert(request.messages)
+        # 转换消息格式，包括下载消息中引用的图片
+        with span("convert_messages", messages=len(request.messages)):
+            messages, instruction = self.message_converter.convert(request.messages)
 
         # 构建请求payload
-        payload = _build_payload(request, messages, instruction)
+        with span("build_payload"):
+            payload = _build_payload(request, messages, instruction)
 
         if request.stream:
             return self._handle_stream_completion(base_url, request.model, payload, api_key)
-        return self._handle_normal_completion(base_url, request.model, payload, api_key)
+        return await self._handle_normal_completion(base_url, request.model, payload, api_key)
 
-    def _handle_normal_completion(
+    async def _handle_normal_completion(
         self, base_url: str, model: str, payload: Dict[str, Any], api_key: str
     ) -> Dict[str, Any]:
         """处理普通聊天完成"""
-        response = self.api_client.generate_content(base_url, payload, model, api_key)
-        return self.response_handler.handle_response(response, model, stream=False, finish_reason="stop")
+        request_payload = await media_offload_manager.apply(base_url, payload, api_key)
+        request_payload = await context_cache_manager.apply(base_url, model, request_payload, api_key)
+        try:
+            response = await self.api_client.generate_content(base_url, request_payload, model, api_key)
+        except Exception as e:
+            stale_cache = context_cache_manager.handle_error(base_url, request_payload, e)
+            if not stale_cache and not media_offload_manager.handle_error(base_url, request_payload, e):
+                raise
+            # 缓存或上传的文件已失效，使用原始payload重试
+            response = await self.api_client.generate_content(base_url, payload, model, api_key)
+        record_usage(response.get("usageMetadata"))
+        with span("transform_response"):
+            return self.response_handler.handle_response(response, model, stream=False, finish_reason="stop")
 
     async def _handle_stream_completion(
         self, base_url: str, model: str, payload: Dict[str, Any], api_key: str
     ) -> AsyncGenerator[str, None]:
-        """处理流式聊天完成，添加重试逻辑"""
+        """处理流式聊天完成，上游中途失败时切换Provider续写，不重复已发送的内容"""
         retries = 0
         max_retries = 3
+        continuation = StreamContinuation()
+        reuploaded = False
         while retries < max_retries:
+            request_payload = payload
+            # 上游每个块的 usageMetadata 都是累计值，只需要保留最后一个
+            usage_metadata = None
             try:
                 tool_call_flag = False
-                async for line in self.api_client.stream_generate_content(base_url, payload, model, api_key):
+                request_payload = await media_offload_manager.apply(
+                    base_url, continuation.build_payload(payload), api_key
+                )
+                request_payload = await context_cache_manager.apply(base_url, model, request_payload, api_key)
+                async for line in self.api_client.stream_generate_content(base_url, request_payload, model, api_key):
                     # print(line)
                     if line.startswith("data:"):
                         chunk = json.loads(line[6:])
+                        usage_metadata = chunk.get("usageMetadata") or usage_metadata
                         openai_chunk = self.response_handler.handle_response(
                             chunk, model, stream=True, finish_reason=None
                         )
                         if openai_chunk:
                             # 提取文本内容
                             text = self._extract_text_from_openai_chunk(openai_chunk)
+                            if text:
+                                new_text = continuation.feed(text)
+                                if not new_text:
+                                    # 续写的开头与已发送的内容重复
+                                    continue
+                                if new_text != text:
+                                    openai_chunk = self._create_char_openai_chunk(openai_chunk, new_text)
+                                text = new_text
                             if text and settings.STREAM_OPTIMIZER_ENABLED:
                                 # 使用流式输出优化器处理文本输出
                                 async for optimized_chunk in openai_optimizer.optimize_stream_output(
@@ -211,21 +248,49 @@ class OpenAIChatService:
                                 # 如果没有文本内容（如工具调用等），整块输出
                                 if "tool_calls" in json.dumps(openai_chunk):
                                     tool_call_flag = True
+                                    continuation.resumable = False
                                 yield f"data: {json.dumps(openai_chunk)}\n\n"
-                if tool_call_flag:
-                    yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='tool_calls'))}\n\n"
-                else:
-                    yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='stop'))}\n\n"
+                record_usage(usage_metadata)
+                final_chunk = self.response_handler.handle_response(
+                    {"usageMetadata": usage_metadata} if usage_metadata else {},
+                    model,
+                    stream=True,
+                    finish_reason="tool_calls" if tool_call_flag else "stop",
+                )
+                yield f"data: {json.dumps(final_chunk)}\n\n"
                 yield "data: [DONE]\n\n"
                 logger.info("Streaming completed successfully")
                 break  # 成功后退出循环
             except Exception as e:
+                # 中断的请求上游同样计费
+                record_usage(usage_metadata)
+                if context_cache_manager.handle_error(base_url, request_payload, e):
+                    # 缓存已失效，上游尚未返回任何内容，直接使用原始payload重试
+                    continue
+                if media_offload_manager.handle_error(base_url, request_payload, e) and not reuploaded:
+                    # 上传的文件已失效，重新上传后重试，每个请求只重新上传一次
+                    reuploaded = True
+                    continue
+
                 retries += 1
                 logger.warning(f"Streaming API call failed with error: {str(e)}. Attempt {retries} of {max_retries}")
-                base_url = await self.provider_manager.handle_api_failure(base_url)
+                try:
+                    base_url = await self.provider_manager.handle_request_failure(base_url, model, e)
+                except ModelNotSupportedError as ex:
+                    logger.error(f"No provider supports model {model}")
+                    yield f"data: {json.dumps({'error': ex.detail})}\n\n"
+                    yield "data: [DONE]\n\n"
+                    break
                 logger.info(f"Switched to new API provider: {base_url}")
                 if retries >= max_retries:
                     logger.error(f"Max retries ({max_retries}) reached for streaming. Raising error")
                     yield f"data: {json.dumps({'error': 'Streaming failed after retries'})}\n\n"
                     yield "data: [DONE]\n\n"
                     break
+                if not continuation.resume(usage_metadata):
+                    logger.error("Streaming failed after tool calls were sent, unable to resume")
+                    yield f"data: {json.dumps({'error': 'Streaming interrupted after tool calls'})}\n\n"
+                    yield "data: [DONE]\n\n"
+                    break
+                if continuation.emitted:
+                    logger.info(f"Resuming stream after {len(continuation.emitted)} characters")
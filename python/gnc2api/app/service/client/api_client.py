@@ -3,8 +3,13 @@ import re
 import httpx
 from abc import ABC, abstractmethod
 
-from typing import Any, AsyncGenerator, Dict
+from typing import Any, AsyncGenerator, Dict, List
 from app.core.constants import DEFAULT_TIMEOUT, DEFAULT_X_GOOG_API_CLIENT
+from app.core.tracing import SPAN_KIND_CLIENT, httpx_extensions, span
+from app.service.capture.traffic_recorder import capture_upstream
+from app.service.client.client_pool import client_pool
+from app.service.client.deadlines import Deadlines, PhaseTimer, deadline_tracker
+from app.utils.inline_media import InlineMedia, JsonBody
 
 
 class ApiClient(ABC):
@@ -58,42 +63,255 @@ class GeminiApiClient(ApiClient):
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36 Edg/134.0.0.0",
         }
 
-    def generate_content(self, base_url: str, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+    def _deadline_timeout(self, deadlines: Deadlines) -> httpx.Timeout:
+        # httpx 的超时只作为兜底，首字节和分块间隔由 PhaseTimer 控制
+        return httpx.Timeout(deadlines.total, connect=deadlines.connect or deadlines.total)
+
+    async def generate_content(
+        self, base_url: str, payload: Dict[str, Any], model: str, api_key: str
+    ) -> Dict[str, Any]:
         base_url = self._process_url(base_url)
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
         model = self._get_real_model(model)
+        deadlines = deadline_tracker.deadlines(base_url, model, stream=False, total=self.timeout)
+        capture = capture_upstream(model, payload, stream=False)
 
-        with httpx.Client(timeout=timeout) as client:
-            url = f"{base_url}/models/{model}:generateContent"
-            response = client.post(url, json=payload, headers=self._get_headers(base_url, api_key))
-            if response.status_code != 200:
-                error_content = response.text
-                raise Exception(f"API call failed with status code {response.status_code}, {error_content}")
+        body = JsonBody(payload)
+        headers = {**self._get_headers(base_url, api_key), **body.headers()}
+
+        with span("upstream.generate_content", kind=SPAN_KIND_CLIENT, provider=base_url, model=model) as upstream:
+            async with client_pool.use(base_url) as client:
+                url = f"{base_url}/models/{model}:generateContent"
+                timer = PhaseTimer(deadline_tracker, base_url, model, deadlines)
+                try:
+                    response = await timer.run(
+                        "first_byte",
+                        client.post(
+                            url,
+                            content=body,
+                            headers=headers,
+                            timeout=self._deadline_timeout(deadlines),
+                            extensions=httpx_extensions(upstream),
+                        ),
+                    )
+                except httpx.ConnectTimeout:
+                    raise timer.expire("connect", deadlines.connect or deadlines.total) from None
+                upstream.set("http.status_code", response.status_code)
+                if capture:
+                    capture.response(response.status_code)
+                    capture.chunk(len(response.content))
+                    capture.close()
+
+                if response.status_code != 200:
+                    error_content = response.text
+                    raise Exception(f"API call failed with status code {response.status_code}, {error_content}")
+                deadline_tracker.record_first_byte(base_url, model, False, timer.elapsed())
 
-            content_type = response.headers.get("Content-Type")
-            if content_type == "text/event-stream":
-                content = response.text.removesuffix("\r\n")
-                if content.startswith("data:"):
-                    content = content.removeprefix("data:").strip()
+                content_type = response.headers.get("Content-Type")
+                if content_type == "text/event-stream":
+                    content = response.text.removesuffix("\r\n")
+                    if content.startswith("data:"):
+                        content = content.removeprefix("data:").strip()
 
-                return json.loads(content)
-            else:
-                return response.json()
+                    return json.loads(content)
+                else:
+                    return response.json()
 
     async def stream_generate_content(
         self, base_url: str, payload: Dict[str, Any], model: str, api_key: str
     ) -> AsyncGenerator[str, None]:
         base_url = self._process_url(base_url)
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
-        headers = self._get_headers(base_url, api_key)
         model = self._get_real_model(model)
+        deadlines = deadline_tracker.deadlines(base_url, model, stream=True, total=self.timeout)
+        capture = capture_upstream(model, payload, stream=True)
+        body = JsonBody(payload)
+        headers = {**self._get_headers(base_url, api_key), **body.headers()}
+
+        with span(
+            "upstream.stream_generate_content",
+            kind=SPAN_KIND_CLIENT,
+            activate=False,
+            provider=base_url,
+            model=model,
+        ) as upstream:
+            try:
+                async with client_pool.use(base_url) as client:
+                    url = f"{base_url}/models/{model}:streamGenerateContent?alt=sse"
+                    request = client.build_request(
+                        "POST",
+                        url,
+                        content=body,
+                        headers=headers,
+                        timeout=self._deadline_timeout(deadlines),
+                        extensions=httpx_extensions(upstream),
+                    )
+                    timer = PhaseTimer(deadline_tracker, base_url, model, deadlines)
+                    try:
+                        response = await timer.run("first_byte", client.send(request, stream=True))
+                    except httpx.ConnectTimeout:
+                        raise timer.expire("connect", deadlines.connect or deadlines.total) from None
+
+                    # chunks 和 downstream 记录数据行数以及调用方处理数据行（响应转换和写入客户端）的耗时
+                    chunks, downstream = 0, 0.0
+                    try:
+                        upstream.set("http.status_code", response.status_code)
+                        if capture:
+                            capture.response(response.status_code)
+
+                        if response.status_code != 200:
+                            error_content = await timer.run("idle", response.aread())
+                            error_msg = error_content.decode("utf-8")
+                            raise Exception(f"API call failed with status code {response.status_code}, {error_msg}")
+
+                        # 首个数据行之前按首字节时限计时，之后按分块间隔计时；SSE 的空行不算数据
+                        lines, phase, waited, max_gap = response.aiter_lines(), "first_byte", 0.0, None
+                        while True:
+                            start = timer.elapsed()
+                            try:
+                                line = await timer.run(phase, lines.__anext__())
+                            except StopAsyncIteration:
+                                break
+                            waited += timer.elapsed() - start
 
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            url = f"{base_url}/models/{model}:streamGenerateContent?alt=sse"
-            async with client.stream(method="POST", url=url, json=payload, headers=headers) as response:
+                            if line:
+                                if phase == "first_byte":
+                                    deadline_tracker.record_first_byte(base_url, model, True, timer.elapsed())
+                                    upstream.event("first_chunk")
+                                    phase = "idle"
+                                else:
+                                    max_gap = max(max_gap or 0.0, waited)
+                                waited = 0.0
+                                chunks += 1
+                                if capture:
+                                    capture.chunk(len(line.encode("utf-8")))
+                            yielded = timer.elapsed()
+                            yield line
+                            downstream += timer.elapsed() - yielded
+
+                        if max_gap is not None:
+                            deadline_tracker.record_idle(base_url, model, max_gap)
+                    finally:
+                        upstream.set("chunks", chunks)
+                        upstream.set("downstream_ms", round(downstream * 1000, 1))
+                        await response.aclose()
+            finally:
+                if capture:
+                    capture.close()
+
+    async def list_models(self, base_url: str, api_key: str) -> List[Dict[str, Any]]:
+        """获取上游支持的模型列表，自动处理分页"""
+        base_url = self._process_url(base_url)
+        timeout = httpx.Timeout(self.timeout, connect=10, read=30)
+        models, page_token = [], ""
+
+        async with client_pool.use(base_url) as client:
+            while True:
+                params = {"pageSize": 1000}
+                if page_token:
+                    params["pageToken"] = page_token
+
+                url = f"{base_url}/models"
+                headers = self._get_headers(base_url, api_key)
+                response = await client.get(url, params=params, headers=headers, timeout=timeout)
                 if response.status_code != 200:
-                    error_content = await response.aread()
-                    error_msg = error_content.decode("utf-8")
-                    raise Exception(f"API call failed with status code {response.status_code}, {error_msg}")
-                async for line in response.aiter_lines():
-                    yield line
+                    raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+
+                data = response.json()
+                models.extend(data.get("models") or [])
+                page_token = data.get("nextPageToken")
+                if not page_token:
+                    return models
+
+    async def warm_up(self, base_url: str, api_key: str, timeout: float = 10) -> bool:
+        """预先建立到上游的连接"""
+        base_url = self._process_url(base_url)
+        return await client_pool.warm(base_url, self._get_headers(base_url, api_key), timeout=timeout)
+
+    async def create_cached_content(self, base_url: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """创建上下文缓存"""
+        base_url = self._process_url(base_url)
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+
+        async with client_pool.use(base_url) as client:
+            url = f"{base_url}/cachedContents"
+            body = JsonBody(payload)
+            headers = {**self._get_headers(base_url, api_key), **body.headers()}
+            response = await client.post(url, content=body, headers=headers, timeout=timeout)
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+            return response.json()
+
+    def _upload_base_url(self, base_url: str) -> str:
+        """Files API 的上传地址位于 API 版本之前的 /upload 路径下，如 .../upload/v1beta"""
+        prefix, _, version = base_url.rstrip("/").rpartition("/")
+        return f"{prefix}/upload/{version}"
+
+    async def upload_file(
+        self, base_url: str, media: InlineMedia, mime_type: str, display_name: str, api_key: str
+    ) -> Dict[str, Any]:
+        """
+        通过 Files API 的可续传协议上传内嵌媒体
+
+        先创建上传会话，再把 base64 数据分块解码后作为请求体发送，不在内存中生成完整的二进制副本
+
+        Returns:
+            Dict[str, Any]: 上游返回的 File 对象
+        """
+        base_url = self._process_url(base_url)
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+        size, chunks = media.decoded()
+
+        async def body():
+            for chunk in chunks:
+                yield chunk
+
+        async with client_pool.use(base_url) as client:
+            headers = {
+                **self._get_headers(base_url, api_key),
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(size),
+                "X-Goog-Upload-Header-Content-Type": mime_type,
+            }
+            url = f"{self._upload_base_url(base_url)}/files"
+            payload = {"file": {"display_name": display_name}}
+            response = await client.post(url, json=payload, headers=headers, timeout=timeout)
+            upload_url = response.headers.get("X-Goog-Upload-URL")
+            if response.status_code != 200 or not upload_url:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+
+            headers = {
+                **self._get_headers(base_url, api_key),
+                "Content-Type": mime_type,
+                "Content-Length": str(size),
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize",
+            }
+            response = await client.post(upload_url, content=body(), headers=headers, timeout=timeout)
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+            return response.json().get("file", {})
+
+    async def get_file(self, base_url: str, name: str, api_key: str) -> Dict[str, Any]:
+        """获取 Files API 中文件的状态"""
+        base_url = self._process_url(base_url)
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+
+        async with client_pool.use(base_url) as client:
+            url = f"{base_url}/{name}"
+            response = await client.get(url, headers=self._get_headers(base_url, api_key), timeout=timeout)
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+            return response.json()
+
+    async def update_cached_content(self, base_url: str, name: str, ttl: str, api_key: str) -> Dict[str, Any]:
+        """更新上下文缓存的过期时间"""
+        base_url = self._process_url(base_url)
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+
+        async with client_pool.use(base_url) as client:
+            url = f"{base_url}/{name}?updateMask=ttl"
+            headers = self._get_headers(base_url, api_key)
+            response = await client.patch(url, json={"ttl": ttl}, headers=headers, timeout=timeout)
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+            return response.json()
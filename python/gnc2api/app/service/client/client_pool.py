@@ -0,0 +1,98 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+import httpx
+
+from app.config.config import settings
+from app.core.constants import DEFAULT_UPSTREAM_KEEPALIVE_EXPIRY, DEFAULT_UPSTREAM_MAX_KEEPALIVE
+from app.log.logger import get_provider_manager_logger
+
+logger = get_provider_manager_logger()
+
+
+class ClientPool:
+    """
+    按API Provider复用的 httpx.AsyncClient 连接池
+
+    每个Provider一个客户端，复用 TCP/TLS 连接；同时记录每个Provider正在进行的请求数，
+    用于在移除Provider时等待其请求（包括流式响应）结束后再关闭连接
+    """
+
+    def __init__(
+        self,
+        timeout: int,
+        max_keepalive: int = DEFAULT_UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry: float = DEFAULT_UPSTREAM_KEEPALIVE_EXPIRY,
+    ):
+        self.timeout = httpx.Timeout(timeout, read=timeout)
+        self.limits = httpx.Limits(
+            max_connections=None, max_keepalive_connections=max_keepalive, keepalive_expiry=keepalive_expiry
+        )
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.draining: set = set()
+
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        """获取Provider对应的客户端，不存在时创建"""
+        client = self.clients.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+            self.clients[base_url] = client
+        return client
+
+    @asynccontextmanager
+    async def use(self, base_url: str) -> AsyncIterator[httpx.AsyncClient]:
+        """在请求期间持有客户端，并计入该Provider的进行中请求数"""
+        client = self.get(base_url)
+        self.in_flight[base_url] = self.in_flight.get(base_url, 0) + 1
+        try:
+            yield client
+        finally:
+            self.in_flight[base_url] = self.in_flight.get(base_url, 1) - 1
+
+    def total_in_flight(self) -> int:
+        """所有Provider正在进行的请求总数"""
+        return sum(self.in_flight.values())
+
+    async def warm(self, base_url: str, headers: Dict[str, str], timeout: float = 10) -> bool:
+        """预先建立到Provider的连接，返回Provider是否可达"""
+        self.draining.discard(base_url)
+        try:
+            async with self.use(base_url) as client:
+                response = await client.get(
+                    f"{base_url}/models", params={"pageSize": 1}, headers=headers, timeout=timeout
+                )
+                logger.info(f"Warmed connection to {base_url}, status code: {response.status_code}")
+                return True
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to warm connection to {base_url}: {str(e)}")
+            return False
+
+    async def drain(self, base_url: str, timeout: float) -> None:
+        """等待Provider的进行中请求结束（最长 timeout 秒）后关闭连接"""
+        self.draining.add(base_url)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.in_flight.get(base_url, 0) > 0 and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.5)
+
+        # 排空期间Provider可能被重新加入
+        if base_url not in self.draining:
+            return
+
+        self.draining.discard(base_url)
+        remaining = self.in_flight.pop(base_url, 0)
+        client = self.clients.pop(base_url, None)
+        if client is not None:
+            await client.aclose()
+        logger.info(f"Drained provider {base_url}, requests cancelled: {remaining}")
+
+    async def close(self) -> None:
+        """关闭所有客户端"""
+        clients, self.clients = self.clients, {}
+        self.in_flight.clear()
+        self.draining.clear()
+        await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
+
+
+client_pool = ClientPool(timeout=settings.MAX_TIMEOUT)
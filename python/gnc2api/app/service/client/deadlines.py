@@ -0,0 +1,222 @@
+import asyncio
+import math
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Deque, Dict, Optional, Tuple, TypeVar
+
+from app.config.config import settings
+from app.core.constants import (
+    ADAPTIVE_DEADLINE_FLOOR,
+    ADAPTIVE_DEADLINE_MIN_SAMPLES,
+    ADAPTIVE_DEADLINE_QUANTILE,
+    ADAPTIVE_DEADLINE_WINDOW,
+)
+from app.exception.exceptions import UpstreamDeadlineError
+from app.log.logger import get_deadline_logger
+
+logger = get_deadline_logger()
+
+T = TypeVar("T")
+
+PHASES = ("connect", "first_byte", "idle", "total")
+
+
+@dataclass
+class Deadlines:
+    """一次上游请求各阶段的时限（秒），None 表示该阶段只受总时长限制"""
+
+    connect: Optional[float]
+    first_byte: Optional[float]
+    idle: Optional[float]
+    total: float
+
+
+def _positive(value: float) -> Optional[float]:
+    return value if value and value > 0 else None
+
+
+class LatencyWindow:
+    """最近若干个延迟样本"""
+
+    __slots__ = ("samples", "_quantile")
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=ADAPTIVE_DEADLINE_WINDOW)
+        self._quantile: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+        self._quantile = None
+
+    def quantile(self) -> Optional[float]:
+        """样本足够时返回 ADAPTIVE_DEADLINE_QUANTILE 分位数，结果缓存到下一个样本加入"""
+        if len(self.samples) < ADAPTIVE_DEADLINE_MIN_SAMPLES:
+            return None
+        if self._quantile is None:
+            values = sorted(self.samples)
+            self._quantile = values[min(len(values) - 1, math.ceil(ADAPTIVE_DEADLINE_QUANTILE * len(values)) - 1)]
+        return self._quantile
+
+
+class DeadlineTracker:
+    """
+    上游请求的分阶段时限
+
+    流式请求分别限制建立连接、等待首个数据块、数据块之间的间隔和总时长；非流式请求的响应在生成完成后
+    才返回，只限制连接和总时长。开启自适应后，按每个Provider和模型最近的首字节时间（非流式为响应时间）
+    和最长分块间隔收紧时限（不会超过配置值），使卡住的Provider更早被放弃。超时按阶段计数，供状态接口查看。
+    """
+
+    def __init__(self):
+        # (provider, model, stream) -> 首字节时间样本；非流式请求记录的是完整响应时间
+        self.first_byte: Dict[Tuple[str, str, bool], LatencyWindow] = {}
+        # (provider, model) -> 每个流式响应中最长的分块间隔
+        self.idle: Dict[Tuple[str, str], LatencyWindow] = {}
+        # provider -> 阶段 -> 超时次数
+        self.expiries: Dict[str, Dict[str, int]] = {}
+
+    def _adapt(self, configured: Optional[float], window: Optional[LatencyWindow]) -> Optional[float]:
+        if not settings.ADAPTIVE_DEADLINES_ENABLED or window is None:
+            return configured
+        quantile = window.quantile()
+        if quantile is None:
+            return configured
+        adaptive = max(ADAPTIVE_DEADLINE_FLOOR, quantile * settings.ADAPTIVE_DEADLINE_MULTIPLIER)
+        return adaptive if configured is None else min(configured, adaptive)
+
+    def deadlines(self, provider: str, model: str, stream: bool, total: float) -> Deadlines:
+        """
+        计算本次请求各阶段的时限
+
+        Args:
+            provider: API Provider地址
+            model: 实际请求的模型
+            stream: 是否为流式请求
+            total: 总时长上限
+        """
+        first_byte = _positive(settings.UPSTREAM_FIRST_BYTE_TIMEOUT) if stream else None
+        idle = _positive(settings.UPSTREAM_IDLE_TIMEOUT) if stream else None
+        return Deadlines(
+            connect=_positive(settings.UPSTREAM_CONNECT_TIMEOUT),
+            first_byte=self._adapt(first_byte, self.first_byte.get((provider, model, stream))),
+            idle=self._adapt(idle, self.idle.get((provider, model))) if stream else None,
+            total=total,
+        )
+
+    def record_first_byte(self, provider: str, model: str, stream: bool, seconds: float) -> None:
+        self.first_byte.setdefault((provider, model, stream), LatencyWindow()).add(seconds)
+
+    def record_idle(self, provider: str, model: str, seconds: float) -> None:
+        self.idle.setdefault((provider, model), LatencyWindow()).add(seconds)
+
+    def record_expiry(self, provider: str, phase: str) -> None:
+        counts = self.expiries.setdefault(provider, dict.fromkeys(PHASES, 0))
+        counts[phase] = counts.get(phase, 0) + 1
+
+    def retain(self, providers) -> None:
+        """移除不再使用的Provider的样本"""
+        keep = set(providers)
+        for table in (self.first_byte, self.idle, self.expiries):
+            for key in [k for k in table if (k[0] if isinstance(k, tuple) else k) not in keep]:
+                table.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各Provider的超时次数和当前的自适应时限"""
+        result: Dict[str, Any] = {}
+        for provider, counts in self.expiries.items():
+            result.setdefault(provider, {"expiries": {}, "adaptive": {}})["expiries"] = dict(counts)
+        for (provider, model, stream), window in self.first_byte.items():
+            quantile = window.quantile()
+            entry = result.setdefault(provider, {"expiries": {}, "adaptive": {}})["adaptive"].setdefault(model, {})
+            key = "first_byte_p99" if stream else "response_p99"
+            entry[key] = round(quantile, 3) if quantile is not None else None
+        for (provider, model), window in self.idle.items():
+            quantile = window.quantile()
+            entry = result.setdefault(provider, {"expiries": {}, "adaptive": {}})["adaptive"].setdefault(model, {})
+            entry["idle_p99"] = round(quantile, 3) if quantile is not None else None
+        return result
+
+
+class PhaseTimer:
+    """
+    在当前任务中为一次上游请求的各个阶段计时
+
+    只在等待上游的 await 期间计时：超时时取消当前任务，把取消转换为 UpstreamDeadlineError。
+    流式响应把数据块交给调用方处理的时间不计入分块间隔。
+    """
+
+    def __init__(self, tracker: DeadlineTracker, provider: str, model: str, deadlines: Deadlines):
+        self.tracker = tracker
+        self.provider = provider
+        self.model = model
+        self.deadlines = deadlines
+        self.loop = asyncio.get_running_loop()
+        self.task: Optional[asyncio.Task] = None
+        self.started = self.loop.time()
+        self.total_at = self.started + deadlines.total if deadlines.total else None
+        self.expired: Optional[Tuple[str, float]] = None
+
+    def elapsed(self) -> float:
+        return self.loop.time() - self.started
+
+    def _expire(self, phase: str, limit: float) -> None:
+        self.expired = (phase, limit)
+        self.task.cancel()
+
+    def expire(self, phase: str, limit: float) -> UpstreamDeadlineError:
+        """记录超时并返回对应的异常"""
+        self.tracker.record_expiry(self.provider, phase)
+        logger.warning(
+            f"{self.provider} ({self.model}) exceeded the {phase} deadline of {limit:.1f}s "
+            f"after {self.elapsed():.1f}s"
+        )
+        return UpstreamDeadlineError(self.provider, phase, limit)
+
+    async def run(self, phase: str, awaitable: Awaitable[T]) -> T:
+        """
+        等待 awaitable，超过该阶段的时限或总时长时抛出 UpstreamDeadlineError
+
+        Args:
+            phase: first_byte、idle 或 total
+            awaitable: 等待上游的操作
+        """
+        limit = getattr(self.deadlines, phase) if phase != "total" else None
+        now = self.loop.time()
+        at = now + limit if limit else None
+        if self.total_at is not None and (at is None or self.total_at <= at):
+            phase, limit, at = "total", self.deadlines.total, self.total_at
+        if at is None:
+            return await awaitable
+
+        if at <= now:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise self.expire(phase, limit)
+
+        self.expired = None
+        self.task = asyncio.current_task()
+        handle = self.loop.call_at(at, self._expire, phase, limit)
+        try:
+            result = await awaitable
+        except asyncio.CancelledError:
+            if self.expired is None:
+                raise
+            # Python 3.11 起需要撤销计数，否则之后的 asyncio.timeout 等会误以为任务仍在取消中
+            if hasattr(self.task, "uncancel"):
+                self.task.uncancel()
+            raise self.expire(*self.expired) from None
+        finally:
+            handle.cancel()
+
+        if self.expired is not None:
+            # 计时器已经触发但结果先一步返回，吸收尚未送达的取消
+            try:
+                await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                if hasattr(self.task, "uncancel"):
+                    self.task.uncancel()
+            self.expired = None
+        return result
+
+
+deadline_tracker = DeadlineTracker()
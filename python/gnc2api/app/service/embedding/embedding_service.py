@@ -1,18 +1,21 @@
-from typing import List, Union
-
-import openai
-from openai.types import CreateEmbeddingResponse
+from typing import TYPE_CHECKING, List, Union
 
 from app.log.logger import get_embeddings_logger
 
+if TYPE_CHECKING:
+    from openai.types import CreateEmbeddingResponse
+
 logger = get_embeddings_logger()
 
 
 class EmbeddingService:
     async def create_embedding(
         self, base_url: str, input_text: Union[str, List[str]], model: str, api_key: str
-    ) -> CreateEmbeddingResponse:
+    ) -> "CreateEmbeddingResponse":
         """Create embeddings using OpenAI API"""
+        # openai SDK 导入耗时较长，仅在首次调用时加载
+        import openai
+
         try:
             client = openai.OpenAI(api_key=api_key, base_url=base_url)
             response = client.embeddings.create(input=input_text, model=model)
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.config import settings
+from app.core.constants import IMAGE_GENERATION_MAX_ATTEMPTS, IMAGE_GENERATION_MAX_N, VALID_IMAGE_RATIOS
+from app.core.tracing import span
+from app.domain.openai_models import ImageGenerationRequest
+from app.exception.exceptions import ModelNotSupportedError
+from app.log.logger import get_image_create_logger
+from app.service.admission.admission_controller import record_usage
+from app.service.client.api_client import GeminiApiClient
+from app.service.key.key_generator import get_key
+from app.service.provider.provider_manager import ProviderManager
+from app.utils.helpers import parse_prompt_parameters
+
+logger = get_image_create_logger()
+
+
+def _size_to_ratio(size: Optional[str]) -> str:
+    """
+    把 OpenAI 的 size（如 1792x1024）换算为最接近的支持比例，无法解析时使用 1:1
+
+    Raises:
+        ValueError: 宽或高不是正数
+    """
+    try:
+        width, height = (int(v) for v in (size or "").lower().split("x"))
+    except ValueError:
+        return "1:1"
+
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid size {size}, width and height must be positive")
+
+    def distance(ratio: str) -> float:
+        w, h = ratio.split(":")
+        return abs(int(w) / int(h) - width / height)
+
+    return min(VALID_IMAGE_RATIOS, key=distance)
+
+
+def _extract_image(response: Dict[str, Any]) -> Tuple[Optional[str], str]:
+    """从 generateContent 响应中取出第一张图片的 base64 数据和附带的文本"""
+    image, text = None, ""
+    for candidate in response.get("candidates", [])[:1]:
+        for part in candidate.get("content", {}).get("parts", []):
+            if "inlineData" in part and image is None:
+                image = part["inlineData"].get("data")
+            elif "text" in part:
+                text += part["text"]
+    return image, text
+
+
+class ImageCreateService:
+    """
+    OpenAI /v1/images/generations 兼容的图片生成
+
+    n 张图片并发生成，每张图片单独选择Provider并在失败时切换；
+    url 格式的图片在线程中上传到图床，不阻塞事件循环。部分图片失败时仍返回成功的图片。
+    """
+
+    def __init__(self, provider_manager: ProviderManager):
+        self.api_client = GeminiApiClient(settings.X_GOOG_API_CLIENT, timeout=settings.MAX_TIMEOUT)
+        self.provider_manager = provider_manager
+
+    def _resolve_model(self, model: str) -> str:
+        """DALL-E 等 OpenAI 模型名映射到配置的图片模型"""
+        name = (model or "").removesuffix("-image")
+        return name if name in settings.IMAGE_MODELS else settings.CREATE_IMAGE_MODEL
+
+    def _build_payload(self, prompt: str, aspect_ratio: str) -> Dict[str, Any]:
+        generation_config = {"responseModalities": ["Text", "Image"]}
+        if aspect_ratio != "1:1":
+            generation_config["imageConfig"] = {"aspectRatio": aspect_ratio}
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}]}], "generationConfig": generation_config}
+
+    async def _generate_one(self, model: str, payload: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        生成一张图片，失败时切换Provider重试
+
+        上游正常响应但没有图片（通常是安全拒绝或只返回了文本）与Provider无关，换一个Provider重试但不计入失败次数；
+        只有传输和HTTP错误才交给 handle_request_failure
+        """
+        provider = await self.provider_manager.get_next_working_provider(model=model)
+        last_error: Optional[Exception] = None
+        for _ in range(IMAGE_GENERATION_MAX_ATTEMPTS):
+            try:
+                response = await self.api_client.generate_content(provider, payload, model, get_key())
+            except Exception as e:
+                last_error = e
+                provider = await self.provider_manager.handle_request_failure(provider, model, e)
+                continue
+
+            record_usage(response.get("usageMetadata"))
+            image, text = _extract_image(response)
+            if image:
+                return image, text
+
+            last_error = Exception(f"No image returned: {text[:200]}")
+            logger.warning(f"Provider {provider} returned no image, retrying on another provider")
+            provider = await self.provider_manager.get_next_working_provider(model=model)
+        raise last_error
+
+    async def _upload(self, image: str) -> str:
+        # 图床上传依赖仅在需要时加载
+        from app.utils.uploader import create_configured_uploader
+
+        filename = f"{time.strftime('%Y/%m/%d')}/{uuid.uuid4().hex[:8]}.png"
+        data = base64.b64decode(image)
+        with span("upload_image", uploader=settings.UPLOAD_PROVIDER, bytes=len(data)):
+            upload_response = await asyncio.to_thread(create_configured_uploader().upload, data, filename)
+        if not upload_response.success:
+            raise Exception(f"Image upload failed: {upload_response.message}")
+        return upload_response.data.url
+
+    async def _create_one(
+        self, index: int, model: str, payload: Dict[str, Any], response_format: str
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """生成并（按需）上传一张图片，返回 (图片, 耗时指标)"""
+        metric: Dict[str, Any] = {"index": index, "status": "success"}
+        start = time.perf_counter()
+        try:
+            image, text = await self._generate_one(model, payload)
+            metric["generate_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+            item = {"revised_prompt": text} if text else {}
+            if response_format == "b64_json":
+                item["b64_json"] = image
+            else:
+                upload_start = time.perf_counter()
+                item["url"] = await self._upload(image)
+                metric["upload_ms"] = round((time.perf_counter() - upload_start) * 1000, 1)
+            return item, metric
+        except ModelNotSupportedError:
+            raise
+        except Exception as e:
+            logger.error(f"Image {index} generation failed: {str(e)}")
+            metric.update(status="failed", error=str(e)[:200])
+            return None, metric
+        finally:
+            metric["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    async def generate_images(self, request: ImageGenerationRequest) -> Dict[str, Any]:
+        """
+        并发生成 n 张图片
+
+        Raises:
+            ValueError: 参数无效
+            ModelNotSupportedError: 没有Provider支持图片模型
+            Exception: 所有图片都生成失败
+        """
+        prompt, n, aspect_ratio = parse_prompt_parameters(request.prompt, _size_to_ratio(request.size))
+        if "{n:" not in request.prompt:
+            n = request.n
+        if not prompt:
+            raise ValueError("prompt is required")
+        if n < 1 or n > IMAGE_GENERATION_MAX_N:
+            raise ValueError(f"n must be between 1 and {IMAGE_GENERATION_MAX_N}")
+        if request.response_format not in ("url", "b64_json"):
+            raise ValueError("response_format must be url or b64_json")
+
+        model = self._resolve_model(request.model)
+        payload = self._build_payload(prompt, aspect_ratio)
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._create_one(i, model, payload, request.response_format) for i in range(n))
+        )
+
+        data: List[Dict[str, Any]] = [item for item, _ in results if item]
+        metrics = [metric for _, metric in results]
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Generated {len(data)}/{n} images with {model} in {total_ms}ms, metrics: {metrics}")
+        if not data:
+            raise Exception(f"All {n} image generations failed")
+
+        return {"created": int(time.time()), "data": data, "metrics": {"total_ms": total_ms, "images": metrics}}
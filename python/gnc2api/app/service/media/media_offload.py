@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.config import settings
+from app.core.constants import (
+    MEDIA_OFFLOAD_DEFAULT_EXPIRY,
+    MEDIA_OFFLOAD_EXPIRY_MARGIN,
+    MEDIA_OFFLOAD_FAILURE_COOLDOWN,
+    MEDIA_OFFLOAD_PROCESSING_TIMEOUT,
+)
+from app.core.tracing import traced
+from app.log.logger import get_media_offload_logger
+from app.service.client.api_client import GeminiApiClient
+from app.utils.inline_media import INLINE_DATA_KEYS, InlineMedia
+
+logger = get_media_offload_logger()
+
+# 内嵌数据字段对应的文件引用字段，保持与原请求相同的命名风格
+FILE_DATA_FIELDS = {
+    "inline_data": ("file_data", "mime_type", "file_uri"),
+    "inlineData": ("fileData", "mimeType", "fileUri"),
+}
+
+
+@dataclass
+class UploadedFile:
+    """已上传到 Files API 的文件"""
+
+    name: str
+    uri: str
+    expire_at: float
+
+
+def _sha256(media: InlineMedia) -> str:
+    digest = hashlib.sha256()
+    for chunk in media.chunks():
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _seconds_until(timestamp: Optional[str]) -> float:
+    """Files API 返回的 expirationTime（RFC 3339）距现在的秒数"""
+    try:
+        expire = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        return expire.timestamp() - time.time()
+    except (AttributeError, ValueError):
+        return MEDIA_OFFLOAD_DEFAULT_EXPIRY
+
+
+class MediaOffloadManager:
+    """
+    内嵌媒体卸载管理器
+
+    请求中超过 MEDIA_OFFLOAD_MIN_BYTES 的内嵌媒体（图片、PDF 等）通过 Files API 上传到对应的API Provider，
+    请求改为以 fileData 引用文件 URI。按内容的 sha256 记录每个Provider上已上传的文件，
+    多轮对话中重复发送的同一份媒体只上传一次；文件临近过期或上游报告文件不存在时重新上传。
+    """
+
+    def __init__(
+        self,
+        api_client: GeminiApiClient,
+        min_bytes: int,
+        expiry_margin: int = MEDIA_OFFLOAD_EXPIRY_MARGIN,
+        failure_cooldown: int = MEDIA_OFFLOAD_FAILURE_COOLDOWN,
+    ):
+        self.api_client = api_client
+        self.min_bytes = max(1, min_bytes)
+        self.expiry_margin = max(0, expiry_margin)
+        self.failure_cooldown = max(0, failure_cooldown)
+
+        # (provider, sha256) -> UploadedFile
+        self.entries: Dict[Tuple[str, str], UploadedFile] = {}
+        # (provider, sha256) -> 上传失败后禁止重试的截止时间
+        self.failures: Dict[Tuple[str, str], float] = {}
+        self.locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    def _prune(self, now: float) -> None:
+        """防止记录无限增长"""
+        if len(self.entries) + len(self.failures) <= 4096:
+            return
+        for key in [k for k, entry in self.entries.items() if entry.expire_at <= now]:
+            self.entries.pop(key, None)
+            self.locks.pop(key, None)
+        for key in [k for k, until in self.failures.items() if until <= now]:
+            self.failures.pop(key, None)
+
+    async def _wait_active(self, base_url: str, file: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """视频等文件上传后需要处理一段时间才能引用"""
+        deadline = time.monotonic() + MEDIA_OFFLOAD_PROCESSING_TIMEOUT
+        while file.get("state") == "PROCESSING":
+            if time.monotonic() > deadline:
+                raise Exception(f"File {file.get('name')} is still processing")
+            await asyncio.sleep(1)
+            file = await self.api_client.get_file(base_url, file["name"], api_key)
+
+        if file.get("state", "ACTIVE") != "ACTIVE" or not file.get("uri"):
+            raise Exception(f"File {file.get('name')} is not usable: {file.get('state')}")
+        return file
+
+    @traced("media_offload.upload")
+    async def _upload(
+        self, base_url: str, media: InlineMedia, mime_type: str, digest: str, api_key: str
+    ) -> UploadedFile:
+        start = time.perf_counter()
+        file = await self.api_client.upload_file(base_url, media, mime_type, f"gnc2api-{digest[:16]}", api_key)
+        file = await self._wait_active(base_url, file, api_key)
+
+        expire_at = time.monotonic() + _seconds_until(file.get("expirationTime"))
+        logger.info(
+            f"Uploaded {media.decoded_size} bytes of {mime_type} to {base_url} as {file['name']} "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+        return UploadedFile(name=file["name"], uri=file["uri"], expire_at=expire_at)
+
+    async def _resolve(self, base_url: str, media: InlineMedia, mime_type: str, api_key: str) -> Optional[str]:
+        """返回媒体在Provider上的文件 URI，上传失败时返回None，由调用方继续内嵌发送"""
+        digest = await asyncio.to_thread(_sha256, media)
+        now, key = time.monotonic(), (base_url, digest)
+        if self.failures.get(key, 0) > now:
+            return None
+
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self.entries.get(key)
+            if entry and entry.expire_at - time.monotonic() > self.expiry_margin:
+                return entry.uri
+
+            try:
+                entry = self.entries[key] = await self._upload(base_url, media, mime_type, digest, api_key)
+                self.failures.pop(key, None)
+                return entry.uri
+            except Exception as e:
+                self.entries.pop(key, None)
+                self.failures[key] = time.monotonic() + self.failure_cooldown
+                logger.warning(f"Failed to upload media to {base_url}, sending it inline: {str(e)}")
+                return None
+
+    def _candidates(self, contents: List[Any]) -> List[Tuple[int, int, str]]:
+        """找出需要卸载的内嵌媒体，返回 (content 下标, part 下标, 字段名)"""
+        candidates = []
+        for i, content in enumerate(contents):
+            parts = content.get("parts") if isinstance(content, dict) else None
+            for j, part in enumerate(parts if isinstance(parts, list) else []):
+                for key in INLINE_DATA_KEYS:
+                    inline_data = part.get(key) if isinstance(part, dict) else None
+                    data = inline_data.get("data") if isinstance(inline_data, dict) else None
+                    if isinstance(data, str):
+                        data = InlineMedia(data)
+                    if isinstance(data, InlineMedia) and data.decoded_size >= self.min_bytes:
+                        candidates.append((i, j, key))
+        return candidates
+
+    async def apply(self, base_url: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """
+        将请求中较大的内嵌媒体替换为 Files API 的文件引用
+
+        Args:
+            base_url: API Provider地址
+            payload: 原始请求payload，不会被修改
+            api_key: API密钥
+
+        Returns:
+            Dict[str, Any]: 改写后的payload，没有需要卸载的媒体时返回原始payload
+        """
+        if not settings.MEDIA_OFFLOAD_ENABLED or not payload or not payload.get("contents"):
+            return payload
+
+        contents = payload["contents"]
+        candidates = self._candidates(contents)
+        if not candidates:
+            return payload
+
+        self._prune(time.monotonic())
+
+        async def resolve(i: int, j: int, key: str) -> Optional[str]:
+            inline_data = contents[i]["parts"][j][key]
+            data = inline_data["data"]
+            media = data if isinstance(data, InlineMedia) else InlineMedia(data)
+            mime_type = inline_data.get("mime_type") or inline_data.get("mimeType") or "application/octet-stream"
+            return await self._resolve(base_url, media, mime_type, api_key)
+
+        uris = await asyncio.gather(*(resolve(i, j, key) for i, j, key in candidates))
+
+        # 只复制被改写的 content 和 parts 列表，其余内容与原始payload共享
+        new_contents = list(contents)
+        for (i, j, key), uri in zip(candidates, uris):
+            if uri is None:
+                continue
+            if new_contents[i] is contents[i]:
+                new_contents[i] = {**contents[i], "parts": list(contents[i]["parts"])}
+            inline_data = contents[i]["parts"][j][key]
+            field, mime_field, uri_field = FILE_DATA_FIELDS[key]
+            mime_type = inline_data.get("mime_type") or inline_data.get("mimeType")
+            new_contents[i]["parts"][j] = {field: {mime_field: mime_type, uri_field: uri}}
+
+        return {**payload, "contents": new_contents}
+
+    def _referenced_uris(self, payload: Dict[str, Any]) -> List[str]:
+        uris = []
+        for content in payload.get("contents") or []:
+            for part in content.get("parts") or [] if isinstance(content, dict) else []:
+                for field, _, uri_field in FILE_DATA_FIELDS.values():
+                    file_data = part.get(field) if isinstance(part, dict) else None
+                    if isinstance(file_data, dict) and file_data.get(uri_field):
+                        uris.append(file_data[uri_field])
+        return uris
+
+    def handle_error(self, base_url: str, payload: Dict[str, Any], error: Exception) -> bool:
+        """
+        上游报告文件不存在或无权访问时移除请求引用的文件记录，下次请求时重新上传
+
+        Args:
+            base_url: API Provider地址
+            payload: 实际发送的payload
+            error: 上游返回的异常
+
+        Returns:
+            bool: 失败是否由文件失效引起，是则可以直接重试
+        """
+        message = str(error).lower()
+        if not payload or "file" not in message:
+            return False
+        if not any(hint in message for hint in ("not exist", "not found", "permission", "expired")):
+            return False
+
+        uris = set(self._referenced_uris(payload))
+        stale = [key for key, entry in self.entries.items() if key[0] == base_url and entry.uri in uris]
+        for key in stale:
+            logger.warning(f"File {self.entries[key].name} on {base_url} is no longer available")
+            self.entries.pop(key, None)
+        return bool(stale)
+
+
+media_offload_manager = MediaOffloadManager(
+    api_client=GeminiApiClient(settings.X_GOOG_API_CLIENT, timeout=settings.MAX_TIMEOUT),
+    min_bytes=settings.MEDIA_OFFLOAD_MIN_BYTES,
+)
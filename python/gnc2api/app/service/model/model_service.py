@@ -1,8 +1,6 @@
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional
 
-import requests
-
 from app.config.config import settings
 from app.log.logger import get_model_logger
 
@@ -539,6 +537,8 @@ class ModelService:
 
         api_key = "" if not isinstance(settings.OFFICIAL_API_KEY, str) else settings.OFFICIAL_API_KEY.strip()
         if api_key:
+            import requests
+
             url = f"{self.base_url}/models?key={api_key}"
 
             try:
@@ -566,6 +566,8 @@ class ModelService:
         return models
 
     def get_gemini_openai_models(self, provider: str) -> Optional[Dict[str, Any]]:
+        import requests
+
         try:
             gemini_models = self.get_gemini_models(provider)
             return self.convert_to_openai_models_format(gemini_models)
@@ -614,3 +616,15 @@ class ModelService:
             return model in self.image_models
 
         return model not in self.filtered_models
+
+
+_model_service: Optional[ModelService] = None
+
+
+def get_model_service() -> ModelService:
+    """获取 ModelService 单例，首次调用时创建"""
+    global _model_service
+
+    if _model_service is None:
+        _model_service = ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS)
+    return _model_service
@@ -0,0 +1,174 @@
+import bisect
+import hashlib
+import json
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app.core.constants import (
+    DEFAULT_AFFINITY_LOAD_FACTOR,
+    DEFAULT_AFFINITY_LOAD_HALF_LIFE,
+    DEFAULT_AFFINITY_MIN_CAPACITY,
+    DEFAULT_AFFINITY_VIRTUAL_NODES,
+    INLINE_MEDIA_MIN_LENGTH,
+)
+from app.utils.inline_media import InlineMedia
+
+
+def _hash(content: str) -> int:
+    """计算稳定的64位哈希值"""
+    digest = hashlib.blake2b(content.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _compact(value: Any) -> Any:
+    """把内嵌图片等长字符串替换为分块计算的摘要，避免序列化时复制整份数据"""
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    if isinstance(value, str) and len(value) >= INLINE_MEDIA_MIN_LENGTH:
+        value = InlineMedia(value)
+    if isinstance(value, InlineMedia):
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in value.chunks():
+            digest.update(chunk.encode("utf-8"))
+        return f"<<{len(value)}:{digest.hexdigest()}>>"
+    return value
+
+
+def build_conversation_key(
+    first_user_parts: Optional[List[Any]], system_parts: Optional[List[Any]] = None
+) -> Optional[str]:
+    """
+    根据系统指令和首条用户消息生成会话标识
+
+    多轮对话中这两部分保持不变，因此同一会话的每一轮都会得到相同的标识
+
+    Args:
+        first_user_parts: 首条用户消息的内容
+        system_parts: 系统指令的内容
+
+    Returns:
+        Optional[str]: 会话标识，无法生成时返回None
+    """
+    if not first_user_parts and not system_parts:
+        return None
+
+    content = json.dumps(
+        _compact({"system": system_parts or [], "user": first_user_parts or []}),
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def extract_gemini_conversation_key(body: Dict[str, Any]) -> Optional[str]:
+    """从Gemini格式的请求体中提取会话标识"""
+    if not body or not isinstance(body, dict):
+        return None
+
+    first_user_parts = None
+    for content in body.get("contents") or []:
+        if isinstance(content, dict) and content.get("role", "user") == "user":
+            first_user_parts = content.get("parts")
+            break
+
+    instruction = body.get("systemInstruction") or body.get("system_instruction")
+    system_parts = instruction.get("parts") if isinstance(instruction, dict) else None
+    return build_conversation_key(first_user_parts, system_parts)
+
+
+class AffinityRouter:
+    """
+    会话亲和路由器
+
+    使用一致性哈希将同一会话固定到同一个API Provider，以便复用上游的前缀缓存；
+    同时采用有界负载（bounded load）策略，避免热点会话把单个Provider压垮。
+    负载以指数衰减的近期分配次数来衡量，无需在请求结束时显式释放。
+    """
+
+    def __init__(
+        self,
+        providers: Iterable[str],
+        virtual_nodes: int = DEFAULT_AFFINITY_VIRTUAL_NODES,
+        load_factor: float = DEFAULT_AFFINITY_LOAD_FACTOR,
+        half_life: float = DEFAULT_AFFINITY_LOAD_HALF_LIFE,
+    ):
+        self.virtual_nodes = max(1, virtual_nodes)
+        self.load_factor = max(1.0, load_factor)
+        self.half_life = max(1.0, half_life)
+        self.loads: Dict[str, float] = {}
+        self.updated_at: Dict[str, float] = {}
+        self.ring: List[tuple[int, str]] = []
+        self.ring_keys: List[int] = []
+        self.rebuild(providers)
+
+    def rebuild(self, providers: Iterable[str]) -> None:
+        """根据Provider列表重建哈希环，保留已有Provider的负载信息"""
+        providers = list(dict.fromkeys(providers))
+        ring = []
+        for provider in providers:
+            for i in range(self.virtual_nodes):
+                ring.append((_hash(f"{provider}#{i}"), provider))
+        ring.sort()
+
+        self.ring = ring
+        self.ring_keys = [item[0] for item in ring]
+        self.loads = {p: self.loads.get(p, 0.0) for p in providers}
+        self.updated_at = {p: self.updated_at.get(p, 0.0) for p in providers}
+
+    def _current_load(self, provider: str, now: float) -> float:
+        load = self.loads.get(provider, 0.0)
+        if load <= 0:
+            return 0.0
+
+        elapsed = now - self.updated_at.get(provider, now)
+        return load * math.pow(0.5, elapsed / self.half_life)
+
+    def _record(self, provider: str, now: float) -> None:
+        self.loads[provider] = self._current_load(provider, now) + 1.0
+        self.updated_at[provider] = now
+
+    def select(self, key: str, candidates: Set[str]) -> Optional[str]:
+        """
+        为会话标识选择Provider
+
+        Args:
+            key: 会话标识
+            candidates: 当前健康、可接收流量的Provider集合
+
+        Returns:
+            Optional[str]: 选中的Provider，无可用Provider时返回None
+        """
+        candidates = {p for p in candidates if p in self.loads}
+        if not key or not candidates or not self.ring:
+            return None
+
+        now = time.monotonic()
+        loads = {p: self._current_load(p, now) for p in candidates}
+        # 流量较低时负载上限过小会导致会话频繁漂移，因此设置一个最低上限
+        capacity = max(
+            DEFAULT_AFFINITY_MIN_CAPACITY,
+            math.ceil(self.load_factor * (sum(loads.values()) + 1) / len(candidates)),
+        )
+
+        # 顺时针遍历哈希环，选择第一个健康且未超出负载上限的Provider
+        start, visited = bisect.bisect(self.ring_keys, _hash(key)), set()
+        for i in range(len(self.ring)):
+            provider = self.ring[(start + i) % len(self.ring)][1]
+            if provider in visited or provider not in candidates:
+                continue
+
+            visited.add(provider)
+            if loads[provider] + 1 <= capacity:
+                self._record(provider, now)
+                return provider
+
+            if len(visited) == len(candidates):
+                break
+
+        provider = min(candidates, key=lambda p: loads[p])
+        self._record(provider, now)
+        return provider
@@ -0,0 +1,161 @@
+import asyncio
+import re
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from app.core.constants import DEFAULT_MODEL_CATALOG_REFRESH_INTERVAL
+from app.log.logger import get_provider_manager_logger
+from app.service.client.api_client import GeminiApiClient
+from app.service.key.key_generator import get_key
+
+logger = get_provider_manager_logger()
+
+# 上游返回的“模型不存在”错误（HTTP 404），与Provider不可用区分开
+# 只匹配上游的标准错误信息，"... for model xxx is not supported" 之类的功能级错误不代表Provider不支持该模型
+MODEL_UNSUPPORTED_PATTERN = re.compile(r"models/[\w.\-]+ is not found for API version", flags=re.I)
+
+# ApiClient 抛出的异常信息中携带的HTTP状态码
+STATUS_CODE_PATTERN = re.compile(r"status code (\d{3})")
+
+
+def normalize_model(model: str) -> str:
+    """去掉网关自定义的模型后缀，得到上游真实的模型名称"""
+    model = (model or "").strip().removeprefix("models/")
+    if model.endswith("-search"):
+        model = model[:-7]
+    if model.endswith("-image"):
+        model = model[:-6]
+    return model
+
+
+def is_model_unsupported_error(error: BaseException) -> bool:
+    """判断异常（或其直接原因）是否表示上游不支持请求的模型"""
+    while error is not None:
+        message = str(error)
+        status = STATUS_CODE_PATTERN.search(message)
+        if MODEL_UNSUPPORTED_PATTERN.search(message) and (not status or status.group(1) == "404"):
+            return True
+        error = error.__cause__
+    return False
+
+
+class ModelCatalog:
+    """
+    各API Provider支持的模型目录
+
+    后台定期拉取每个Provider的模型列表，维护 模型 -> Provider集合 的索引。
+    尚未成功拉取过模型列表的Provider视为支持所有模型，避免目录不可用时拒绝请求。
+    """
+
+    def __init__(self, api_client: GeminiApiClient, refresh_interval: int = DEFAULT_MODEL_CATALOG_REFRESH_INTERVAL):
+        self.api_client = api_client
+        self.refresh_interval = max(30, refresh_interval)
+
+        # provider -> 支持的模型集合，刷新时整体替换
+        self.catalogs: Dict[str, FrozenSet[str]] = {}
+        # model -> 支持该模型的provider集合，由 catalogs 派生
+        self.model_index: Dict[str, FrozenSet[str]] = {}
+        # provider -> 上游明确报告不支持的模型，下次成功刷新该Provider时清除
+        self.unsupported: Dict[str, Set[str]] = {}
+        self.refreshed_at: Dict[str, float] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def _rebuild_index(self) -> None:
+        index: Dict[str, Set[str]] = {}
+        for provider, models in self.catalogs.items():
+            for model in models:
+                index.setdefault(model, set()).add(provider)
+
+        self.model_index = {k: frozenset(v) for k, v in index.items()}
+
+    async def refresh_provider(self, provider: str) -> bool:
+        """拉取单个Provider的模型列表，失败时保留上一次的结果"""
+        try:
+            models = await self.api_client.list_models(provider, get_key())
+        except Exception as e:
+            logger.warning(f"Failed to fetch model list from {provider}: {str(e)}")
+            return False
+
+        names = frozenset(normalize_model(m.get("name", "")) for m in models if m.get("name"))
+        if not names:
+            logger.warning(f"Provider {provider} returned an empty model list, keep previous catalog")
+            return False
+
+        self.catalogs[provider] = names
+        self.unsupported.pop(provider, None)
+        self.refreshed_at[provider] = time.time()
+        return True
+
+    async def refresh(self, providers: Iterable[str]) -> None:
+        """并发刷新所有Provider的模型目录"""
+        providers = list(providers)
+        results = await asyncio.gather(*(self.refresh_provider(p) for p in providers))
+
+        self.retain(providers)
+        logger.info(
+            f"Model catalog refreshed, {sum(results)}/{len(providers)} providers, {len(self.model_index)} models"
+        )
+
+    def retain(self, providers: Iterable[str]) -> None:
+        """移除已经不在配置中的Provider并重建索引"""
+        providers = set(providers)
+        for provider in set(self.catalogs) - providers:
+            self.catalogs.pop(provider, None)
+            self.refreshed_at.pop(provider, None)
+        for provider in set(self.unsupported) - providers:
+            self.unsupported.pop(provider, None)
+
+        self._rebuild_index()
+
+    def supports(self, provider: str, model: str) -> Optional[bool]:
+        """
+        判断Provider是否支持指定模型
+
+        Returns:
+            Optional[bool]: 目录未知时返回None
+        """
+        name = normalize_model(model)
+        if name in self.unsupported.get(provider, ()):
+            return False
+        if provider not in self.catalogs:
+            return None
+        return provider in self.model_index.get(name, ())
+
+    def filter(self, model: str, providers: Iterable[str]) -> List[str]:
+        """返回可能支持该模型的Provider（已确认支持或目录未知），保持原有顺序"""
+        name = normalize_model(model)
+        supported = self.model_index.get(name, frozenset())
+        return [
+            p
+            for p in providers
+            if (p in supported or p not in self.catalogs) and name not in self.unsupported.get(p, ())
+        ]
+
+    def mark_unsupported(self, provider: str, model: str) -> None:
+        """上游明确报告不支持该模型时，在下次刷新前不再把该模型路由到这个Provider"""
+        name = normalize_model(model)
+        if name not in self.unsupported.setdefault(provider, set()):
+            self.unsupported[provider].add(name)
+            logger.warning(f"Provider {provider} does not support model {name}")
+
+    async def _refresh_loop(self, get_providers: Callable[[], Iterable[str]]) -> None:
+        while True:
+            try:
+                await self.refresh(get_providers())
+            except Exception as e:
+                logger.error(f"Model catalog refresh failed: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, get_providers: Callable[[], Iterable[str]]) -> None:
+        """启动后台刷新任务"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._refresh_loop(get_providers))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
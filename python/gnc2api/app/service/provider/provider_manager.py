@@ -1,9 +1,17 @@
 import asyncio
 from itertools import cycle
-from typing import Dict
+from typing import Dict, List, Optional, Set
 
 from app.config.config import settings
+from app.core.constants import PROVIDER_WARMUP_TIMEOUT
+from app.exception.exceptions import ModelNotSupportedError, UpstreamDeadlineError
 from app.log.logger import get_provider_manager_logger
+from app.service.client.api_client import GeminiApiClient
+from app.service.client.client_pool import client_pool
+from app.service.client.deadlines import deadline_tracker
+from app.service.key.key_generator import get_key
+from app.service.provider.affinity_router import AffinityRouter
+from app.service.provider.model_catalog import ModelCatalog, is_model_unsupported_error
 
 logger = get_provider_manager_logger()
 
@@ -13,9 +21,20 @@ class ProviderManager:
         self.providers = providers
         self.provider_cycle = cycle(providers)
         self.provider_cycle_lock = asyncio.Lock()
+        self.capable_offset = -1
         self.failure_count_lock = asyncio.Lock()
         self.provider_failure_counts: Dict[str, int] = {provider: 0 for provider in providers}
         self.MAX_FAILURES = settings.MAX_FAILURES
+        self.affinity_router = AffinityRouter(
+            providers,
+            virtual_nodes=settings.AFFINITY_VIRTUAL_NODES,
+            load_factor=settings.AFFINITY_LOAD_FACTOR,
+            half_life=settings.AFFINITY_LOAD_HALF_LIFE,
+        )
+        self.api_client = GeminiApiClient(settings.X_GOOG_API_CLIENT, timeout=settings.MAX_TIMEOUT)
+        self.model_catalog = ModelCatalog(self.api_client, refresh_interval=settings.MODEL_CATALOG_REFRESH_INTERVAL)
+        self.reload_lock = asyncio.Lock()
+        self.drain_tasks: Set[asyncio.Task] = set()
 
     async def get_next_provider(self) -> str:
         async with self.provider_cycle_lock:
@@ -23,33 +42,164 @@ class ProviderManager:
 
     async def is_provider_valid(self, provider: str) -> bool:
         async with self.failure_count_lock:
-            return self.provider_failure_counts[provider] < self.MAX_FAILURES
+            return self.provider_failure_counts.get(provider, 0) < self.MAX_FAILURES
 
     async def reset_failure_counts(self):
         async with self.failure_count_lock:
             for provider in self.provider_failure_counts:
                 self.provider_failure_counts[provider] = 0
 
-    async def get_next_working_provider(self) -> str:
-        initial_provider = await self.get_next_provider()
-        current_provider = initial_provider
-
-        while True:
+    async def warm_up(self) -> None:
+        """预先建立到所有Provider的连接，使启动后的首批请求不必等待 DNS 解析和 TLS 握手"""
+        api_key = get_key()
+        results = await asyncio.gather(
+            *(self.api_client.warm_up(p, api_key, timeout=PROVIDER_WARMUP_TIMEOUT) for p in self.providers),
+            return_exceptions=True,
+        )
+        warmed = sum(1 for result in results if result is True)
+        logger.info(f"Warmed connections to {warmed}/{len(self.providers)} providers")
+
+    def start_model_catalog(self) -> None:
+        """启动模型目录的后台刷新任务"""
+        if settings.MODEL_CATALOG_ENABLED:
+            self.model_catalog.start(lambda: self.providers)
+
+    async def stop_model_catalog(self) -> None:
+        await self.model_catalog.stop()
+
+    def get_capable_providers(self, model: Optional[str]) -> list:
+        """
+        获取可以处理该模型的Provider
+
+        Raises:
+            ModelNotSupportedError: 没有任何Provider支持该模型
+        """
+        if not model or not settings.MODEL_CATALOG_ENABLED:
+            return self.providers
+
+        providers = self.model_catalog.filter(model, self.providers)
+        if not providers:
+            raise ModelNotSupportedError(model)
+        return providers
+
+    async def get_affinity_provider(self, affinity_key: str, model: Optional[str] = None) -> Optional[str]:
+        """根据会话标识选择Provider，使同一会话尽量落在同一个Provider上"""
+        capable = set(self.get_capable_providers(model))
+        async with self.failure_count_lock:
+            candidates = {
+                p for p, count in self.provider_failure_counts.items() if count < self.MAX_FAILURES and p in capable
+            }
+
+        return self.affinity_router.select(affinity_key, candidates)
+
+    async def get_next_working_provider(self, model: Optional[str] = None, affinity_key: Optional[str] = None) -> str:
+        """
+        获取下一个可用的Provider
+
+        Args:
+            model: 请求的模型，指定时只返回支持该模型的Provider
+            affinity_key: 会话标识，指定时优先使用会话亲和路由
+
+        Raises:
+            ModelNotSupportedError: 没有任何Provider支持该模型
+        """
+        capable = self.get_capable_providers(model)
+        if affinity_key and settings.AFFINITY_ROUTING_ENABLED:
+            provider = await self.get_affinity_provider(affinity_key, model)
+            if provider:
+                return provider
+
+        if len(capable) < len(self.providers):
+            # 只有部分Provider支持该模型，在这些Provider中轮询
+            async with self.failure_count_lock:
+                working = [p for p in capable if self.provider_failure_counts.get(p, 0) < self.MAX_FAILURES]
+            candidates = working or capable
+            async with self.provider_cycle_lock:
+                self.capable_offset = (self.capable_offset + 1) % len(candidates)
+                return candidates[self.capable_offset]
+
+        # 最多轮询一圈，Provider列表在轮询期间被替换时也能结束
+        current_provider = await self.get_next_provider()
+        for _ in range(len(self.providers) - 1):
             if await self.is_provider_valid(current_provider):
                 return current_provider
-
             current_provider = await self.get_next_provider()
-            if current_provider == initial_provider:
-                return current_provider
 
-    async def handle_api_failure(self, provider: str) -> str:
+        return current_provider
+
+    async def handle_api_failure(self, provider: str, model: Optional[str] = None) -> str:
         """处理API调用失败"""
         async with self.failure_count_lock:
-            self.provider_failure_counts[provider] += 1
-            if self.provider_failure_counts[provider] >= self.MAX_FAILURES:
+            if provider in self.provider_failure_counts:
+                self.provider_failure_counts[provider] += 1
+            if self.provider_failure_counts.get(provider, 0) >= self.MAX_FAILURES:
                 logger.warning(f"API provider {provider} has failed {self.MAX_FAILURES} times")
 
-        return await self.get_next_working_provider()
+        return await self.get_next_working_provider(model=model)
+
+    async def handle_model_unsupported(self, provider: str, model: str) -> str:
+        """
+        处理上游不支持请求模型的情况，不计入Provider的失败次数
+
+        Raises:
+            ModelNotSupportedError: 没有其他Provider支持该模型
+        """
+        self.model_catalog.mark_unsupported(provider, model)
+        return await self.get_next_working_provider(model=model)
+
+    async def handle_request_failure(self, provider: str, model: Optional[str], error: Exception) -> str:
+        """根据失败原因切换Provider：模型不支持时只排除该模型，其余情况（包括阶段超时）计入Provider失败次数"""
+        if model and is_model_unsupported_error(error):
+            return await self.handle_model_unsupported(provider, model)
+        if isinstance(error, UpstreamDeadlineError):
+            logger.warning(f"API provider {provider} timed out in the {error.phase} phase, switching provider")
+        return await self.handle_api_failure(provider, model)
+
+    async def reload(self, providers: List[str]) -> Dict[str, List[str]]:
+        """
+        热更新Provider列表
+
+        新增的Provider先预热连接并拉取模型目录，再与现有列表一起原子替换；
+        保留的Provider沿用原有的失败计数和亲和负载；被移除的Provider不再接收新请求，
+        其进行中的请求（包括流式响应）结束后再关闭连接
+
+        Args:
+            providers: 新的Provider列表
+
+        Returns:
+            Dict[str, List[str]]: 新增、移除和保留的Provider
+        """
+        providers = list(dict.fromkeys(p.strip() for p in providers if p and p.strip()))
+        if not providers:
+            raise ValueError("API providers cannot be empty")
+
+        async with self.reload_lock:
+            current = set(self.providers)
+            added = [p for p in providers if p not in current]
+            removed = [p for p in self.providers if p not in set(providers)]
+
+            if added:
+                api_key = get_key()
+                await asyncio.gather(*(self.api_client.warm_up(p, api_key) for p in added))
+                if settings.MODEL_CATALOG_ENABLED:
+                    await asyncio.gather(*(self.model_catalog.refresh_provider(p) for p in added))
+
+            # 以下替换过程中没有 await，对并发请求而言是原子的
+            self.providers = providers
+            self.provider_cycle = cycle(providers)
+            self.capable_offset = -1
+            self.provider_failure_counts = {p: self.provider_failure_counts.get(p, 0) for p in providers}
+            self.affinity_router.rebuild(providers)
+            self.model_catalog.retain(providers)
+            deadline_tracker.retain(providers)
+
+            for provider in removed:
+                task = asyncio.create_task(client_pool.drain(provider, settings.PROVIDER_DRAIN_TIMEOUT))
+                self.drain_tasks.add(task)
+                task.add_done_callback(self.drain_tasks.discard)
+
+        logger.info(f"Providers reloaded, added: {added}, removed: {removed}, total: {len(providers)}")
+        return {"added": added, "removed": removed, "kept": [p for p in providers if p in current]}
 
     def get_fail_count(self, provider: str) -> int:
         return self.provider_failure_counts.get(provider, 0)
@@ -60,13 +210,17 @@ class ProviderManager:
 
         async with self.failure_count_lock:
             for provider in self.providers:
-                fail_count = self.provider_failure_counts[provider]
+                fail_count = self.provider_failure_counts.get(provider, 0)
                 if fail_count < self.MAX_FAILURES:
                     valid_providers[provider] = fail_count
                 else:
                     invalid_providers[provider] = fail_count
 
-        return {"valid_providers": valid_providers, "invalid_providers": invalid_providers}
+        return {
+            "valid_providers": valid_providers,
+            "invalid_providers": invalid_providers,
+            "deadlines": deadline_tracker.snapshot(),
+        }
 
     async def get_first_valid_provider(self) -> str:
         """获取第一个有效的API Provider"""
@@ -5,10 +5,10 @@
 import json
 import re
 import base64
-import requests
 from typing import Dict, Any, List, Optional, Tuple
 
-from app.core.constants import DATA_URL_PATTERN, IMAGE_URL_PATTERN, VALID_IMAGE_RATIOS
+from app.core.constants import IMAGE_URL_PATTERN, LOG_MAX_INLINE_LENGTH, VALID_IMAGE_RATIOS
+from app.utils.inline_media import InlineMedia, parse_data_url
 
 
 def extract_mime_type_and_data(base64_string: str) -> Tuple[Optional[str], str]:
@@ -21,18 +21,9 @@ def extract_mime_type_and_data(base64_string: str) -> Tuple[Optional[str], str]:
     Returns:
         tuple: (mime_type, encoded_data)
     """
-    # 检查字符串是否以 "data:" 格式开始
-    if base64_string.startswith("data:"):
-        # 提取 MIME 类型和数据
-        pattern = DATA_URL_PATTERN
-        match = re.match(pattern, base64_string)
-        if match:
-            mime_type = "image/jpeg" if match.group(1) == "image/jpg" else match.group(1)
-            encoded_data = match.group(2)
-            return mime_type, encoded_data
-
+    mime_type, data = parse_data_url(base64_string)
     # 如果不是预期格式，假定它只是数据部分
-    return None, base64_string
+    return mime_type, data.value() if isinstance(data, InlineMedia) else data
 
 
 def convert_image_to_base64(url: str) -> str:
@@ -48,6 +39,8 @@ def convert_image_to_base64(url: str) -> str:
     Raises:
         Exception: 如果获取图片失败
     """
+    import requests
+
     response = requests.get(url)
     if response.status_code == 200:
         # 将图片内容转换为base64
@@ -57,6 +50,46 @@ def convert_image_to_base64(url: str) -> str:
         raise Exception(f"Failed to fetch image: {response.status_code}")
 
 
+async def read_json_body(request: Any) -> Optional[Any]:
+    """
+    读取请求体中的JSON数据
+
+    Starlette 会缓存解析结果，路由解析过请求体后再次调用不会重复解析
+
+    Args:
+        request: Starlette 请求对象
+
+    Returns:
+        Optional[Any]: 解析后的JSON数据，请求体为空或格式无效时返回None
+    """
+    try:
+        return await request.json()
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def redact_inline_data(data: Any, key: str = "") -> Any:
+    """
+    生成用于日志的请求副本，内嵌的 base64 数据只记录长度
+
+    Args:
+        data: 请求数据
+        key: 当前值所在的字段名
+
+    Returns:
+        Any: 替换了内嵌数据的副本，其余内容引用原值
+    """
+    if isinstance(data, dict):
+        return {k: redact_inline_data(v, k) for k, v in data.items()}
+    if isinstance(data, list):
+        return [redact_inline_data(v, key) for v in data]
+    if isinstance(data, InlineMedia):
+        return f"<{len(data)} chars>"
+    if isinstance(data, str) and len(data) > LOG_MAX_INLINE_LENGTH and (key == "data" or data.startswith("data:")):
+        return f"{data[:32]}...<{len(data)} chars>"
+    return data
+
+
 def format_json_response(data: Dict[str, Any], indent: int = 2) -> str:
     """
     格式化JSON响应
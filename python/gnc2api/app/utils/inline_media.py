@@ -0,0 +1,216 @@
+"""
+内嵌媒体（base64 图片等）的处理工具
+
+多模态请求中的 base64 数据往往有数 MB，这里的函数都不复制这些字符串：
+data URL 只解析开头的元信息，数据部分以 InlineMedia 引用原始字符串，
+发送上游请求时再分块编码写出。该模块不依赖应用配置。
+"""
+
+import base64
+import json
+import re
+import uuid
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+from app.core.constants import DATA_URL_HEADER_MAX_LENGTH, INLINE_MEDIA_CHUNK_SIZE, INLINE_MEDIA_MIN_LENGTH
+
+# 需要转义或编码后长度会变化的字符，base64 数据通常不包含
+_NEEDS_ESCAPE = re.compile(r'["\\\x00-\x1f\x7f-\U0010ffff]')
+_NOT_BASE64 = re.compile(r"[^A-Za-z0-9+/=]")
+
+INLINE_DATA_KEYS = ("inline_data", "inlineData")
+
+
+class InlineMedia:
+    """原始字符串中 base64 数据的引用，数据从 offset 开始直到字符串末尾"""
+
+    __slots__ = ("source", "offset")
+
+    def __init__(self, source: str, offset: int = 0):
+        self.source = source
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return len(self.source) - self.offset
+
+    def __repr__(self) -> str:
+        return f"<InlineMedia {len(self)} chars>"
+
+    @property
+    def decoded_size(self) -> int:
+        """解码后的大致字节数"""
+        return len(self) * 3 // 4
+
+    def chunks(self, size: int = INLINE_MEDIA_CHUNK_SIZE) -> Iterator[str]:
+        """分块读取数据，每次只复制 size 个字符"""
+        for start in range(self.offset, len(self.source), size):
+            yield self.source[start : start + size]
+
+    def value(self) -> str:
+        """复制出完整的数据，只在无法分块处理时使用"""
+        return self.source[self.offset :] if self.offset else self.source
+
+    def decoded(self) -> Tuple[int, Iterator[bytes]]:
+        """
+        分块解码 base64 数据
+
+        Returns:
+            tuple: (解码后的字节数, 逐块解码的迭代器)，数据包含换行等非 base64 字符时整体解码
+        """
+        size = len(self)
+        if size % 4 or _NOT_BASE64.search(self.source, self.offset):
+            data = base64.b64decode(self.value())
+            return len(data), iter((data,))
+
+        padding = len(self.source[-2:]) - len(self.source[-2:].rstrip("="))
+        # 分块大小是 4 的倍数，每块都可以单独解码
+        return size // 4 * 3 - padding, (base64.b64decode(chunk) for chunk in self.chunks())
+
+
+def parse_data_url(url: str) -> Tuple[Optional[str], Union[InlineMedia, str]]:
+    """
+    解析 base64 格式的 data URL
+
+    只在开头的有限长度内查找分隔符，不对整个字符串做正则匹配
+
+    Returns:
+        tuple: (mime_type, data)，不是 base64 data URL 时返回 (None, 原字符串)
+    """
+    if not url.startswith("data:"):
+        return None, url
+
+    comma = url.find(",", 5, DATA_URL_HEADER_MAX_LENGTH)
+    if comma < 0:
+        return None, url
+
+    mime_type, _, params = url[5:comma].partition(";")
+    if not mime_type or "base64" not in params.split(";"):
+        return None, url
+
+    if mime_type == "image/jpg":
+        mime_type = "image/jpeg"
+    return mime_type, InlineMedia(url, comma + 1)
+
+
+def _media_size(value: Any) -> int:
+    if isinstance(value, InlineMedia):
+        return value.decoded_size
+    if isinstance(value, str):
+        if value.startswith("data:"):
+            _, data = parse_data_url(value)
+            return len(data) * 3 // 4 if isinstance(data, InlineMedia) else 0
+        return len(value) * 3 // 4
+    return 0
+
+
+def _parts_media_size(parts: Any) -> int:
+    size = 0
+    for part in parts if isinstance(parts, list) else []:
+        if not isinstance(part, dict):
+            continue
+        for key in INLINE_DATA_KEYS:
+            if isinstance(part.get(key), dict):
+                size += _media_size(part[key].get("data"))
+        if part.get("type") == "image_url" and isinstance(part.get("image_url"), dict):
+            url = part["image_url"].get("url")
+            if isinstance(url, str) and url.startswith("data:"):
+                size += _media_size(url)
+    return size
+
+
+def inline_media_size(body: Any) -> int:
+    """
+    统计请求中内嵌媒体解码后的总字节数
+
+    同时支持 OpenAI 格式（messages 中的 image_url data URL）和 Gemini 格式（parts 中的 inline_data）
+    """
+    if not isinstance(body, dict):
+        return 0
+
+    size = 0
+    for message in body.get("messages") or []:
+        if isinstance(message, dict):
+            size += _parts_media_size(message.get("content"))
+    for content in body.get("contents") or []:
+        if isinstance(content, dict):
+            size += _parts_media_size(content.get("parts"))
+    for key in ("systemInstruction", "system_instruction"):
+        if isinstance(body.get(key), dict):
+            size += _parts_media_size(body[key].get("parts"))
+    return size
+
+
+def wrap_inline_data(contents: List[Any]) -> List[Any]:
+    """把 Gemini 格式 parts 中较大的 base64 数据替换为 InlineMedia，原地修改并返回"""
+    for content in contents or []:
+        parts = content.get("parts") if isinstance(content, dict) else None
+        for part in parts if isinstance(parts, list) else []:
+            for key in INLINE_DATA_KEYS:
+                inline_data = part.get(key) if isinstance(part, dict) else None
+                if not isinstance(inline_data, dict):
+                    continue
+                data = inline_data.get("data")
+                if isinstance(data, str) and len(data) >= INLINE_MEDIA_MIN_LENGTH:
+                    inline_data["data"] = InlineMedia(data)
+    return contents
+
+
+def _dumps(value: Any, default=None) -> str:
+    # 与 httpx 的 json= 参数保持相同的编码方式
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), allow_nan=False, default=default)
+
+
+def _escaped_chunks(media: InlineMedia) -> Iterator[bytes]:
+    for chunk in media.chunks():
+        yield _dumps(chunk)[1:-1].encode("utf-8")
+
+
+class JsonBody:
+    """
+    分块写出的 JSON 请求体
+
+    InlineMedia 以外的部分照常序列化（通常只有几 KB），InlineMedia 的数据在发送时
+    逐块编码写出，因此不会在内存中生成完整请求体的字符串和字节串两份副本。
+    长度预先计算好，以 Content-Length 而不是分块传输编码发送。
+    """
+
+    def __init__(self, payload: Any):
+        media: List[InlineMedia] = []
+        marker = f"inline-media-{uuid.uuid4().hex}"
+
+        def default(value: Any) -> str:
+            if isinstance(value, InlineMedia):
+                media.append(value)
+                return marker
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+        pieces = _dumps(payload, default).split(f'"{marker}"')
+        self.pieces = [piece.encode("utf-8") for piece in pieces]
+        self.media = media
+        # 不需要转义的数据原样写出，长度就是字符数
+        self.raw = [not _NEEDS_ESCAPE.search(m.source, m.offset) for m in media]
+
+        self.length = sum(len(piece) for piece in self.pieces) + 2 * len(media)
+        for item, raw in zip(media, self.raw):
+            self.length += len(item) if raw else sum(len(chunk) for chunk in _escaped_chunks(item))
+
+    def _media_chunks(self, index: int) -> Iterator[bytes]:
+        if self.raw[index]:
+            return (chunk.encode("ascii") for chunk in self.media[index].chunks())
+        return _escaped_chunks(self.media[index])
+
+    def _chunks(self) -> Iterator[bytes]:
+        yield self.pieces[0]
+        for index in range(len(self.media)):
+            yield b'"'
+            yield from self._media_chunks(index)
+            yield b'"'
+            yield self.pieces[index + 1]
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        # 只提供异步迭代，httpx 的 AsyncClient 不接受同步的请求体
+        for chunk in self._chunks():
+            yield chunk
+
+    def headers(self) -> dict:
+        return {"Content-Length": str(self.length)}
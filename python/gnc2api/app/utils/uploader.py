@@ -1,4 +1,5 @@
 import requests
+from app.config.config import settings
 from app.domain.image_models import ImageMetadata, ImageUploader, UploadResponse
 from enum import Enum
 from typing import Optional, Any
@@ -335,3 +336,18 @@ class ImageUploaderFactory:
         elif provider == "cloudflare_imgbed":
             return CloudFlareImgBedUploader(credentials["auth_code"], credentials["base_url"])
         raise ValueError(f"Unknown provider: {provider}")
+
+
+def create_configured_uploader() -> ImageUploader:
+    """按 UPLOAD_PROVIDER 配置创建图片上传器"""
+    if settings.UPLOAD_PROVIDER == "smms":
+        return ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER, api_key=settings.SMMS_SECRET_TOKEN)
+    elif settings.UPLOAD_PROVIDER == "picgo":
+        return ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER, api_key=settings.PICGO_API_KEY)
+    elif settings.UPLOAD_PROVIDER == "cloudflare_imgbed":
+        return ImageUploaderFactory.create(
+            provider=settings.UPLOAD_PROVIDER,
+            base_url=settings.CLOUDFLARE_IMGBED_URL,
+            auth_code=settings.CLOUDFLARE_IMGBED_AUTH_CODE,
+        )
+    raise ValueError(f"Unknown upload provider: {settings.UPLOAD_PROVIDER}")
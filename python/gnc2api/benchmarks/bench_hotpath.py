@@ -0,0 +1,581 @@
+"""
+请求热路径上纯函数的微基准测试
+
+每个请求都会经过消息转换、payload 构建、响应提取等纯 CPU 函数，这里用固定的、贴近真实流量的
+数据（长对话历史、大量工具声明、思考模型响应、搜索引用）逐个计时，不启动网关和上游。
+
+用法:
+    # 运行全部用例并保存报告
+    python benchmarks/bench_hotpath.py --output reports/hotpath.json
+
+    # 与之前保存的报告对比，任一用例变慢超过 10% 时返回非零退出码
+    python benchmarks/bench_hotpath.py --compare reports/hotpath.json --threshold 0.1
+
+    # 只运行名称包含 extract 的用例
+    python benchmarks/bench_hotpath.py --filter extract
+
+计时方式与 timeit 相同：关闭 GC，自动确定每轮调用次数，重复多轮后取中位数。
+会修改入参的函数每次调用前都会准备一份新的参数，准备时间不计入结果。
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 导入应用模块前需要的最少配置，不依赖本地的 .env
+os.environ.setdefault("API_PROVIDERS", '["http://127.0.0.1:1/v1beta"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["sk-bench"]')
+
+from replay import git_revision
+
+from app.config.config import settings
+from app.domain.gemini_models import GeminiRequest
+from app.domain.openai_models import ChatRequest
+from app.handler.message_converter import OpenAIMessageConverter
+from app.handler.response_handler import _extract_result, _extract_tool_calls, _handle_openai_stream_response
+from app.handler.stream_optimizer import StreamOptimizer
+from app.service.chat import gemini_chat_service, openai_chat_service
+from app.service.model.model_service import ModelService
+
+MODEL = "gemini-2.0-flash"
+THINKING_MODEL = "gemini-2.0-flash-thinking-exp"
+SEARCH_MODEL = "gemini-2.0-flash-exp"
+SEED = 20240601
+
+# 报告格式有不兼容的变化时递增，对比时拒绝不同版本的基线
+REPORT_VERSION = 1
+
+
+@dataclass
+class Case:
+    """一个基准用例，make_args 返回调用 func 的位置参数"""
+
+    name: str
+    func: Callable[..., Any]
+    make_args: Callable[[], Tuple[Any, ...]]
+    # func 会修改入参时为True，每次调用前深拷贝一份参数
+    mutates: bool = False
+    description: str = ""
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+def _pin_settings() -> None:
+    """固定影响被测函数分支的配置，使结果不受本地环境影响"""
+    settings.SHOW_THINKING_PROCESS = True
+    settings.SHOW_SEARCH_LINK = True
+    settings.TOOLS_CODE_EXECUTION_ENABLED = False
+    settings.SEARCH_MODELS = [SEARCH_MODEL]
+    settings.IMAGE_MODELS = [SEARCH_MODEL]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    vocabulary = (
+        "the gateway forwards each request to an upstream provider and converts the response back "
+        "into the format expected by the client while keeping latency low 流式 输出 会 话 工具 调用 模型"
+    ).split()
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def _paragraphs(rng: random.Random, count: int, words: int) -> str:
+    return "\n\n".join(_sentence(rng, words) for _ in range(count))
+
+
+def build_tools(count: int) -> List[Dict[str, Any]]:
+    """OpenAI 格式的函数工具，参数结构参考常见的 agent 工具"""
+    tools = []
+    for i in range(count):
+        properties = {
+            "path": {"type": "string", "description": f"File path for operation {i}"},
+            "limit": {"type": "integer", "description": "Maximum number of results", "minimum": 1},
+            "mode": {"type": "string", "enum": ["fast", "accurate", "balanced"]},
+            "filters": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"field": {"type": "string"}, "value": {"type": "string"}},
+                    "required": ["field", "value"],
+                },
+            },
+        }
+        tools.append(
+            {
+                "type": "function",
+                "function": {
+                    "name": f"tool_{i}",
+                    "description": f"Run operation {i} against the workspace and return structured results.",
+                    # 每隔几个工具出现一个无参数的声明，覆盖移除空 parameters 的分支
+                    "parameters": (
+                        {"type": "object", "properties": {}}
+                        if i % 7 == 0
+                        else {"type": "object", "properties": properties, "required": ["path"]}
+                    ),
+                },
+            }
+        )
+    return tools
+
+
+def build_history(turns: int, image_every: int = 25, tool_every: int = 5) -> List[Dict[str, Any]]:
+    """
+    OpenAI 格式的长对话历史：系统指令、多段落的回复、周期性的工具调用和内嵌小图片
+
+    不包含 markdown 图片链接，避免转换时请求远程图片
+    """
+    rng = random.Random(SEED)
+    image = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": _paragraphs(rng, 3, 40)}]
+    for turn in range(turns):
+        if turn % image_every == image_every - 1:
+            messages.append(
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": _sentence(rng, 20)},
+                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}},
+                    ],
+                }
+            )
+        else:
+            messages.append({"role": "user", "content": _sentence(rng, 30)})
+
+        if turn % tool_every == tool_every - 1:
+            call_id = f"call_{turn}"
+            arguments = json.dumps({"path": f"/src/module_{turn}.py", "limit": 20, "mode": "fast"})
+            messages.append(
+                {
+                    "role": "assistant",
+                    "tool_calls": [
+                        {"id": call_id, "type": "function", "function": {"name": "tool_1", "arguments": arguments}}
+                    ],
+                }
+            )
+            messages.append({"role": "tool", "tool_call_id": call_id, "content": _paragraphs(rng, 2, 60)})
+        messages.append({"role": "assistant", "content": _paragraphs(rng, 4, 50)})
+    messages.append({"role": "user", "content": _sentence(rng, 25)})
+    return messages
+
+
+def build_gemini_request(turns: int, tools: int) -> Dict[str, Any]:
+    """Gemini 原生格式的请求体"""
+    rng = random.Random(SEED)
+    contents = []
+    for turn in range(turns):
+        contents.append({"role": "user", "parts": [{"text": _sentence(rng, 30)}]})
+        contents.append({"role": "model", "parts": [{"text": _paragraphs(rng, 4, 50)}]})
+    contents.append({"role": "user", "parts": [{"text": _sentence(rng, 25)}]})
+
+    declarations = [tool["function"] for tool in build_tools(tools)]
+    return {
+        "contents": contents,
+        "tools": [
+            {"functionDeclarations": declarations[: tools // 2]},
+            {"functionDeclarations": declarations[tools // 2 :]},
+        ],
+        "generationConfig": {"temperature": 0.7, "topP": 0.95, "maxOutputTokens": 8192},
+        "systemInstruction": {"parts": [{"text": _paragraphs(rng, 3, 40)}]},
+    }
+
+
+def _usage() -> Dict[str, Any]:
+    return {"promptTokenCount": 18234, "candidatesTokenCount": 812, "totalTokenCount": 19046}
+
+
+def build_text_chunk(words: int = 12) -> Dict[str, Any]:
+    """流式响应中的普通文本块"""
+    return {
+        "candidates": [
+            {"content": {"role": "model", "parts": [{"text": _sentence(random.Random(SEED), words)}]}, "index": 0}
+        ],
+        "modelVersion": MODEL,
+    }
+
+
+def build_final_chunk() -> Dict[str, Any]:
+    """流式响应的最后一块，带结束原因和用量"""
+    chunk = build_text_chunk(4)
+    chunk["candidates"][0]["finishReason"] = "STOP"
+    chunk["usageMetadata"] = _usage()
+    return chunk
+
+
+def build_thinking_response() -> Dict[str, Any]:
+    """思考模型的非流式响应：思考过程和回答两个 part"""
+    rng = random.Random(SEED)
+    return {
+        "candidates": [
+            {
+                "content": {
+                    "role": "model",
+                    "parts": [{"text": _paragraphs(rng, 12, 80)}, {"text": _paragraphs(rng, 6, 60)}],
+                },
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {**_usage(), "thoughtsTokenCount": 2048},
+    }
+
+
+def build_grounding_response(sources: int = 10) -> Dict[str, Any]:
+    """搜索模型的响应，带引用来源"""
+    rng = random.Random(SEED)
+    chunks = [{"web": {"uri": f"https://example.com/article/{i}", "title": f"Article {i}"}} for i in range(sources)]
+    supports = [
+        {
+            "segment": {"startIndex": i * 40, "endIndex": i * 40 + 39, "text": _sentence(rng, 6)},
+            "groundingChunkIndices": [i % sources],
+            "confidenceScores": [0.9],
+        }
+        for i in range(sources * 2)
+    ]
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": _paragraphs(rng, 5, 60)}]},
+                "finishReason": "STOP",
+                "index": 0,
+                "groundingMetadata": {
+                    "webSearchQueries": ["gateway latency", "gemini proxy"],
+                    "groundingChunks": chunks,
+                    "groundingSupports": supports,
+                },
+            }
+        ],
+        "usageMetadata": _usage(),
+    }
+
+
+def build_tool_call_parts(calls: int = 8) -> List[Dict[str, Any]]:
+    """并行工具调用的响应 parts"""
+    parts: List[Dict[str, Any]] = [{"text": "I will inspect the workspace first."}]
+    for i in range(calls):
+        args = {"path": f"/src/module_{i}.py", "limit": 20, "filters": [{"field": "kind", "value": "function"}]}
+        parts.append({"functionCall": {"name": f"tool_{i}", "args": args}})
+    return parts
+
+
+def build_model_list(count: int) -> Dict[str, Any]:
+    """models 接口返回的模型列表"""
+    models = [
+        {
+            "name": f"models/gemini-{i // 10}.{i % 10}-flash",
+            "version": "001",
+            "displayName": f"Gemini {i}",
+            "inputTokenLimit": 1048576,
+            "outputTokenLimit": 8192,
+            "supportedGenerationMethods": ["generateContent", "countTokens"],
+        }
+        for i in range(count - 1)
+    ]
+    models.append({"name": f"models/{SEARCH_MODEL}", "version": "001", "displayName": "Gemini exp"})
+    return {"models": models}
+
+
+def build_cases() -> List[Case]:
+    _pin_settings()
+    converter = OpenAIMessageConverter()
+    optimizer = StreamOptimizer(min_delay=0.016, max_delay=0.024, short_text_threshold=10, long_text_threshold=50)
+    model_service = ModelService([SEARCH_MODEL], [SEARCH_MODEL])
+
+    history = build_history(200)
+    tools = build_tools(50)
+    contents, instruction = converter.convert(copy.deepcopy(history))
+    chat_request = ChatRequest(model=MODEL, messages=history, tools=tools, max_tokens=4096)
+    search_request = ChatRequest(model=f"{SEARCH_MODEL}-search", messages=history[-3:])
+    gemini_request = GeminiRequest(**build_gemini_request(200, 50))
+    long_text = _paragraphs(random.Random(SEED), 40, 80)
+    text_chunk, final_chunk = build_text_chunk(), build_final_chunk()
+    thinking, grounding = build_thinking_response(), build_grounding_response()
+    tool_parts = build_tool_call_parts()
+    tool_response = {"candidates": [{"content": {"role": "model", "parts": tool_parts}, "index": 0}]}
+    models = build_model_list(50)
+    search_contents, _ = converter.convert(copy.deepcopy(history[-3:]))
+
+    return [
+        Case(
+            "convert.history_200",
+            converter.convert,
+            lambda: (history,),
+            mutates=True,
+            description="OpenAI messages -> Gemini contents, 200 turns with tool calls and images",
+            extra={"messages": len(history)},
+        ),
+        Case(
+            "openai.build_tools_50",
+            openai_chat_service._build_tools,
+            lambda: (chat_request, contents),
+            description="50 function tools with dedup and empty-parameter cleanup",
+        ),
+        Case(
+            "openai.build_payload_200",
+            openai_chat_service._build_payload,
+            lambda: (chat_request, contents, instruction),
+            description="full OpenAI-route payload for the 200-turn history",
+        ),
+        Case(
+            "openai.build_payload_search",
+            openai_chat_service._build_payload,
+            lambda: (search_request, search_contents, instruction),
+            description="short search-model request",
+        ),
+        Case(
+            "gemini.build_tools_50",
+            gemini_chat_service._build_tools,
+            lambda: (MODEL, gemini_request.model_dump()),
+            description="merge two Gemini tool groups with 50 declarations",
+        ),
+        Case(
+            "gemini.build_payload_200",
+            gemini_chat_service._build_payload,
+            lambda: (MODEL, gemini_request),
+            description="Gemini-route payload including model_dump of 200 turns",
+        ),
+        Case(
+            "extract.stream_text",
+            _extract_result,
+            lambda: (text_chunk, MODEL, True, False),
+            description="single streamed text chunk",
+        ),
+        Case(
+            "extract.thinking",
+            _extract_result,
+            lambda: (thinking, THINKING_MODEL, False, False),
+            description="non-stream thinking response with thought and answer parts",
+        ),
+        Case(
+            "extract.grounding",
+            _extract_result,
+            lambda: (grounding, f"{SEARCH_MODEL}-search", False, False),
+            description="search response with 10 grounding chunks",
+        ),
+        Case(
+            "extract.tool_calls",
+            _extract_result,
+            lambda: (tool_response, MODEL, False, False),
+            description="non-stream response with 8 parallel function calls",
+        ),
+        Case(
+            "stream_response.text",
+            _handle_openai_stream_response,
+            lambda: (text_chunk, MODEL, None),
+            description="OpenAI chunk for a streamed text part",
+        ),
+        Case(
+            "stream_response.final",
+            _handle_openai_stream_response,
+            lambda: (final_chunk, MODEL, "stop"),
+            description="last OpenAI chunk with usage",
+        ),
+        Case(
+            "tool_calls.openai_8",
+            _extract_tool_calls,
+            lambda: (tool_parts, False),
+            description="8 function calls to OpenAI tool_calls",
+        ),
+        Case(
+            "tool_calls.gemini_8",
+            _extract_tool_calls,
+            lambda: (tool_parts, True),
+            description="8 function calls kept in Gemini format",
+        ),
+        Case(
+            "optimizer.calculate_delay",
+            optimizer.calculate_delay,
+            lambda: (30,),
+            description="delay for a medium-length chunk (log interpolation branch)",
+        ),
+        Case(
+            "optimizer.split_long_text",
+            optimizer.split_text_into_chunks,
+            lambda: (long_text,),
+            description="split a long response into chunks",
+            extra={"chars": len(long_text)},
+        ),
+        Case(
+            "models.convert_50",
+            model_service.convert_to_openai_models_format,
+            lambda: (models,),
+            description="50 Gemini models to the OpenAI list format",
+        ),
+    ]
+
+
+def _prepare(case: Case, number: int) -> List[Tuple[Any, ...]]:
+    args = case.make_args()
+    if case.mutates:
+        return [copy.deepcopy(args) for _ in range(number)]
+    return [args] * number
+
+
+def _time(case: Case, number: int) -> float:
+    """调用 number 次，返回总耗时（秒）"""
+    calls = _prepare(case, number)
+    func = case.func
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for args in calls:
+            func(*args)
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _calibrate(case: Case, min_time: float) -> int:
+    """与 timeit.autorange 相同，按 1、2、5、10... 增加调用次数，直到一轮耗时不少于 min_time"""
+    i = 1
+    while True:
+        for multiplier in (1, 2, 5):
+            number = i * multiplier
+            if _time(case, number) >= min_time:
+                return number
+        i *= 10
+
+
+def run_case(case: Case, repeat: int, min_time: float) -> Dict[str, Any]:
+    number = _calibrate(case, min_time)
+    samples = [_time(case, number) / number * 1e9 for _ in range(repeat)]
+    median = statistics.median(samples)
+    return {
+        "description": case.description,
+        "number": number,
+        "repeat": repeat,
+        "ns_per_op": {
+            "median": round(median, 1),
+            "min": round(min(samples), 1),
+            "mean": round(statistics.fmean(samples), 1),
+            "stdev": round(statistics.stdev(samples), 1) if len(samples) > 1 else 0.0,
+        },
+        "ops_per_sec": round(1e9 / median, 1) if median else None,
+        **case.extra,
+    }
+
+
+def _format_ns(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return f"{value:.0f}ns"
+
+
+def compare(
+    report: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> Tuple[List[Tuple[str, Optional[float], Optional[float], Optional[float]]], List[str]]:
+    """
+    按中位数对比两份报告
+
+    Returns:
+        tuple: (每个用例的 (名称, 当前值, 基线值, 变化比例), 变慢超过阈值的用例名)
+    """
+    rows, regressions = [], []
+    base_cases = baseline.get("cases", {})
+    for name, result in report["cases"].items():
+        current = result["ns_per_op"]["median"]
+        base = base_cases.get(name, {}).get("ns_per_op", {}).get("median")
+        delta = (current - base) / base if base else None
+        rows.append((name, current, base, delta))
+        if delta is not None and delta > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_report(
+    report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None, threshold: float = 0.1
+) -> List[str]:
+    print(f"Hot-path benchmarks ({report['label']}, python {report['python']})")
+    header = f"{'case':<30}{'median':>12}{'min':>12}{'ops/s':>14}"
+    if baseline:
+        header += f"{'baseline':>12}{'delta':>10}"
+    print(header)
+
+    rows, regressions = compare(report, baseline, threshold) if baseline else ([], [])
+    base_values = {name: (base, delta) for name, _, base, delta in rows}
+    for name, result in report["cases"].items():
+        stats = result["ns_per_op"]
+        line = (
+            f"{name:<30}{_format_ns(stats['median']):>12}{_format_ns(stats['min']):>12}{result['ops_per_sec']:>14,.0f}"
+        )
+        if baseline:
+            base, delta = base_values.get(name, (None, None))
+            mark = " !" if name in regressions else ""
+            line += f"{_format_ns(base):>12}{'' if delta is None else f'{delta * 100:+.1f}%':>10}{mark}"
+        print(line)
+
+    if baseline:
+        if regressions:
+            print(
+                f"{len(regressions)} case(s) slower than baseline {baseline.get('label')} by more than {threshold:.0%}"
+            )
+        else:
+            print(f"No regressions beyond {threshold:.0%} against baseline {baseline.get('label')}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmark pure functions on the request hot path")
+    parser.add_argument("--filter", type=str, default="", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=7, help="timing rounds per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per round")
+    parser.add_argument("--label", type=str, default="", help="report label, defaults to git revision")
+    parser.add_argument("--output", type=str, default="", help="save report as json")
+    parser.add_argument("--compare", type=str, default="", help="baseline report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown treated as a regression")
+    parser.add_argument("--list", action="store_true", help="list cases and exit")
+    args = parser.parse_args()
+
+    cases = [case for case in build_cases() if args.filter in case.name]
+    if args.list:
+        for case in cases:
+            print(f"{case.name:<30}{case.description}")
+        return 0
+    if not cases:
+        print(f"No cases match {args.filter!r}", file=sys.stderr)
+        return 1
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("version") != REPORT_VERSION:
+            print(f"Baseline {args.compare} has an incompatible report version", file=sys.stderr)
+            return 1
+
+    report = {
+        "version": REPORT_VERSION,
+        "label": args.label or git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": {},
+    }
+    for case in cases:
+        report["cases"][case.name] = run_case(case, max(1, args.repeat), args.min_time)
+
+    regressions = print_report(report, baseline, args.threshold)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
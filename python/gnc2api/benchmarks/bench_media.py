@@ -0,0 +1,189 @@
+"""
+大体积多模态请求的内存基准测试
+
+启动模拟上游和网关，发送内嵌 base64 图片的请求，统计网关进程的常驻内存峰值
+
+用法:
+    # 每个请求携带 4 张共 20 MB 的图片，顺序发送 5 次
+    python benchmarks/bench_media.py --total-mb 20 --images 4 --requests 5
+
+    # Gemini 原生接口、流式请求、2 个并发
+    python benchmarks/bench_media.py --api gemini --stream --concurrency 2 --output reports/media.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from replay import ROOT, free_port, git_revision, read_peak_rss, stop_environment, wait_until_ready
+
+BENCH_TOKEN = "sk-bench"
+MODEL = "gemini-2.0-flash"
+
+
+def read_rss(pid: int) -> int:
+    """读取进程当前的常驻内存（KB）"""
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def start_environment(media_limit: int) -> tuple[str, List[subprocess.Popen]]:
+    upstream_port, gateway_port = free_port(), free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "mock", "upstream.py"), "--port", str(upstream_port), "--ttfb", "0.05"],
+        cwd=ROOT,
+    )
+
+    env = os.environ.copy()
+    env.update(
+        API_PROVIDERS=json.dumps([f"http://127.0.0.1:{upstream_port}/v1beta"]),
+        ALLOWED_TOKENS=json.dumps([BENCH_TOKEN]),
+        AUTH_TOKEN=BENCH_TOKEN,
+        TRAFFIC_CAPTURE_ENABLED="false",
+        REQUEST_LOGGING_ENABLED="false",
+        MAX_INLINE_MEDIA_BYTES=str(media_limit),
+    )
+    gateway = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(gateway_port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+
+    processes = [upstream, gateway]
+    try:
+        wait_until_ready(f"http://127.0.0.1:{upstream_port}/v1beta/models")
+        wait_until_ready(f"http://127.0.0.1:{gateway_port}/health")
+    except Exception:
+        stop_environment(processes)
+        raise
+    return f"http://127.0.0.1:{gateway_port}", processes
+
+
+def build_body(api: str, images: List[str], stream: bool) -> bytes:
+    """构造请求体，图片数据在各个请求之间共享，避免压测进程自身占用过多内存"""
+    if api == "openai":
+        content = [{"type": "text", "text": "Describe these images."}]
+        content += [{"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}} for data in images]
+        body = {"model": MODEL, "stream": stream, "messages": [{"role": "user", "content": content}]}
+    else:
+        parts = [{"text": "Describe these images."}]
+        parts += [{"inline_data": {"mime_type": "image/png", "data": data}} for data in images]
+        body = {"contents": [{"role": "user", "parts": parts}]}
+    return json.dumps(body).encode("utf-8")
+
+
+def request_path(api: str, stream: bool) -> str:
+    if api == "openai":
+        return "/v1/chat/completions"
+    return f"/v1beta/models/{MODEL}:{'streamGenerateContent?alt=sse' if stream else 'generateContent'}"
+
+
+async def send(client: httpx.AsyncClient, path: str, body: bytes) -> Dict[str, Any]:
+    headers = {"Authorization": f"Bearer {BENCH_TOKEN}", "x-goog-api-key": BENCH_TOKEN}
+    headers["Content-Type"] = "application/json"
+    start = time.perf_counter()
+    async with client.stream("POST", path, content=body, headers=headers) as response:
+        size = 0
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+    return {"status": response.status_code, "total": time.perf_counter() - start, "bytes": size}
+
+
+async def run(gateway: str, path: str, body: bytes, requests: int, concurrency: int) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=gateway, timeout=300) as client:
+
+        async def one():
+            async with semaphore:
+                return await send(client, path, body)
+
+        return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure gateway memory with large inline images")
+    parser.add_argument("--api", choices=("openai", "gemini"), default="openai")
+    parser.add_argument("--total-mb", type=float, default=20, help="decoded image bytes per request (MB)")
+    parser.add_argument("--images", type=int, default=4, help="number of images per request")
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--label", type=str, default="", help="report label, defaults to git revision")
+    parser.add_argument("--output", type=str, default="", help="save report as json")
+    args = parser.parse_args()
+
+    image_bytes = int(args.total_mb * 1024 * 1024 / max(1, args.images))
+    images = [base64.b64encode(os.urandom(image_bytes)).decode("ascii") for _ in range(args.images)]
+    body = build_body(args.api, images, args.stream)
+    del images
+
+    gateway, processes = start_environment(media_limit=image_bytes * args.images * 2)
+    pid = processes[-1].pid
+    try:
+        idle_rss = read_rss(pid)
+        start = time.perf_counter()
+        results = asyncio.run(run(gateway, request_path(args.api, args.stream), body, args.requests, args.concurrency))
+        wall = time.perf_counter() - start
+        peak_rss = read_peak_rss(pid)
+    finally:
+        stop_environment(processes)
+
+    errors = [r for r in results if r["status"] != 200]
+    growth = (peak_rss or 0) - idle_rss
+    report = {
+        "label": args.label or git_revision(),
+        "api": args.api,
+        "stream": args.stream,
+        "request_bytes": len(body),
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "wall_seconds": round(wall, 3),
+        "idle_rss_kb": idle_rss,
+        "peak_rss_kb": peak_rss,
+        "growth_kb": growth,
+        # 峰值增长相当于多少份请求体，用于衡量同一份数据在内存中的副本数
+        "body_copies": round(growth * 1024 / (len(body) * args.concurrency), 2),
+    }
+
+    print(
+        f"{report['api']} stream={report['stream']} body={len(body) / 1024 / 1024:.1f}MB "
+        f"x{report['requests']} (concurrency {report['concurrency']}), errors: {report['errors']}"
+    )
+    print(f"idle rss {idle_rss} KB, peak rss {peak_rss} KB, growth {growth} KB ({report['body_copies']}x body)")
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
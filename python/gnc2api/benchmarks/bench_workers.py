@@ -0,0 +1,246 @@
+"""
+网关吞吐量随 worker 数量变化的基准测试
+
+启动一个模拟上游，依次以不同的 worker 数量（python -m app.main --workers N）启动网关，
+用多个压测进程以固定并发持续发送请求，统计每种配置的吞吐量、延迟分位数和网关CPU占用。
+
+用法:
+    # 分别以 1、2、4 个 worker 运行，每种配置压测 15 秒，并发 64
+    python benchmarks/bench_workers.py --workers 1,2,4 --duration 15 --concurrency 64
+
+    # 流式请求，结果保存为 json
+    python benchmarks/bench_workers.py --workers 1,2,4 --stream --output reports/workers.json
+
+说明:
+    - 模拟上游以 --upstream-ttfb 模拟生成耗时，网关的瓶颈是自身的 CPU，吞吐量随 worker 数增长，
+      直到 worker 数超过可用 CPU 核数；报告中的 cpu_count 是运行时的核数，单核机器上不会看到增长。
+    - 模拟上游本身是单进程，报告中的 upstream_cpu 接近 1.0 时说明上游成为瓶颈，应降低并发或增加 --upstream-ttfb。
+    - 压测进程数（--clients）应足够多，避免压测端先达到 CPU 上限。
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from replay import ROOT, free_port, git_revision, percentiles, read_cpu_seconds, stop_environment, wait_until_ready
+
+BENCH_TOKEN = "sk-bench"
+MODEL = "gemini-2.0-flash"
+
+
+def read_children(pid: int) -> List[int]:
+    """读取进程的直接子进程，仅支持Linux"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            return [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def read_tree_cpu_seconds(pid: int) -> Optional[float]:
+    """进程及其子进程（多 worker 时的各个 worker）累计的CPU时间"""
+    values = [read_cpu_seconds(p) for p in [pid, *read_children(pid)]]
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def start_upstream(ttfb: float) -> tuple[str, subprocess.Popen]:
+    port = free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "mock", "upstream.py"), "--port", str(port), "--ttfb", str(ttfb)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/v1beta/models")
+    except Exception:
+        stop_environment([upstream])
+        raise
+    return f"http://127.0.0.1:{port}/v1beta", upstream
+
+
+def start_gateway(upstream: str, workers: int) -> tuple[str, subprocess.Popen]:
+    port = free_port()
+    env = os.environ.copy()
+    env.update(
+        API_PROVIDERS=json.dumps([upstream]),
+        ALLOWED_TOKENS=json.dumps([BENCH_TOKEN]),
+        AUTH_TOKEN=BENCH_TOKEN,
+        TRAFFIC_CAPTURE_ENABLED="false",
+        REQUEST_LOGGING_ENABLED="false",
+        SERVER_ACCESS_LOG="false",
+    )
+    # 网关日志量较大，输出到终端会明显影响吞吐量
+    gateway = subprocess.Popen(
+        [sys.executable, "-m", "app.main", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/health", timeout=60)
+    except Exception:
+        stop_environment([gateway])
+        raise
+    return f"http://127.0.0.1:{port}", gateway
+
+
+def request_body(stream: bool) -> bytes:
+    body = {"model": MODEL, "stream": stream, "messages": [{"role": "user", "content": "Write a short poem."}]}
+    return json.dumps(body).encode("utf-8")
+
+
+async def _load(gateway: str, body: bytes, concurrency: int, duration: float) -> Dict[str, Any]:
+    """以固定并发循环发送请求直到时间结束，每个连接收到完整响应后立即发送下一个请求"""
+    headers = {"Authorization": f"Bearer {BENCH_TOKEN}", "Content-Type": "application/json"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=gateway, timeout=60, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def loop():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    async with client.stream("POST", "/v1/chat/completions", content=body, headers=headers) as r:
+                        async for _ in r.aiter_raw():
+                            pass
+                    if r.status_code == 200:
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def _load_process(args: tuple) -> Dict[str, Any]:
+    return asyncio.run(_load(*args))
+
+
+def run_load(gateway: str, body: bytes, concurrency: int, duration: float, clients: int) -> Dict[str, Any]:
+    """把并发平均分到多个压测进程"""
+    clients = max(1, min(clients, concurrency))
+    shares = [concurrency // clients + (1 if i < concurrency % clients else 0) for i in range(clients)]
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_load_process, [(gateway, body, share, duration) for share in shares])
+    return {
+        "latencies": [value for result in results for value in result["latencies"]],
+        "errors": sum(result["errors"] for result in results),
+    }
+
+
+def bench(upstream: str, upstream_pid: int, workers: int, args: argparse.Namespace) -> Dict[str, Any]:
+    gateway, process = start_gateway(upstream, workers)
+    body = request_body(args.stream)
+    try:
+        # 预热：建立连接、触发各 worker 的首次请求路径
+        run_load(gateway, body, args.concurrency, args.warmup, args.clients)
+
+        cpu_before, upstream_before = read_tree_cpu_seconds(process.pid), read_cpu_seconds(upstream_pid)
+        start = time.perf_counter()
+        result = run_load(gateway, body, args.concurrency, args.duration, args.clients)
+        wall = time.perf_counter() - start
+        cpu_after, upstream_after = read_tree_cpu_seconds(process.pid), read_cpu_seconds(upstream_pid)
+    finally:
+        stop_environment([process])
+
+    def utilization(before: Optional[float], after: Optional[float]) -> Optional[float]:
+        return round((after - before) / wall, 3) if before is not None and after is not None else None
+
+    requests = len(result["latencies"])
+    return {
+        "workers": workers,
+        "requests": requests,
+        "errors": result["errors"],
+        "wall_seconds": round(wall, 3),
+        "throughput": round(requests / wall, 2) if wall else 0,
+        "latency_ms": percentiles(result["latencies"]),
+        "gateway_cpu": utilization(cpu_before, cpu_after),
+        "upstream_cpu": utilization(upstream_before, upstream_after),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"Throughput by worker count ({report['label']}, {report['cpu_count']} CPUs, "
+        f"concurrency {report['concurrency']}, stream={report['stream']})"
+    )
+    print(
+        f"{'workers':>8}{'req/s':>10}{'scaling':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'gw cpu':>8}{'up cpu':>8}"
+    )
+    for result in report["results"]:
+        latency = result["latency_ms"]
+        print(
+            f"{result['workers']:>8}{result['throughput']:>10}{result['scaling']:>9}"
+            f"{latency.get('p50', '-'):>10}{latency.get('p99', '-'):>10}{result['errors']:>8}"
+            f"{result['gateway_cpu'] if result['gateway_cpu'] is not None else '-':>8}"
+            f"{result['upstream_cpu'] if result['upstream_cpu'] is not None else '-':>8}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure gateway throughput with different worker counts")
+    parser.add_argument("--workers", type=str, default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent connections")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per worker count")
+    parser.add_argument("--warmup", type=float, default=2, help="warmup seconds before measuring")
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--stream", action="store_true", help="send streaming requests")
+    parser.add_argument("--upstream-ttfb", type=float, default=0.02, help="mock upstream time to first byte")
+    parser.add_argument("--label", type=str, default="", help="report label, defaults to git revision")
+    parser.add_argument("--output", type=str, default="", help="save report as json")
+    args = parser.parse_args()
+
+    worker_counts = [int(value) for value in args.workers.split(",") if value.strip()]
+    upstream, upstream_process = start_upstream(args.upstream_ttfb)
+    try:
+        results = [bench(upstream, upstream_process.pid, workers, args) for workers in worker_counts]
+    finally:
+        stop_environment([upstream_process])
+
+    base = results[0]["throughput"] if results and results[0]["throughput"] else None
+    for result in results:
+        # 相对于第一个配置的吞吐量倍数
+        result["scaling"] = round(result["throughput"] / base, 2) if base else None
+
+    report = {
+        "label": args.label or git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpu_count": os.cpu_count(),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "stream": args.stream,
+        "upstream_ttfb": args.upstream_ttfb,
+        "results": results,
+    }
+    print_report(report)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
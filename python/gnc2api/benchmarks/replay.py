@@ -0,0 +1,368 @@
+"""
+流量回放工具，用录制的真实流量对比不同版本的性能
+
+用法:
+    # 启动模拟上游和网关，按 2 倍速回放，并生成报告
+    python benchmarks/replay.py data/traffic.jsonl --speed 2 --output reports/current.json
+
+    # 与之前版本的报告对比
+    python benchmarks/replay.py data/traffic.jsonl --speed 2 --compare reports/baseline.json
+
+    # 回放到已经运行的网关（需要自行用回放模式启动模拟上游）
+    python benchmarks/replay.py data/traffic.jsonl --gateway http://127.0.0.1:8001 --token sk-xxx --gateway-pid 1234
+
+录制文件由 TRAFFIC_CAPTURE_ENABLED=true 时的网关生成，模拟上游按录制的首字节时间、
+分块大小和分块间隔返回响应，因此报告中的耗时差异主要来自网关本身。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.service.capture.sanitizer import restore
+
+REPLAY_TOKEN = "sk-replay"
+
+
+def load_records(path: str, limit: int = 0) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("v") != 1:
+                continue
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+
+    records.sort(key=lambda x: x["ts"])
+    return records
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} is not ready after {timeout}s")
+
+
+def read_cpu_seconds(pid: Optional[int]) -> Optional[float]:
+    """读取进程累计的用户态和内核态CPU时间，仅支持Linux"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", maxsplit=1)[1].split()
+        # 去掉进程名后，utime 和 stime 分别位于第 12 和 13 个字段
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def read_peak_rss(pid: Optional[int]) -> Optional[int]:
+    """读取进程的内存峰值（KB），仅支持Linux"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def start_environment(capture_file: str, speed: float) -> tuple[str, str, List[subprocess.Popen]]:
+    """启动回放模式的模拟上游和指向它的网关，返回网关地址、模拟上游地址和子进程列表"""
+    upstream_port, gateway_port = free_port(), free_port()
+
+    upstream = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(ROOT, "mock", "upstream.py"),
+            "--port",
+            str(upstream_port),
+            "--replay",
+            capture_file,
+            "--speed",
+            str(speed),
+        ],
+        cwd=ROOT,
+    )
+
+    env = os.environ.copy()
+    env.update(
+        API_PROVIDERS=json.dumps([f"http://127.0.0.1:{upstream_port}/v1beta"]),
+        ALLOWED_TOKENS=json.dumps([REPLAY_TOKEN]),
+        AUTH_TOKEN=REPLAY_TOKEN,
+        TRAFFIC_CAPTURE_ENABLED="false",
+        REQUEST_LOGGING_ENABLED="false",
+    )
+    gateway = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(gateway_port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+
+    processes = [upstream, gateway]
+    try:
+        wait_until_ready(f"http://127.0.0.1:{upstream_port}/replay/stats")
+        wait_until_ready(f"http://127.0.0.1:{gateway_port}/health")
+    except Exception:
+        stop_environment(processes)
+        raise
+
+    return f"http://127.0.0.1:{gateway_port}", f"http://127.0.0.1:{upstream_port}", processes
+
+
+def read_replay_stats(upstream: str) -> Optional[Dict[str, Any]]:
+    """读取模拟上游按摘要匹配录制时序的命中情况"""
+    try:
+        stats = httpx.get(f"{upstream}/replay/stats", timeout=5).json()
+        return {"hits": stats.get("hits", 0), "misses": stats.get("misses", 0)}
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def stop_environment(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def replay_one(client: httpx.AsyncClient, record: Dict[str, Any], token: str) -> Dict[str, Any]:
+    url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    headers = {"Authorization": f"Bearer {token}", "x-goog-api-key": token, "Content-Type": "application/json"}
+    body = json.dumps(restore(record["body"]), ensure_ascii=False).encode("utf-8")
+
+    start = time.perf_counter()
+    ttfb, status, size = None, 0, 0
+    try:
+        async with client.stream(record.get("method", "POST"), url, content=body, headers=headers) as response:
+            status = response.status_code
+            async for chunk in response.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                size += len(chunk)
+    except httpx.HTTPError as e:
+        print(f"Request to {record['path']} failed: {e}", file=sys.stderr)
+
+    total = time.perf_counter() - start
+    upstream = record.get("upstream") or []
+    return {
+        "status": status,
+        "ok": status == record.get("status", 200),
+        "ttfb": ttfb if ttfb is not None else total,
+        "total": total,
+        "bytes": size,
+        "recorded_ttfb": upstream[-1]["ttfb"] / 1000 if upstream else None,
+    }
+
+
+async def replay(records: List[Dict[str, Any]], gateway: str, token: str, speed: float, timeout: float) -> list:
+    """按录制时的请求间隔（除以speed）发送请求"""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=256)
+    async with httpx.AsyncClient(base_url=gateway, timeout=timeout, limits=limits) as client:
+        loop, first = asyncio.get_running_loop(), records[0]["ts"]
+        start = loop.time()
+        tasks = []
+        for record in records:
+            delay = (record["ts"] - first) / speed - (loop.time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(replay_one(client, record, token)))
+        return await asyncio.gather(*tasks)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "mean": round(statistics.fmean(values) * 1000, 2),
+        "p50": round(pick(0.50) * 1000, 2),
+        "p90": round(pick(0.90) * 1000, 2),
+        "p99": round(pick(0.99) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+def build_report(
+    results: list,
+    wall: float,
+    speed: float,
+    cpu: Optional[float],
+    rss: Optional[int],
+    label: str,
+    upstream_matches: Optional[Dict[str, Any]] = None,
+):
+    ok = [r for r in results if r["ok"]]
+    # 网关额外引入的首字节延迟：客户端首字节时间减去（按速度缩放后的）录制的上游首字节时间
+    overhead = [r["ttfb"] - r["recorded_ttfb"] / speed for r in ok if r["recorded_ttfb"] is not None]
+    return {
+        "label": label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "speed": speed,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "throughput": round(len(results) / wall, 2) if wall else 0,
+        "latency_ms": {
+            "ttfb": percentiles([r["ttfb"] for r in ok]),
+            "total": percentiles([r["total"] for r in ok]),
+            "ttfb_overhead": percentiles(overhead),
+        },
+        "cpu": {
+            "seconds": round(cpu, 3) if cpu is not None else None,
+            "ms_per_request": round(cpu * 1000 / len(results), 3) if cpu is not None and results else None,
+            "utilization": round(cpu / wall, 3) if cpu is not None and wall else None,
+        },
+        "peak_rss_kb": rss,
+        "upstream_matches": upstream_matches,
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    rows = [("errors", report["errors"], (baseline or {}).get("errors"))]
+    for group, stats in report["latency_ms"].items():
+        base_stats = (baseline or {}).get("latency_ms", {}).get(group, {})
+        for name in ("p50", "p90", "p99"):
+            rows.append((f"{group}.{name} (ms)", stats.get(name), base_stats.get(name)))
+    rows.append(
+        ("cpu ms/request", report["cpu"]["ms_per_request"], (baseline or {}).get("cpu", {}).get("ms_per_request"))
+    )
+    rows.append(("peak rss (KB)", report["peak_rss_kb"], (baseline or {}).get("peak_rss_kb")))
+
+    print(
+        f"Replayed {report['requests']} requests at {report['speed']}x in {report['wall_seconds']}s ({report['label']})"
+    )
+    header = f"{'metric':<24}{'current':>12}"
+    if baseline:
+        header += f"{'baseline':>12}{'delta':>10}"
+    print(header)
+
+    for name, current, base in rows:
+        line = f"{name:<24}{'-' if current is None else current:>12}"
+        if baseline:
+            delta = ""
+            if isinstance(current, (int, float)) and isinstance(base, (int, float)) and base:
+                delta = f"{(current - base) / base * 100:+.1f}%"
+            line += f"{'-' if base is None else base:>12}{delta:>10}"
+        print(line)
+
+    if report.get("upstream_matches"):
+        matches = report["upstream_matches"]
+        print(f"Upstream timing matched by payload: {matches['hits']}, fallback: {matches['misses']}")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the gateway")
+    parser.add_argument("capture", help="capture file written by TRAFFIC_CAPTURE_ENABLED")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most N requests")
+    parser.add_argument("--gateway", type=str, default="", help="use a running gateway instead of starting one")
+    parser.add_argument("--token", type=str, default=REPLAY_TOKEN, help="api token for --gateway")
+    parser.add_argument("--gateway-pid", type=int, default=0, help="pid of --gateway for cpu and memory stats")
+    parser.add_argument("--timeout", type=float, default=300, help="request timeout in seconds")
+    parser.add_argument("--label", type=str, default="", help="report label, defaults to git revision")
+    parser.add_argument("--output", type=str, default="", help="save report as json")
+    parser.add_argument("--compare", type=str, default="", help="baseline report to compare with")
+    args = parser.parse_args()
+
+    records = load_records(args.capture, args.limit)
+    if not records:
+        print(f"No records found in {args.capture}", file=sys.stderr)
+        return 1
+
+    speed = max(0.01, args.speed)
+    processes, gateway, pid, upstream = [], args.gateway, args.gateway_pid, ""
+    if not gateway:
+        gateway, upstream, processes = start_environment(os.path.abspath(args.capture), speed)
+        pid = processes[-1].pid
+
+    try:
+        cpu_before = read_cpu_seconds(pid)
+        start = time.perf_counter()
+        results = asyncio.run(replay(records, gateway, args.token, speed, args.timeout))
+        wall = time.perf_counter() - start
+        cpu_after = read_cpu_seconds(pid)
+        rss = read_peak_rss(pid)
+        matches = read_replay_stats(upstream) if upstream else None
+    finally:
+        stop_environment(processes)
+
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    report = build_report(results, wall, speed, cpu, rss, args.label or git_revision(), matches)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
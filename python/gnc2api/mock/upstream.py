@@ -0,0 +1,448 @@
+"""
+本地模拟的 Gemini 上游服务，用于离线调试和测试
+
+用法: python mock/upstream.py --port 8090 --ttfb 0.2 --delay 0.02
+然后将 API_PROVIDERS 配置为 ["http://127.0.0.1:8090/v1beta"]
+
+回放模式: python mock/upstream.py --replay data/traffic.jsonl --speed 2
+按录制文件中的首字节时间、分块大小和分块间隔返回响应，时间按 speed 缩放
+
+同时模拟了 Files API 的可续传上传和文件引用，引用不存在或已过期（--file-ttl）的文件时返回 403
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.service.capture.sanitizer import digest
+
+POEMS = [
+    "白日依山尽，黄河入海流。欲穷千里目，更上一层楼。",
+    "床前明月光，疑是地上霜。举头望明月，低头思故乡。",
+    "海内存知己，天涯若比邻。无为在歧路，儿女共沾巾。",
+    "会当凌绝顶，一览众山小。",
+    "横看成岭侧成峰，远近高低各不同。不识庐山真面目，只缘身在此山中。",
+]
+
+MODELS = [
+    "gemini-1.5-flash",
+    "gemini-1.5-flash-002",
+    "gemini-1.5-pro-002",
+    "gemini-2.0-flash",
+    "gemini-2.0-flash-exp",
+]
+
+# 运行参数，可通过命令行修改
+CONFIG = {
+    # 首字节延迟（秒）
+    "ttfb": 0.0,
+    # 流式输出时每个分块之间的间隔（秒）
+    "delay": 0.0,
+    # 流式输出时每个分块的字符数
+    "chunk_size": 8,
+    # 随机返回 500 错误的概率
+    "error_rate": 0.0,
+    # 流式输出到一半时随机断开连接的概率
+    "drop_rate": 0.0,
+    # 忽略请求末尾的 model 内容，从头重新生成（模拟不支持续写的上游）
+    "ignore_prefill": False,
+    # 回放速度倍数，仅在回放模式下生效
+    "speed": 1.0,
+    # 该模拟上游支持的模型，为空时使用 MODELS
+    "models": [],
+    # Files API 上传的文件保留时间（秒）
+    "file_ttl": 48 * 3600,
+}
+
+# 缓存内容，name -> {"model", "tokens", "expire"}
+CACHED_CONTENTS: Dict[str, Dict[str, Any]] = {}
+# Files API 上传的文件，name -> File 对象和过期时间
+FILES: Dict[str, Dict[str, Any]] = {}
+# 进行中的可续传上传会话，upload_id -> {"display_name", "size", "mime_type"}
+UPLOADS: Dict[str, Dict[str, Any]] = {}
+
+app = FastAPI(title="Mock Gemini Upstream")
+
+
+class ReplayIndex:
+    """录制的上游时序索引，优先按请求摘要匹配，匹配不到时按模型和调用方式轮流使用"""
+
+    def __init__(self, path: str):
+        by_key, by_kind = defaultdict(list), defaultdict(list)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for item in json.loads(line).get("upstream", []):
+                    by_key[item["key"]].append(item)
+                    by_kind[(item["model"], item["stream"])].append(item)
+                    by_kind[(None, item["stream"])].append(item)
+
+        self.by_key = {k: itertools.cycle(v) for k, v in by_key.items()}
+        self.by_kind = {k: itertools.cycle(v) for k, v in by_kind.items()}
+        self.hits = self.misses = 0
+
+    def match(self, model: str, payload: Dict[str, Any], stream: bool) -> Optional[Dict[str, Any]]:
+        items = self.by_key.get(digest(payload))
+        if items:
+            self.hits += 1
+            return next(items)
+
+        self.misses += 1
+        items = self.by_kind.get((model, stream)) or self.by_kind.get((None, stream))
+        return next(items) if items else None
+
+
+REPLAY: Optional[ReplayIndex] = None
+
+
+def _estimate_tokens(content: Any) -> int:
+    return max(1, len(json.dumps(content, ensure_ascii=False)) // 4)
+
+
+def _error(status_code: int, message: str, status: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code, content={"error": {"code": status_code, "message": message, "status": status}}
+    )
+
+
+def _model_not_found(model: str) -> JSONResponse:
+    return _error(404, f"models/{model} is not found for API version v1beta", "NOT_FOUND")
+
+
+def _parse_ttl(ttl: str) -> float:
+    try:
+        return float(str(ttl).removesuffix("s"))
+    except ValueError:
+        return 3600.0
+
+
+def _resolve_cache(payload: Dict[str, Any]) -> tuple[int, JSONResponse | None]:
+    name = payload.get("cachedContent")
+    if not name:
+        return 0, None
+
+    item = CACHED_CONTENTS.get(name)
+    if not item or item["expire"] < time.time():
+        CACHED_CONTENTS.pop(name, None)
+        return 0, _error(403, f"CachedContent not found (or permission denied): {name}", "PERMISSION_DENIED")
+
+    return item["tokens"], None
+
+
+def _resolve_files(payload: Dict[str, Any]) -> JSONResponse | None:
+    """检查请求引用的文件是否存在且未过期"""
+    for content in payload.get("contents") or []:
+        for part in content.get("parts") or []:
+            file_data = part.get("fileData") or part.get("file_data") or {}
+            uri = file_data.get("fileUri") or file_data.get("file_uri")
+            if not uri:
+                continue
+            name = "files/" + uri.rsplit("/", 1)[-1]
+            item = FILES.get(name)
+            if not item or item["expire"] < time.time():
+                FILES.pop(name, None)
+                return _error(
+                    403,
+                    f"You do not have permission to access the File {name} or it may not exist.",
+                    "PERMISSION_DENIED",
+                )
+    return None
+
+
+# 1x1 的 PNG 图片，请求图片输出时返回
+MOCK_PNG = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+
+
+def _pick_text(payload: Dict[str, Any]) -> str:
+    """请求末尾是 model 内容时接着已有的回复继续生成"""
+    contents = payload.get("contents") or [{}]
+    if contents[-1].get("role") == "model":
+        prefill = "".join(part.get("text", "") for part in contents[-1].get("parts", []))
+        for poem in POEMS:
+            if poem.startswith(prefill):
+                return poem if CONFIG["ignore_prefill"] else poem[len(prefill) :]
+    return random.choice(POEMS)
+
+
+def _build_response(model: str, text: str, prompt_tokens: int, cached_tokens: int, finish: bool = True) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+
+    usage = {
+        "promptTokenCount": prompt_tokens + cached_tokens,
+        "candidatesTokenCount": max(1, len(text) // 2),
+        "totalTokenCount": prompt_tokens + cached_tokens + max(1, len(text) // 2),
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+
+    return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": model}
+
+
+def _padded_response(model: str, size: int, finish: bool) -> str:
+    """构造与录制分块大小一致的响应"""
+    data = _build_response(model, "", 1, 0, finish)
+    base = len(json.dumps(data, ensure_ascii=False))
+    data["candidates"][0]["content"]["parts"][0]["text"] = "x" * max(0, size - base)
+    return json.dumps(data, ensure_ascii=False)
+
+
+async def _replay_sleep(milliseconds: float) -> None:
+    if milliseconds > 0:
+        await asyncio.sleep(milliseconds / 1000 / CONFIG["speed"])
+
+
+def _replay_stream(model: str, item: Dict[str, Any]) -> StreamingResponse:
+    chunks: List[int] = item.get("chunks") or [64]
+    gaps: List[int] = item.get("gaps", [])
+
+    async def generate():
+        await _replay_sleep(item.get("ttfb", 0))
+        for i, size in enumerate(chunks):
+            if i > 0:
+                await _replay_sleep(gaps[i - 1] if i - 1 < len(gaps) else 0)
+            # 录制的分块大小包含 "data: " 前缀
+            data = _padded_response(model, size - 6, i == len(chunks) - 1)
+            yield f"data: {data}\r\n\r\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+async def _replay_normal(model: str, item: Dict[str, Any]) -> JSONResponse:
+    await _replay_sleep(item.get("duration", 0))
+    size = sum(item.get("chunks", [])) or 64
+    return JSONResponse(content=json.loads(_padded_response(model, size, True)))
+
+
+@app.get("/replay/stats")
+async def replay_stats():
+    if not REPLAY:
+        return {"enabled": False}
+    return {"enabled": True, "hits": REPLAY.hits, "misses": REPLAY.misses}
+
+
+@app.get("/v1beta/models")
+async def list_models():
+    models = []
+    for name in CONFIG["models"] or MODELS:
+        models.append(
+            {
+                "name": f"models/{name}",
+                "version": "001",
+                "displayName": name,
+                "description": f"Mock model {name}",
+                "inputTokenLimit": 1048576,
+                "outputTokenLimit": 8192,
+                "supportedGenerationMethods": ["generateContent", "countTokens", "createCachedContent"],
+            }
+        )
+    return {"models": models}
+
+
+@app.post("/v1beta/cachedContents")
+async def create_cached_content(request: Request):
+    payload = await request.json()
+    name = f"cachedContents/{uuid.uuid4().hex[:16]}"
+    ttl = _parse_ttl(payload.get("ttl", "3600s"))
+    content = {k: payload.get(k) for k in ("systemInstruction", "contents", "tools", "toolConfig") if payload.get(k)}
+
+    CACHED_CONTENTS[name] = {
+        "model": payload.get("model", ""),
+        "tokens": _estimate_tokens(content),
+        "expire": time.time() + ttl,
+    }
+    return {
+        "name": name,
+        "model": payload.get("model", ""),
+        "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)),
+        "usageMetadata": {"totalTokenCount": CACHED_CONTENTS[name]["tokens"]},
+    }
+
+
+@app.patch("/v1beta/cachedContents/{cache_id}")
+async def update_cached_content(cache_id: str, request: Request):
+    name = f"cachedContents/{cache_id}"
+    if name not in CACHED_CONTENTS:
+        return _error(404, f"CachedContent not found: {name}", "NOT_FOUND")
+
+    payload = await request.json()
+    ttl = _parse_ttl(payload.get("ttl", "3600s"))
+    CACHED_CONTENTS[name]["expire"] = time.time() + ttl
+    return {"name": name, "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl))}
+
+
+@app.delete("/v1beta/cachedContents/{cache_id}")
+async def delete_cached_content(cache_id: str):
+    CACHED_CONTENTS.pop(f"cachedContents/{cache_id}", None)
+    return {}
+
+
+@app.post("/upload/v1beta/files")
+async def upload_file(request: Request):
+    """Files API 的可续传上传：start 创建会话，upload, finalize 一次性写入全部内容"""
+    command = request.headers.get("X-Goog-Upload-Command", "")
+    if command == "start":
+        payload = await request.json()
+        upload_id = uuid.uuid4().hex
+        UPLOADS[upload_id] = {
+            "display_name": (payload.get("file") or {}).get("display_name", ""),
+            "size": int(request.headers.get("X-Goog-Upload-Header-Content-Length", "0")),
+            "mime_type": request.headers.get("X-Goog-Upload-Header-Content-Type", "application/octet-stream"),
+        }
+        upload_url = f"{str(request.base_url).rstrip('/')}/upload/v1beta/files?upload_id={upload_id}"
+        return JSONResponse({}, headers={"X-Goog-Upload-URL": upload_url, "X-Goog-Upload-Status": "active"})
+
+    upload = UPLOADS.pop(request.query_params.get("upload_id", ""), None)
+    if not upload or "finalize" not in command:
+        return _error(400, "Invalid upload session", "INVALID_ARGUMENT")
+
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+    if size != upload["size"]:
+        return _error(400, f"Upload size mismatch: {size} != {upload['size']}", "INVALID_ARGUMENT")
+
+    name = f"files/{uuid.uuid4().hex[:12]}"
+    expire = time.time() + CONFIG["file_ttl"]
+    file = {
+        "name": name,
+        "displayName": upload["display_name"],
+        "mimeType": upload["mime_type"],
+        "sizeBytes": str(size),
+        "expirationTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expire)),
+        "uri": f"{str(request.base_url).rstrip('/')}/v1beta/{name}",
+        "state": "ACTIVE",
+    }
+    FILES[name] = {"file": file, "expire": expire}
+    return {"file": file}
+
+
+@app.get("/v1beta/files")
+async def list_files():
+    now = time.time()
+    return {"files": [item["file"] for item in FILES.values() if item["expire"] >= now]}
+
+
+@app.get("/v1beta/files/{file_id}")
+async def get_file(file_id: str):
+    item = FILES.get(f"files/{file_id}")
+    if not item or item["expire"] < time.time():
+        return _error(403, f"You do not have permission to access the File files/{file_id}", "PERMISSION_DENIED")
+    return item["file"]
+
+
+@app.delete("/v1beta/files/{file_id}")
+async def delete_file(file_id: str):
+    FILES.pop(f"files/{file_id}", None)
+    return {}
+
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def generate_content(model: str, request: Request):
+    if CONFIG["models"] and model not in CONFIG["models"]:
+        return _model_not_found(model)
+
+    payload = await request.json()
+    item = REPLAY.match(model, payload, False) if REPLAY else None
+    if item:
+        if item["status"] != 200:
+            return _error(item["status"], "Replayed upstream error", "INTERNAL")
+        return await _replay_normal(model, item)
+
+    cached_tokens, error = _resolve_cache(payload)
+    error = error or _resolve_files(payload)
+    if error:
+        return error
+
+    if random.random() < CONFIG["error_rate"]:
+        return _error(500, "Mock internal error", "INTERNAL")
+
+    await asyncio.sleep(CONFIG["ttfb"])
+    text = random.choice(POEMS)
+    response = _build_response(model, text, _estimate_tokens(payload.get("contents", [])), cached_tokens)
+    if "Image" in (payload.get("generationConfig") or {}).get("responseModalities", []):
+        response["candidates"][0]["content"]["parts"].append(
+            {"inlineData": {"mimeType": "image/png", "data": MOCK_PNG}}
+        )
+    return response
+
+
+@app.post("/v1beta/models/{model}:streamGenerateContent")
+async def stream_generate_content(model: str, request: Request):
+    if CONFIG["models"] and model not in CONFIG["models"]:
+        return _model_not_found(model)
+
+    payload = await request.json()
+    item = REPLAY.match(model, payload, True) if REPLAY else None
+    if item:
+        if item["status"] != 200:
+            return _error(item["status"], "Replayed upstream error", "INTERNAL")
+        return _replay_stream(model, item)
+
+    cached_tokens, error = _resolve_cache(payload)
+    error = error or _resolve_files(payload)
+    if error:
+        return error
+
+    if random.random() < CONFIG["error_rate"]:
+        return _error(500, "Mock internal error", "INTERNAL")
+
+    prompt_tokens = _estimate_tokens(payload.get("contents", []))
+    text, size = _pick_text(payload), max(1, CONFIG["chunk_size"])
+    drop = random.random() < CONFIG["drop_rate"]
+
+    async def generate():
+        await asyncio.sleep(CONFIG["ttfb"])
+        chunks = [text[i : i + size] for i in range(0, len(text), size)]
+        for i, chunk in enumerate(chunks):
+            if drop and i == len(chunks) // 2:
+                raise ConnectionResetError("Mock stream dropped")
+            finish = i == len(chunks) - 1
+            data = _build_response(model, chunk, prompt_tokens, cached_tokens, finish)
+            yield f"data: {json.dumps(data, ensure_ascii=False)}\r\n\r\n"
+            if not finish:
+                await asyncio.sleep(CONFIG["delay"])
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Gemini upstream")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="listen host")
+    parser.add_argument("--port", type=int, default=8090, help="listen port")
+    parser.add_argument("--ttfb", type=float, default=0.0, help="time to first byte in seconds")
+    parser.add_argument("--delay", type=float, default=0.0, help="gap between stream chunks in seconds")
+    parser.add_argument("--chunk-size", type=int, default=8, help="characters per stream chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of returning 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of dropping a stream halfway")
+    parser.add_argument("--ignore-prefill", action="store_true", help="restart generation instead of continuing")
+    parser.add_argument("--replay", type=str, default="", help="replay upstream timing from a capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--models", type=str, default="", help="comma separated models served by this upstream")
+    parser.add_argument("--file-ttl", type=float, default=48 * 3600, help="seconds before uploaded files expire")
+
+    args = parser.parse_args()
+    CONFIG.update(ttfb=args.ttfb, delay=args.delay, chunk_size=args.chunk_size, error_rate=args.error_rate)
+    CONFIG.update(drop_rate=args.drop_rate, ignore_prefill=args.ignore_prefill)
+    CONFIG.update(speed=max(0.01, args.speed), models=[m.strip() for m in args.models.split(",") if m.strip()])
+    CONFIG.update(file_ttl=args.file_ttl)
+    if args.replay:
+        REPLAY = ReplayIndex(args.replay)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
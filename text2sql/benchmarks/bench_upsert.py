@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# @Author  : wzdnzd
+# @Time    : 2026-10-19
+
+"""
+对话历史批量写入的基准测试
+
+在本地 MySQL 兼容的数据库中创建临时表，分别用逐行插入、executemany 和 upsertmany 写入相同数量的对话历史，
+统计每种方式的写入速度（行/秒），其中 upsertmany 还会再写入一遍已存在的记录以测试唯一键冲突时的更新速度。
+
+用法:
+    # 使用 database/config.py 中的连接配置，写入 10000 行，每批 500 行
+    python benchmarks/bench_upsert.py --rows 10000 --batch 500
+
+    # 指定连接配置和答案长度，结果保存为 json
+    python benchmarks/bench_upsert.py --host 127.0.0.1 --port 3306 --answer-size 4096 --output reports/upsert.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import config
+from database.dbclient import HISTORY_COLUMNS, HISTORY_UPDATES, MySqLClient, create_table
+
+
+def generate_rows(count: int, answer_size: int) -> list[tuple]:
+    conversation_id = str(uuid.uuid4())
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    answer = ("SELECT * FROM `users` WHERE `name` = '测试';\n" * (answer_size // 40 + 1))[:answer_size]
+
+    return [(conversation_id, str(uuid.uuid4()), f"问题 {i}", answer, "bench", timestamp, 0, "") for i in range(count)]
+
+
+def write_all(func, items: list) -> int:
+    """依次写入，返回影响行数之和，任意一次失败时返回 -1"""
+    total = 0
+    for item in items:
+        count = func(item)
+        if count < 0:
+            return -1
+        total += count
+
+    return total
+
+
+def measure(name: str, rows: list[tuple], func) -> dict:
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "method": name,
+        "rows": len(rows),
+        "affected": count,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(rows) / elapsed, 1) if elapsed > 0 else 0,
+    }
+
+
+def run(client: MySqLClient, table: str, rows: list[tuple], batch: int) -> list[dict]:
+    names = ", ".join(f"`{column}`" for column in HISTORY_COLUMNS)
+    placeholder = ", ".join(["%s"] * len(HISTORY_COLUMNS))
+    sql = f"INSERT INTO `{table}` ({names}) VALUES ({placeholder})"
+
+    def truncate():
+        client.update(f"TRUNCATE TABLE `{table}`")
+
+    def chunks(items: list[tuple]) -> list[list[tuple]]:
+        return [items[i : i + batch] for i in range(0, len(items), batch)]
+
+    def upsert(item: list[tuple]) -> int:
+        return client.upsertmany(table, HISTORY_COLUMNS, item, HISTORY_UPDATES)
+
+    results = []
+
+    # 逐行插入，每行一个事务
+    truncate()
+    results.append(measure("insertone", rows, lambda: write_all(lambda row: client.insertone(sql, row), rows)))
+
+    # executemany，每批一个事务
+    truncate()
+    results.append(
+        measure("insertmany", rows, lambda: write_all(lambda item: client.insertmany(sql, item), chunks(rows)))
+    )
+
+    # 多行 INSERT ... ON DUPLICATE KEY UPDATE，每批一个事务
+    truncate()
+    results.append(measure("upsertmany", rows, lambda: write_all(upsert, chunks(rows))))
+
+    # 再次写入相同的 message_id 并修改答案，全部走唯一键冲突后的更新
+    updated = [row[:3] + (row[3] + " ",) + row[4:] for row in rows]
+    results.append(measure("upsertmany (update)", updated, lambda: write_all(upsert, chunks(updated))))
+
+    return results
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"Bulk write throughput ({report['rows']} rows, batch {report['batch']}, answer {report['answer_size']} bytes)"
+    )
+    print(f"{'method':<22}{'rows/s':>12}{'seconds':>10}{'affected':>10}")
+    for result in report["results"]:
+        print(f"{result['method']:<22}{result['rows_per_second']:>12}{result['seconds']:>10}{result['affected']:>10}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure bulk write throughput of chat histories")
+    parser.add_argument("--host", type=str, default=config.DB_HOST, help="database host")
+    parser.add_argument("--port", type=int, default=config.DB_PORT, help="database port")
+    parser.add_argument("--user", type=str, default=config.DB_USERNAME, help="database user")
+    parser.add_argument("--password", type=str, default=config.DB_PASSWORD, help="database password")
+    parser.add_argument("--database", type=str, default=config.DB_DATABASE, help="database name")
+    parser.add_argument("--table", type=str, default=f"{config.DB_TABLENAME}_bench", help="temporary table name")
+    parser.add_argument("--rows", type=int, default=10000, help="rows to write per method")
+    parser.add_argument("--batch", type=int, default=500, help="rows per transaction for batched methods")
+    parser.add_argument("--answer-size", type=int, default=1024, help="answer length in characters")
+    parser.add_argument("--keep", action="store_true", help="keep the table after benchmark")
+    parser.add_argument("--output", type=str, default="", help="save report as json")
+    args = parser.parse_args()
+
+    # 连接池在首次获取连接时才读取配置
+    config.DB_HOST, config.DB_PORT = args.host, args.port
+    config.DB_USERNAME, config.DB_PASSWORD, config.DB_DATABASE = args.user, args.password, args.database
+
+    client = MySqLClient()
+    if not create_table(table=args.table, client=client):
+        print(f"failed to create table {args.table}")
+        return 1
+
+    rows = generate_rows(max(1, args.rows), max(1, args.answer_size))
+    try:
+        results = run(client, args.table, rows, max(1, args.batch))
+    finally:
+        if not args.keep:
+            client.update(f"DROP TABLE IF EXISTS `{args.table}`")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": len(rows),
+        "batch": args.batch,
+        "answer_size": args.answer_size,
+        "results": results,
+    }
+    print_report(report)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return 1 if any(result["affected"] < 0 for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
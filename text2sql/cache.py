@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+# @Author  : wzdnzd
+# @Time    : 2026-10-19
+
+import difflib
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import config
+from database.dbclient import MySqLClient
+from tools import utils
+from tools.logger import logger
+
+
+def normalize(text: str) -> str:
+    """统一全半角和大小写，去掉空白和标点，只保留文字和数字"""
+    text = unicodedata.normalize("NFKC", utils.trim(text)).lower()
+    return "".join(c for c in text if c.isalnum())
+
+
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def compatible(key: str, other: str) -> bool:
+    """
+    相似的两个问题能否共用答案：数字（年份、月份、TopN 等）必须完全相同，差异只能是字符的增删
+
+    华东和华北、3月和4月这类只差一个关键字符的问题 n-gram 相似度很高，但对应的 SQL 完全不同
+    """
+    if NUMBER_PATTERN.findall(key) != NUMBER_PATTERN.findall(other):
+        return False
+
+    opcodes = difflib.SequenceMatcher(None, key, other, autojunk=False).get_opcodes()
+    return all(tag != "replace" for tag, *_ in opcodes)
+
+
+def ngrams(text: str, n: int = 2) -> frozenset[str]:
+    if len(text) <= n:
+        return frozenset([text]) if text else frozenset()
+
+    return frozenset(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+@dataclass
+class CachedAnswer(object):
+    # 原始回答的消息 id
+    message_id: str
+
+    # 原始问题
+    question: str
+
+    # 回答内容
+    answer: str
+
+    # 生成回答的模型
+    model: str
+
+    # 回答时间戳，用于计算是否过期
+    created: float
+
+    # 归一化后的问题
+    key: str = ""
+
+    grams: frozenset = field(default_factory=frozenset)
+
+
+class AnswerCache(object):
+    """
+    重复问题的答案缓存
+
+    问题归一化后完全相同时直接命中；阈值小于 1 时再通过字符 n-gram 倒排索引查找 Jaccard 相似度不低于阈值、
+    且数字相同并且只有字符增删的历史问题。
+    只缓存会话中的第一个问题，并排除负反馈的回答；启动时从对话历史表加载，之后由后台线程增量刷新
+    """
+
+    def __init__(
+        self,
+        table: str,
+        client: MySqLClient = None,
+        ttl: int = config.CACHE_TTL,
+        similarity: float = config.CACHE_SIMILARITY,
+        max_entries: int = config.CACHE_MAX_ENTRIES,
+        refresh_interval: float = config.CACHE_REFRESH_INTERVAL,
+        n: int = 2,
+    ):
+        self.table = utils.trim(table)
+        self.client = client if client else MySqLClient()
+        self.ttl = max(1, ttl)
+        self.similarity = min(1.0, max(0.0, similarity))
+        self.max_entries = max(1, max_entries)
+        self.refresh_interval = max(1.0, refresh_interval)
+        self.n = max(1, n)
+
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.exact = {}
+        self.index = defaultdict(set)
+
+        # 缓存命中后返回给用户的新消息 id 到原始消息 id 的映射，用于负反馈时删除原始回答
+        self.aliases = OrderedDict()
+
+        # 已见过的会话，只有会话中的第一个问题才会被缓存，追问依赖上下文
+        self.conversations = OrderedDict()
+
+        self.last_id = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="answer-cache", daemon=True)
+        self.thread.start()
+
+    def _expired(self, entry: CachedAnswer, now: float) -> bool:
+        return now - entry.created > self.ttl
+
+    def _remove(self, message_id: str) -> None:
+        entry = self.entries.pop(message_id, None)
+        if not entry:
+            return
+
+        if self.exact.get(entry.key) is entry:
+            del self.exact[entry.key]
+
+        for gram in entry.grams:
+            postings = self.index.get(gram)
+            if postings is not None:
+                postings.discard(message_id)
+                if not postings:
+                    del self.index[gram]
+
+    def add(
+        self,
+        message_id: str,
+        question: str,
+        answer: str,
+        model: str = "",
+        created: float = 0,
+        conversation_id: str = "",
+    ) -> bool:
+        """缓存一个回答，返回是否被缓存"""
+        message_id, answer = utils.trim(message_id), utils.trim(answer)
+        key = normalize(question)
+        created = created or time.time()
+        if not message_id or not key or not answer or time.time() - created > self.ttl:
+            return False
+
+        with self.lock:
+            conversation_id = utils.trim(conversation_id)
+            if conversation_id:
+                if conversation_id in self.conversations:
+                    return False
+                self.conversations[conversation_id] = created
+                while len(self.conversations) > self.max_entries * 4:
+                    self.conversations.popitem(last=False)
+
+            existing = self.exact.get(key)
+            if existing:
+                # 答案相同时保留较早的记录，避免命中缓存后写入的历史不断延长有效期
+                if existing.answer == answer:
+                    return False
+                self._remove(existing.message_id)
+
+            entry = CachedAnswer(
+                message_id, utils.trim(question), answer, utils.trim(model), created, key, ngrams(key, self.n)
+            )
+            self._remove(message_id)
+            self.entries[message_id] = entry
+            self.exact[key] = entry
+            for gram in entry.grams:
+                self.index[gram].add(message_id)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+        return True
+
+    def lookup(self, question: str) -> CachedAnswer | None:
+        key = normalize(question)
+        if not key:
+            return None
+
+        now = time.time()
+        with self.lock:
+            entry = self.exact.get(key)
+            if entry and not self._expired(entry, now):
+                self.hits += 1
+                return entry
+
+            if self.similarity >= 1.0:
+                self.misses += 1
+                return None
+
+            grams = ngrams(key, self.n)
+
+            # 相似度不低于阈值时至少要共享 |q| - ceil(t * |q|) + 1 个 n-gram 中的一个，只需遍历最少见的这部分
+            prefix = len(grams) - math.ceil(self.similarity * len(grams)) + 1
+            rarest = sorted(grams, key=lambda x: len(self.index.get(x, ())))[: max(1, prefix)]
+
+            candidates = set()
+            for gram in rarest:
+                candidates.update(self.index.get(gram, ()))
+
+            best, score = None, self.similarity
+            for message_id in candidates:
+                candidate = self.entries[message_id]
+                if self._expired(candidate, now):
+                    continue
+
+                common = len(grams & candidate.grams)
+                value = common / (len(grams) + len(candidate.grams) - common)
+                if value >= score and compatible(key, candidate.key):
+                    best, score = candidate, value
+
+            if best:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return best
+
+    def link(self, message_id: str, entry: CachedAnswer) -> None:
+        """记录命中缓存后返回的新消息 id，对它的负反馈会删除原始回答"""
+        with self.lock:
+            self.aliases[message_id] = entry.message_id
+            while len(self.aliases) > self.max_entries:
+                self.aliases.popitem(last=False)
+
+    def invalidate(self, message_id: str) -> None:
+        """删除收到负反馈的回答"""
+        with self.lock:
+            self._remove(self.aliases.pop(message_id, message_id))
+
+    def _invalidate_row(self, message_id: str, question: str, answer: str) -> None:
+        with self.lock:
+            if message_id in self.entries or message_id in self.aliases:
+                self.invalidate(message_id)
+                return
+
+            # 其它实例中命中缓存后的负反馈只能按问题和答案匹配
+            entry = self.exact.get(normalize(question))
+            if entry and entry.answer == answer:
+                self._remove(entry.message_id)
+
+    def _load(self, rows: list[tuple]) -> None:
+        for row in rows:
+            id, conversation_id, message_id, question, answer, model, created, fb_score = row
+            self.last_id = max(self.last_id, int(id))
+
+            created = created.timestamp() if isinstance(created, datetime) else float(created or 0)
+            conversation_id, message_id = utils.decode(conversation_id), utils.decode(message_id)
+            if int(fb_score or 0) < 0:
+                # 负反馈的首个问题也要记录会话，避免把追问当作首个问题缓存
+                with self.lock:
+                    self.conversations.setdefault(conversation_id, created)
+                continue
+
+            self.add(
+                message_id, utils.decode(question), utils.decode(answer), utils.decode(model), created, conversation_id
+            )
+
+    def refresh(self) -> None:
+        """加载新写入的历史，并删除有效期内收到负反馈的回答"""
+        columns = "`id`, `conversation_id`, `message_id`, `question`, `answer`, `model`, `created`, `fb_score`"
+        cutoff = datetime.fromtimestamp(time.time() - self.ttl).strftime("%Y-%m-%d %H:%M:%S")
+
+        if self.last_id <= 0:
+            # 首次加载有效期内最新的记录
+            sql = f"SELECT {columns} FROM `{self.table}` WHERE `created` >= %s ORDER BY `id` DESC LIMIT %s"
+            rows = self.client.selectall(sql, (cutoff, self.max_entries))
+            if rows is None:
+                return
+            self._load(list(reversed(rows)))
+        else:
+            sql = f"SELECT {columns} FROM `{self.table}` WHERE `id` > %s ORDER BY `id` ASC LIMIT %s"
+            while True:
+                rows = self.client.selectall(sql, (self.last_id, 1000))
+                if not rows:
+                    break
+                self._load(rows)
+                if len(rows) < 1000:
+                    break
+
+        sql = f"SELECT `message_id`, `question`, `answer` FROM `{self.table}` WHERE `fb_score` < 0 AND `created` >= %s"
+        for message_id, question, answer in self.client.selectall(sql, (cutoff,)) or []:
+            self._invalidate_row(utils.decode(message_id), utils.decode(question), utils.decode(answer))
+
+        with self.lock:
+            now = time.time()
+            while self.entries and self._expired(next(iter(self.entries.values())), now):
+                self._remove(next(iter(self.entries)))
+
+    def _run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"刷新答案缓存失败，错误信息: {e}")
+
+            self.stopped.wait(self.refresh_interval)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "grams": len(self.index),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "last_id": self.last_id,
+            }
+
+    def close(self) -> None:
+        self.stopped.set()
+
+
+@utils.singleton
+def get_cache(table: str, client: MySqLClient = None) -> AnswerCache:
+    return AnswerCache(table=table, client=client)
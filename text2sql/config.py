@@ -15,3 +15,52 @@ LLM_API = "http://127.0.0.1:8080/v1/chat/completions"
 
 # 严格反馈模式，负反馈时必须填写反馈内容
 STRICT_FEEDBACK = True
+
+# 在侧边栏显示后台写入等运行状态，用于排查问题
+SHOW_STATS = False
+
+# 使用流式响应，回答逐字显示
+LLM_STREAM = True
+
+# 连接服务后端接口的超时时间（秒）
+LLM_CONNECT_TIMEOUT = 10
+
+# 读取响应的超时时间（秒），流式响应时为两次收到数据之间的最长间隔
+LLM_READ_TIMEOUT = 60
+
+# 与服务后端接口保持的最大连接数
+LLM_POOL_SIZE = 10
+
+# 每次提问携带的对话上下文预算，超出时从最早的对话开始淘汰
+CONTEXT_BUDGET = 8000
+
+# 上下文预算按估算的 token 数计算，否则按字符数计算
+CONTEXT_COUNT_TOKENS = False
+
+# 固定放在上下文最前面的系统提示词，计入预算且不会被淘汰
+SYSTEM_PROMPTS = []
+
+# 使用大模型把淘汰的对话概括为摘要并保留在上下文中
+CONTEXT_SUMMARY = False
+
+# 对话摘要的最大字数
+CONTEXT_SUMMARY_SIZE = 500
+
+# 对重复问题直接返回历史回答，只对会话中的第一个问题生效
+CACHE_ENABLED = False
+
+# 缓存回答的有效期（秒）
+CACHE_TTL = 7 * 24 * 3600
+
+# 问题相似度（字符 n-gram 的 Jaccard 系数）不低于该值时视为重复问题，1.0 表示只有归一化后完全相同的问题才命中
+# 小于 1.0 时还要求两个问题中的数字完全相同且只有字符的增删、没有替换，仍可能把含义不同的问题当作重复问题，需按实际数据调整
+CACHE_SIMILARITY = 1.0
+
+# 最多缓存的回答数量
+CACHE_MAX_ENTRIES = 10000
+
+# 从数据库增量加载新回答和负反馈的间隔（秒）
+CACHE_REFRESH_INTERVAL = 60
+
+# 刷新页面后恢复的对话轮数，更早的对话可以分页加载，0 表示不恢复
+RESTORE_PAGE_SIZE = 20
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# @Author  : wzdnzd
+# @Time    : 2026-10-19
+
+import re
+from collections import deque
+from typing import Callable
+
+import llm
+from tools.logger import logger
+from tools.utils import trim
+
+# 中日韩字符，每个字符大约对应一个 token
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def count_chars(text: str) -> int:
+    return len(text) if text else 0
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符每个计 1，其余字符每 4 个计 1"""
+    if not text:
+        return 0
+
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ChatContext(object):
+    """
+    单个会话的对话上下文
+
+    消息保存在双端队列中并维护总大小，追加和淘汰都是 O(1)，超出预算时从最早的一轮对话开始淘汰，
+    固定的系统提示词和淘汰对话的摘要始终放在最前面并计入预算，最新的一条消息总会保留
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        pinned: list[str] = None,
+        counter: Callable[[str], int] = count_chars,
+        summarizer: Callable[[str, list[dict]], str] = None,
+        low_water: float = 0.75,
+    ):
+        self.budget = max(1, budget)
+        self.counter = counter
+        self.summarizer = summarizer
+
+        # 有摘要时一次淘汰到预算的一定比例以下，避免每轮对话都调用一次摘要
+        self.low_water = min(1.0, max(0.0, low_water)) if summarizer else 1.0
+
+        self.pinned = [{"role": "system", "content": trim(x)} for x in (pinned or []) if trim(x)]
+        self.pinned_size = sum(self.counter(x["content"]) for x in self.pinned)
+
+        self.summary = ""
+        self.summary_size = 0
+
+        # 元素为 (消息, 大小)
+        self.messages = deque()
+        self.size = 0
+
+        # 最后一次追加时淘汰的消息和之前的摘要，撤销这条消息时一起恢复
+        self.undo = None
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def total(self) -> int:
+        """当前上下文的总大小，包括固定提示词和摘要"""
+        return self.pinned_size + self.summary_size + self.size
+
+    def append(self, role: str, content: str) -> None:
+        """追加一条消息，超出预算时淘汰最早的对话"""
+        size = self.counter(content)
+        self.messages.append(({"role": role, "content": content}, size))
+        self.size += size
+        self.undo = None
+
+        if self.total() > self.budget:
+            self.evict()
+
+    def pop(self) -> dict | None:
+        """移除最后一条消息，如请求失败时撤销已追加的问题，同时恢复追加它时淘汰的对话和之前的摘要"""
+        if not self.messages:
+            return None
+
+        message, size = self.messages.pop()
+        self.size -= size
+
+        if self.undo:
+            evicted, self.summary, self.summary_size = self.undo
+            self.messages.extendleft(reversed(evicted))
+            self.size += sum(x[1] for x in evicted)
+            self.undo = None
+
+        return message
+
+    def evict(self) -> None:
+        target = int(self.budget * self.low_water)
+        evicted = []
+
+        while len(self.messages) > 1 and self.total() > target:
+            evicted.append(self.__popleft())
+
+            # 按轮淘汰，不保留缺少问题的回答
+            while len(self.messages) > 1 and self.messages[0][0]["role"] == "assistant":
+                evicted.append(self.__popleft())
+
+        if not evicted:
+            return
+
+        self.undo = (evicted, self.summary, self.summary_size)
+        if self.summarizer:
+            self.summarize([message for message, _ in evicted])
+
+    def __popleft(self) -> tuple[dict, int]:
+        item = self.messages.popleft()
+        self.size -= item[1]
+        return item
+
+    def summarize(self, evicted: list[dict]) -> None:
+        try:
+            summary = trim(self.summarizer(self.summary, evicted))
+        except Exception as e:
+            logger.error(f"生成对话摘要失败，错误信息: {e}")
+            return
+
+        if summary:
+            self.summary = summary
+            self.summary_size = self.counter(summary)
+
+    def build(self) -> list[dict]:
+        """生成发送给模型的消息列表"""
+        messages = list(self.pinned)
+        if self.summary:
+            messages.append({"role": "system", "content": f"以下是之前对话的摘要：\n{self.summary}"})
+
+        messages.extend(message for message, _ in self.messages)
+        return messages
+
+    def clear(self) -> None:
+        self.summary, self.summary_size = "", 0
+        self.messages.clear()
+        self.size = 0
+        self.undo = None
+
+
+def llm_summarizer(url: str, apikey: str = "", limit: int = 500) -> Callable[[str, list[dict]], str]:
+    """使用大模型把之前的摘要和淘汰的对话合并为新的摘要，失败时保留之前的摘要"""
+
+    def summarize(summary: str, evicted: list[dict]) -> str:
+        lines = [f"之前的摘要：{summary}"] if summary else []
+        lines.extend(f"{message['role']}: {message['content']}" for message in evicted)
+
+        prompt = f"请用不超过 {limit} 字概括以下对话中的关键信息，只输出摘要内容：\n" + "\n".join(lines)
+        response = llm.chat(url=url, messages=[{"role": "user", "content": prompt}], apikey=apikey, retry=0)
+        if not response.success:
+            return summary
+
+        return trim(response.content)[:limit]
+
+    return summarize
@@ -49,3 +49,42 @@ DB_SET_SESSION = None
 
 # creator : 使用连接数据库的模块
 DB_CREATOR = pymysql
+
+# 后台批量写入队列的容量，队列满时直接写入本地缓冲文件
+DB_WRITE_QUEUE_SIZE = 1000
+
+# 单次批量写入的最大记录数
+DB_WRITE_BATCH_SIZE = 100
+
+# 批量写入前等待更多记录的最长时间（秒）
+DB_WRITE_FLUSH_INTERVAL = 0.5
+
+# 数据库不可用时暂存记录的本地文件（sqlite），相对路径基于项目根目录
+DB_SPOOL_FILE = "data/spool.db"
+
+# 数据库不可用后重新尝试写入的间隔（秒）
+DB_RETRY_INTERVAL = 10
+
+# 输出写入统计日志的间隔（秒），0 表示不输出
+DB_STATS_LOG_INTERVAL = 300
+
+# 连接异常时重试的初始等待时间（秒），之后每次翻倍
+DB_RETRY_BACKOFF = 0.2
+
+# 连接异常时重试的最长等待时间（秒）
+DB_RETRY_BACKOFF_MAX = 5
+
+# 批量写入时单条语句的最大字节数，实际值不超过服务端的 max_allowed_packet
+DB_MAX_STATEMENT_SIZE = 4 * 1024 * 1024
+
+# 连接池中没有可用连接时最长等待时间（秒），超时后抛出异常而不是一直等待，0 表示一直等待
+DB_CHECKOUT_TIMEOUT = 10
+
+# ping: 检查连接是否可用的时机（0 不检查，1 从连接池取出时，2 创建游标时，4 执行语句时，可组合）
+DB_PING = 1
+
+# 检查连接是否可用时执行的语句，为空时使用驱动的 ping()
+DB_PING_QUERY = "SELECT 1"
+
+# 单个连接的最长存活时间（秒），超过后归还时关闭并在下次取出时重新建立，0 表示不限制
+DB_MAX_LIFETIME = 3600
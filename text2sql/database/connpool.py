@@ -3,15 +3,85 @@
 # @Author  : wzdnzd
 # @Time    : 2024-02-28
 
+import json
+import threading
+import time
+import weakref
+
 from dbutils.pooled_db import PooledDB
+from dbutils.steady_db import SteadyDBConnection
 
 from database import config
 from tools import utils
+from tools.logger import logger
+
+# 获取连接等待时间直方图的分桶上限（毫秒）
+WAIT_BUCKETS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+# DBUtils 3.2 起 ping 支持 (时机, 语句) 并提供 dbapi_connection，之前的版本 ping 只接受整数
+MODERN_DBUTILS = hasattr(SteadyDBConnection, "dbapi_connection")
+
+
+def dbapi_connection(conn):
+    """连接池连接对应的底层 DB-API 连接"""
+    if MODERN_DBUTILS:
+        return conn.dbapi_connection
+
+    # 连接池连接 -> SteadyDBConnection -> DB-API 连接
+    return conn._con._con
+
+
+class PoolTimeoutError(Exception):
+    """在 DB_CHECKOUT_TIMEOUT 内没有可用的连接"""
+
+
+class TrackedConnection(object):
+    """从连接池中取出的连接，关闭时归还给连接池并更新统计"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.checkin(conn)
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise AttributeError(f"连接已归还，无法访问 {name}")
+        return getattr(conn, name)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
 
 class MyConnectionPool(object):
     __pool = None
 
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # 限制同时使用的连接数，代替 PooledDB 的无限等待，等待超时后抛出 PoolTimeoutError
+        limit = config.DB_MAX_CONNECYIONS
+        self.semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+        # 底层连接的创建时间，用于计算连接存活时间和定期更换连接
+        self.births = weakref.WeakKeyDictionary()
+
+        self.active = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.rotated = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.histogram = [0] * (len(WAIT_BUCKETS) + 1)
+        self.logged_at = time.time()
+
     def __verify__(self):
         """验证数据库配置是否正确"""
         for item in [config.DB_HOST, config.DB_USERNAME, config.DB_PASSWORD, config.DB_DATABASE]:
@@ -22,8 +92,7 @@ class MyConnectionPool(object):
 
     def __enter__(self):
         """创建数据库连接 conn 和游标 cursor"""
-        self.conn = self.__getconn()
-        self.cursor = self.conn.cursor()
+        self.conn, self.cursor = self.getconn()
 
     def __getconn(self):
         """创建数据库连接池"""
@@ -31,6 +100,11 @@ class MyConnectionPool(object):
             if not self.__verify__():
                 raise ValueError("数据库连接配置错误")
 
+            # 从连接池取出连接时检查连接是否可用，不可用则重新建立；旧版本 DBUtils 只能使用驱动的 ping()
+            ping = config.DB_PING
+            if config.DB_PING_QUERY and MODERN_DBUTILS:
+                ping = (config.DB_PING, config.DB_PING_QUERY)
+
             self.__pool = PooledDB(
                 host=utils.trim(config.DB_HOST),
                 port=config.DB_PORT,
@@ -45,6 +119,7 @@ class MyConnectionPool(object):
                 blocking=config.DB_BLOCKING,
                 maxusage=config.DB_MAX_USAGE,
                 setsession=config.DB_SET_SESSION,
+                ping=ping,
                 use_unicode=False,
                 charset=config.DB_CHARSET,
             )
@@ -56,12 +131,109 @@ class MyConnectionPool(object):
         self.cursor.close()
         self.conn.close()
 
-    def getconn(self):
-        """从连接池中取出一个连接"""
-        conn = self.__getconn()
-        cursor = conn.cursor()
+    def checkout(self):
+        """从连接池中取出一个连接，最多等待 DB_CHECKOUT_TIMEOUT 秒"""
+        start = time.perf_counter()
+        if self.semaphore is not None:
+            timeout = config.DB_CHECKOUT_TIMEOUT if config.DB_CHECKOUT_TIMEOUT > 0 else None
+            if not self.semaphore.acquire(timeout=timeout):
+                with self.lock:
+                    self.timeouts += 1
+                    active = self.active
+                raise PoolTimeoutError(f"获取数据库连接超时（{timeout} 秒），使用中的连接数：{active}")
+
+        try:
+            conn = self.__getconn()
+        except Exception:
+            if self.semaphore is not None:
+                self.semaphore.release()
+            raise
+
+        wait = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.active += 1
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.histogram[self.__bucket(wait)] += 1
+
+            raw = dbapi_connection(conn)
+            if raw not in self.births:
+                self.births[raw] = time.time()
+
+        self.__log_stats()
+        return TrackedConnection(self, conn)
+
+    def checkin(self, conn):
+        """归还连接，超过最长存活时间的底层连接先关闭，下次取出时由 ping 检查发现并重新建立"""
+        try:
+            lifetime = config.DB_MAX_LIFETIME
+            raw = dbapi_connection(conn)
+            born = self.births.get(raw)
+            if lifetime > 0 and born is not None and time.time() - born > lifetime:
+                with self.lock:
+                    self.births.pop(raw, None)
+                    self.rotated += 1
+                try:
+                    raw.close()
+                except Exception as e:
+                    logger.error(f"关闭过期的数据库连接失败，错误信息: {e}")
+        finally:
+            conn.close()
+            with self.lock:
+                self.active -= 1
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+    def getconn(self, cursorclass=None):
+        """从连接池中取出一个连接，cursorclass 为游标类型，默认为普通的缓冲游标"""
+        conn = self.checkout()
+        try:
+            cursor = conn.cursor(cursorclass) if cursorclass else conn.cursor()
+        except Exception:
+            conn.close()
+            raise
         return conn, cursor
 
+    def __bucket(self, wait):
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if wait <= bound:
+                return i
+        return len(WAIT_BUCKETS)
+
+    def stats(self):
+        """连接数、获取连接的等待时间分布（毫秒）和连接存活时间（秒）"""
+        now = time.time()
+        with self.lock:
+            ages = [now - born for born in self.births.values()]
+            labels = [f"<={x}ms" for x in WAIT_BUCKETS] + [f">{WAIT_BUCKETS[-1]}ms"]
+
+            return {
+                "max": config.DB_MAX_CONNECYIONS,
+                "active": self.active,
+                "idle": max(0, len(ages) - self.active),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "rotated": self.rotated,
+                "wait_ms": {
+                    "avg": round(self.wait_total / self.checkouts, 2) if self.checkouts else 0,
+                    "max": round(self.wait_max, 2),
+                    "histogram": dict(zip(labels, self.histogram)),
+                },
+                "age_s": {
+                    "avg": round(sum(ages) / len(ages), 1) if ages else 0,
+                    "max": round(max(ages), 1) if ages else 0,
+                },
+            }
+
+    def __log_stats(self):
+        interval = config.DB_STATS_LOG_INTERVAL
+        if interval <= 0 or time.time() - self.logged_at < interval:
+            return
+
+        self.logged_at = time.time()
+        logger.info(f"数据库连接池统计: {json.dumps(self.stats(), ensure_ascii=False)}")
+
 
 @utils.singleton
 def get_instance():
@@ -6,42 +6,106 @@
 import time
 from datetime import datetime
 
+from pymysql import cursors, err
+
+from database import config
 from database.connpool import get_instance
 from history import ChatHistory
-from pymysql.converters import escape_string
 from tools import utils
 from tools.logger import logger
 
+# 连接断开、锁等待超时、死锁等可以通过重试解决的异常
+RETRY_ERRORS = (err.OperationalError, err.InterfaceError)
+
+# 对话历史表的字段，与 history_row 返回值的顺序一致
+HISTORY_COLUMNS = ["conversation_id", "message_id", "question", "answer", "model", "created", "fb_score", "fb_detail"]
+
+# message_id 重复时（如重放已写入的记录）只更新内容，不覆盖已提交的反馈
+HISTORY_UPDATES = ["question", "answer", "model"]
+
+# 建表之后新增的二级索引，由 migrate_table 补充到已存在的表中
+INDEXES = {
+    "idx_conversation_created": "(`conversation_id`, `created`)",
+    "idx_created": "(`created`)",
+}
+
+# 更新用户反馈，参数与 feedback_row 返回值的顺序一致
+FEEDBACK_SQL = "UPDATE `{table}` SET `fb_score` = %s, `fb_detail` = %s WHERE `message_id` = %s"
+
 
 class MySqLClient(object):
     def __init__(self):
         # 从数据池中获取连接
         self.db = get_instance()
 
-    def execute(self, sql, param=None, autoclose=False, retry=3):
-        """执行SQL语句"""
-        count, retry = 0, max(0, retry)
-
-        # 从连接池获取连接
-        conn, cursor = self.db.getconn()
+        # 单条批量语句允许的最大字节数，首次批量写入时根据服务端 max_allowed_packet 确定
+        self.__statement_size = 0
+
+    def __retry(self, func, retry=3):
+        """执行 func，连接类异常时按指数退避重试，重试次数用完或其它异常时抛出"""
+        retry = max(0, retry)
+        for attempt in range(retry + 1):
+            try:
+                return func()
+            except RETRY_ERRORS as e:
+                if attempt >= retry:
+                    raise
+
+                delay = min(config.DB_RETRY_BACKOFF * 2**attempt, config.DB_RETRY_BACKOFF_MAX)
+                logger.warning(f"数据库连接异常，{delay:.2f} 秒后进行第 {attempt + 1} 次重试，错误信息: {e}")
+                time.sleep(delay)
+
+    def __rollback(self, conn):
+        """回滚事务，连接已断开时忽略异常"""
         try:
-            if param:
-                count = cursor.execute(sql, param)
-            else:
-                count = cursor.execute(sql)
+            conn.rollback()
+        except Exception as e:
+            logger.error(f"回滚事务失败，错误信息: {e}")
 
-            conn.commit()
-            if autoclose:
+    def execute(self, sql, param=None, autoclose=False, retry=3):
+        """执行SQL语句，失败时抛出异常"""
+
+        def run():
+            # 从连接池获取连接，每次重试都使用新的连接
+            conn, cursor = self.db.getconn()
+            try:
+                if param:
+                    count = cursor.execute(sql, param)
+                else:
+                    count = cursor.execute(sql)
+
+                conn.commit()
+            except Exception:
+                self.__rollback(conn)
                 self.close(conn, cursor)
-        except Exception as e:
-            logger.error(e)
+                raise
 
-            if retry > 0:
-                conn.rollback()
+            if autoclose:
+                self.close(conn, cursor)
+            return conn, cursor, count
+
+        return self.__retry(run, retry)
+
+    def transaction(self, func, retry=3):
+        """
+        在一个事务中执行 func(cursor) 并提交，返回 func 的结果
+
+        失败时回滚，连接类异常会在新的连接上重新执行整个事务，因此 func 应当是幂等的
+        """
+
+        def run():
+            conn, cursor = self.db.getconn()
+            try:
+                result = func(cursor)
+                conn.commit()
+                return result
+            except Exception:
+                self.__rollback(conn)
+                raise
+            finally:
                 self.close(conn, cursor)
-                return self.execute(sql, param, autoclose, retry - 1)
 
-        return conn, cursor, count
+        return self.__retry(run, retry)
 
     def close(self, conn, cursor):
         """释放连接归还给连接池"""
@@ -74,33 +138,119 @@ class MySqLClient(object):
         return self.__select(sql, param, True)
 
     def insertmany(self, sql, param, retry=3):
-        """插入多行数据"""
-        conn, cursor = self.db.getconn()
-        count, retry = -1, max(0, retry)
-
+        """插入多行数据，返回影响的行数，失败时返回 -1"""
         try:
-            cursor.executemany(sql, param)
-            conn.commit()
+            return self.transaction(lambda cursor: cursor.executemany(sql, param) or 0, retry)
         except Exception as e:
             logger.error(e)
-            conn.rollback()
+            return -1
+
+    def statement_size(self, cursor):
+        """单条批量语句允许的最大字节数，不超过配置值和服务端 max_allowed_packet"""
+        if self.__statement_size <= 0:
+            cursor.execute("SELECT @@max_allowed_packet")
+            packet = int(cursor.fetchone()[0])
+
+            # 预留协议头和语句前后缀之外的余量
+            self.__statement_size = max(1024, min(config.DB_MAX_STATEMENT_SIZE, packet - 1024))
+
+        return self.__statement_size
+
+    def upsert(self, cursor, table, columns, rows, updates=None):
+        """
+        在给定游标上执行多行 INSERT ... ON DUPLICATE KEY UPDATE，不提交事务
+
+        按 statement_size 把 rows 拆分成多条语句，updates 为唯一键冲突时需要更新的字段，默认更新全部字段，
+        为空列表时冲突会报错。返回 MySQL 报告的影响行数：新插入的行计 1，被更新的行计 2，内容未变化的行计 0
+        """
+        table = utils.trim(table)
+        if not table or not columns:
+            raise ValueError("批量写入失败，表名和字段不能为空")
+        if not rows:
+            return 0
+
+        updates = columns if updates is None else updates
+        names = ", ".join(f"`{column}`" for column in columns)
+        prefix = f"INSERT INTO `{table}` ({names}) VALUES "
+        suffix = ""
+        if updates:
+            suffix = " ON DUPLICATE KEY UPDATE " + ", ".join(f"`{column}` = VALUES(`{column}`)" for column in updates)
+
+        placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        limit = self.statement_size(cursor)
+        base = len(prefix.encode("utf8")) + len(suffix.encode("utf8"))
+
+        count, values, size = 0, [], base
+        for row in rows:
+            value = cursor.mogrify(placeholder, row)
+            length = len(value.encode("utf8")) + 1
+            if values and size + length > limit:
+                count += cursor.execute(prefix + ",".join(values) + suffix)
+                values, size = [], base
+
+            values.append(value)
+            size += length
+
+        if values:
+            count += cursor.execute(prefix + ",".join(values) + suffix)
 
-        self.close(conn, cursor)
         return count
 
-    def update(self, sql, param=None):
-        """更新数据"""
-        conn, cursor, count = None, None, -1
-
+    def upsertmany(self, table, columns, rows, updates=None, retry=3):
+        """在一个事务中批量写入或更新多行数据，返回影响的行数，失败时返回 -1，参见 upsert"""
         try:
-            conn, cursor, count = self.execute(sql, param)
-            conn.commit()
+            return self.transaction(lambda cursor: self.upsert(cursor, table, columns, rows, updates), retry)
         except Exception as e:
             logger.error(e)
-            conn.rollback()
+            return -1
+
+    def iterate(self, table, columns, where="", param=None, key="id", page_size=10000, fetch_size=1000):
+        """
+        按 key 升序分页读取数据，每次返回最多 fetch_size 行
+
+        每页使用无缓冲的服务端游标逐批取回，页与页之间按 key 定位而不是 OFFSET，内存占用与总行数无关。
+        columns 中必须包含 key，where 为不含 WHERE 关键字的过滤条件，其中的占位符由 param 填充
+        """
+        table = utils.trim(table)
+        if not table or not columns or key not in columns:
+            raise ValueError(f"读取数据失败，表名和字段不能为空且字段中必须包含 {key}")
+
+        index = columns.index(key)
+        names = ", ".join(f"`{column}`" for column in columns)
+        condition = f"`{key}` > %s" + (f" AND ({where})" if where else "")
+        sql = f"SELECT {names} FROM `{table}` WHERE {condition} ORDER BY `{key}` ASC LIMIT %s"
+        page_size, fetch_size, param = max(1, page_size), max(1, fetch_size), list(param or [])
+
+        conn, cursor = self.db.getconn(cursors.SSCursor)
+        try:
+            last = 0
+            while True:
+                cursor.execute(sql, [last, *param, page_size])
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+
+                    count += len(rows)
+                    last = rows[-1][index]
+                    yield rows
+
+                # 每页结束后提交，避免整个导出过程持有同一个一致性读快照
+                conn.commit()
+                if count < page_size:
+                    break
+        finally:
+            self.close(conn, cursor)
 
-        self.close(conn, cursor)
-        return count
+    def update(self, sql, param=None, retry=3):
+        """更新数据，返回影响的行数，失败时返回 -1"""
+        try:
+            _, _, count = self.execute(sql, param, autoclose=True, retry=retry)
+            return count
+        except Exception as e:
+            logger.error(e)
+            return -1
 
     def insertone(self, sql, param):
         """插入单行数据"""
@@ -153,85 +303,242 @@ def create_table(table: str, client: MySqLClient = None):
             `fb_score` tinyint NOT NULL DEFAULT '0' COMMENT '用户反馈，-1 表示负反馈，1 表示正反馈，0 表示未反馈',
             `fb_detail` text CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci COMMENT '用户反馈文本内容',
             PRIMARY KEY (`id` DESC),
-            UNIQUE KEY `uk_message_id` (`message_id`) USING BTREE
+            UNIQUE KEY `uk_message_id` (`message_id`) USING BTREE,
+            KEY `idx_conversation_created` (`conversation_id`, `created`),
+            KEY `idx_created` (`created`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
     """
 
     if not client:
         client = MySqLClient()
 
-    return client.create(table, sql, False)
+    if not client.create(table, sql, False):
+        return False
+
+    # 补充旧版本建表时没有的索引，失败不影响读写
+    migrate_table(table=table, client=client)
+    return True
+
+
+def migrate_table(table: str, client: MySqLClient = None) -> bool:
+    """为已存在的表添加缺少的索引"""
+    table = utils.trim(table)
+    if not table:
+        logger.error("迁移表失败，表名不能为空")
+        return False
+
+    client = MySqLClient() if not client else client
+    sql = "SELECT DISTINCT `INDEX_NAME` FROM `information_schema`.`STATISTICS` WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s"
+    rows = client.selectall(sql, (table,))
+    if rows is None:
+        logger.error(f"迁移表失败，无法读取表 {table} 的索引")
+        return False
+
+    existing = {utils.decode(row[0]) for row in rows}
+    missing = [name for name in INDEXES if name not in existing]
+    if not missing:
+        return True
+
+    # 在线添加索引，不阻塞读写
+    logger.info(f"为表 {table} 添加索引：{', '.join(missing)}")
+    actions = ", ".join(f"ADD INDEX `{name}` {INDEXES[name]}" for name in missing)
+    return client.update(f"ALTER TABLE `{table}` {actions}, ALGORITHM=INPLACE, LOCK=NONE") >= 0
 
 
 def save_history(table: str, history: ChatHistory, client: MySqLClient = None) -> bool:
     """保存对话历史"""
-    error, table = "保存对话历史失败，", utils.trim(table)
+    table = utils.trim(table)
     if not table:
-        logger.error(f"{error}表名不能为空")
+        logger.error("保存对话历史失败，表名不能为空")
+        return False
+
+    row = history_row(history)
+    if not row:
         return False
 
+    client = MySqLClient() if not client else client
+    return client.upsertmany(table, HISTORY_COLUMNS, [row], HISTORY_UPDATES) >= 0
+
+
+def save_feedback(
+    table: str, message_id: str, fb_score: int, fb_detail: str, client: MySqLClient = None, strict: bool = True
+) -> tuple[bool, str]:
+    """保存用户反馈"""
+    table = utils.trim(table)
+    if not table:
+        logger.error("保存用户反馈失败，表名不能为空")
+        return False, "表名不能为空"
+
+    row, warn = feedback_row(message_id=message_id, fb_score=fb_score, fb_detail=fb_detail, strict=strict)
+    if not row:
+        return False, warn
+
+    client = MySqLClient() if not client else client
+    success = client.update(FEEDBACK_SQL.format(table=table), row) == 1
+    warn = "反馈失败，请重新提交" if not success else "提交成功，感谢您的反馈"
+
+    return success, warn
+
+
+def history_row(history: ChatHistory) -> tuple | None:
+    """校验对话历史，返回参数化写入所需的字段值，校验失败时返回 None"""
+    error = "保存对话历史失败，"
     if not history or not isinstance(history, ChatHistory):
         logger.error(f"{error}对话历史数据不能为空")
-        return False
+        return None
 
     conversation_id = utils.trim(history.conversation_id)
     if not conversation_id:
         logger.error(f"{error}对话 id 不能为空")
-        return False
+        return None
 
     message_id = utils.trim(history.message_id)
     if not message_id:
         logger.error(f"{error}消息 id 不能为空")
-        return False
+        return None
 
-    question = escape_string(utils.trim(history.question))
+    question = utils.trim(history.question)
     if not question:
         logger.error(f"{error}用户提问的问题不能为空")
-        return False
+        return None
 
-    answer = escape_string(utils.trim(history.answer))
+    answer = utils.trim(history.answer)
     if not answer:
         logger.error(f"{error}服务提供的答案不能为空")
-        return False
+        return None
 
     created = history.created if history.created else int(time.time())
-    model = utils.trim(history.model)
     timestamp = datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S")
-
     fb_score = history.fb_score if history.fb_score is not None else 0
-    fb_detail = escape_string(utils.trim(history.fb_detail))
 
-    sql = f"INSERT INTO `{table}` (`conversation_id`, `message_id`, `question`, `answer`, `model`, `created`, `fb_score`, `fb_detail`) VALUES ('{conversation_id}', '{message_id}', '{question}', '{answer}', '{model}', '{timestamp}', '{fb_score}', '{fb_detail}');"
+    return (
+        conversation_id,
+        message_id,
+        question,
+        answer,
+        utils.trim(history.model),
+        timestamp,
+        fb_score,
+        utils.trim(history.fb_detail),
+    )
 
-    client = MySqLClient() if not client else client
-    return client.insertone(sql, None) == 1
 
+def feedback_row(message_id: str, fb_score: int, fb_detail: str, strict: bool = True) -> tuple[tuple | None, str]:
+    """校验用户反馈，返回参数化更新所需的字段值和错误信息"""
+    message_id, fb_detail = utils.trim(message_id), utils.trim(fb_detail)
 
-def save_feedback(
-    table: str, message_id: str, fb_score: int, fb_detail: str, client: MySqLClient = None, strict: bool = True
-) -> tuple[bool, str]:
-    """保存用户反馈"""
-    goon, error, warn = True, "保存用户反馈失败，", ""
+    warn = ""
+    if not message_id:
+        warn = "消息 id 不能为空"
+    elif strict and fb_score < 0 and not fb_detail:
+        warn = "用户反馈内容不能为空"
+
+    if warn:
+        logger.error(f"保存用户反馈失败，{warn}")
+        return None, warn
+
+    return (fb_score, fb_detail, message_id), ""
 
+
+def write_batch(table: str, histories: list[tuple], feedbacks: list[tuple], client: MySqLClient = None) -> int:
+    """
+    在一个事务中批量写入对话历史和用户反馈，先写入历史再更新反馈，失败时回滚并抛出异常
+
+    对话历史按 message_id 去重，重复写入（如从本地缓冲文件重放）只更新内容，不会报错
+    """
     table = utils.trim(table)
-    message_id = utils.trim(message_id)
-    fb_detail = escape_string(utils.trim(fb_detail))
+    if not table:
+        raise ValueError("表名不能为空")
+
+    def run(cursor):
+        count = 0
+        if histories:
+            count += client.upsert(cursor, table, HISTORY_COLUMNS, histories, HISTORY_UPDATES)
+        if feedbacks:
+            count += cursor.executemany(FEEDBACK_SQL.format(table=table), feedbacks) or 0
 
+        return count
+
+    # 失败由调用方转存到本地缓冲文件，这里不再重试
+    client = MySqLClient() if not client else client
+    return client.transaction(run, retry=0)
+
+
+def to_history(row: tuple) -> ChatHistory:
+    """把按 id 和 HISTORY_COLUMNS 顺序查询的结果转换为对话历史"""
+    _, conversation_id, message_id, question, answer, model, created, fb_score, fb_detail = row
+    return ChatHistory(
+        conversation_id=utils.decode(conversation_id),
+        message_id=utils.decode(message_id),
+        question=utils.decode(question),
+        answer=utils.decode(answer),
+        model=utils.decode(model),
+        created=int(created.timestamp()) if isinstance(created, datetime) else int(created or 0),
+        fb_score=int(fb_score or 0),
+        fb_detail=utils.decode(fb_detail),
+    )
+
+
+def query_histories(
+    table: str, where: str, param: list, before: tuple = None, limit: int = 20, client: MySqLClient = None
+) -> tuple[list[ChatHistory], tuple | None]:
+    """
+    按 (created, id) 倒序分页查询对话历史，返回按时间正序排列的记录和读取更早记录的游标
+
+    游标为本页最早一条记录的 (created, id)，下一页从游标之后继续，不使用 OFFSET；没有更早的记录时游标为 None
+    """
+    table, limit = utils.trim(table), max(1, limit)
     if not table:
-        goon, warn = False, "表名不能为空"
-    if not message_id:
-        goon, warn = False, "消息 id 不能为空"
-    elif strict and fb_score < 0 and not fb_detail:
-        goon, warn = False, "用户反馈内容不能为空"
+        logger.error("查询对话历史失败，表名不能为空")
+        return [], None
 
-    if not goon:
-        logger.error(f"{error}{warn}")
-        return False, warn
+    conditions, param = ([where] if where else []), list(param or [])
+    if before:
+        conditions.append("(`created` < %s OR (`created` = %s AND `id` < %s))")
+        param.extend([before[0], before[0], before[1]])
 
-    sql = f"UPDATE `{table}` SET `fb_score` = '{fb_score}', `fb_detail` = '{fb_detail}' WHERE `message_id` = '{message_id}';"
+    columns = ", ".join(f"`{column}`" for column in ["id", *HISTORY_COLUMNS])
+    sql = f"SELECT {columns} FROM `{table}`"
+    if conditions:
+        sql += f" WHERE {' AND '.join(conditions)}"
+
+    # 多取一条判断是否还有更早的记录
+    sql += " ORDER BY `created` DESC, `id` DESC LIMIT %s"
+    param.append(limit + 1)
 
     client = MySqLClient() if not client else client
-    success = client.update(sql, None) == 1
-    warn = "反馈失败，请重新提交" if not success else "提交成功，感谢您的反馈"
+    rows = client.selectall(sql, param)
+    if not rows:
+        return [], None
 
-    return success, warn
+    rows = list(rows)
+    cursor = (rows[limit - 1][6], rows[limit - 1][0]) if len(rows) > limit else None
+
+    return [to_history(row) for row in reversed(rows[:limit])], cursor
+
+
+def load_conversation(
+    table: str, conversation_id: str, before: tuple = None, limit: int = 20, client: MySqLClient = None
+) -> tuple[list[ChatHistory], tuple | None]:
+    """读取一个会话中 before 之前最近的 limit 轮对话，使用 idx_conversation_created 索引，参见 query_histories"""
+    conversation_id = utils.trim(conversation_id)
+    if not conversation_id:
+        logger.error("查询对话历史失败，对话 id 不能为空")
+        return [], None
+
+    return query_histories(table, "`conversation_id` = %s", [conversation_id], before, limit, client)
+
+
+def list_histories(
+    table: str, start: str = "", end: str = "", before: tuple = None, limit: int = 20, client: MySqLClient = None
+) -> tuple[list[ChatHistory], tuple | None]:
+    """按时间浏览所有会话的对话历史，start 和 end 为提问时间范围，使用 idx_created 索引，参见 query_histories"""
+    conditions, param = [], []
+    if start:
+        conditions.append("`created` >= %s")
+        param.append(start)
+    if end:
+        conditions.append("`created` < %s")
+        param.append(end)
+
+    return query_histories(table, " AND ".join(conditions), param, before, limit, client)
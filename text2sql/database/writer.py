@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# @Author  : wzdnzd
+# @Time    : 2026-10-19
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from pymysql import err
+
+from database import config
+from database.dbclient import MySqLClient, create_table, write_batch
+from tools import utils
+from tools.logger import logger
+
+# 数据本身有问题（如字段超长）时，重试没有意义，其余异常视为数据库不可用
+DATA_ERRORS = (err.IntegrityError, err.DataError, err.ProgrammingError, err.NotSupportedError)
+
+
+class Spool(object):
+    """数据库不可用时暂存待写入记录的本地 sqlite 文件，按写入顺序重放"""
+
+    def __init__(self, filename: str):
+        if not os.path.isabs(filename):
+            filename = os.path.join(utils.BASE_DIR, filename)
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, item TEXT NOT NULL)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def append(self, items: list[tuple]) -> None:
+        with self.lock:
+            self.conn.executemany("INSERT INTO spool (item) VALUES (?)", [(json.dumps(x),) for x in items])
+            self.conn.commit()
+            self.size += len(items)
+
+    def peek(self, limit: int) -> tuple[int, list[tuple]]:
+        """返回最早的若干条记录和其中最大的 id"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, item FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+        if not rows:
+            return 0, []
+        return rows[-1][0], [tuple(json.loads(item)) for _, item in rows]
+
+    def remove(self, last_id: int) -> None:
+        with self.lock:
+            count = self.conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,)).rowcount
+            self.conn.commit()
+            self.size = max(0, self.size - count)
+
+
+class WriteBehindWriter(object):
+    """
+    后台批量写入对话历史和用户反馈
+
+    页面只需把记录放入有界队列即可返回，由后台线程合并成批后在一个事务中写入；数据库不可用时记录转存到本地
+    缓冲文件，恢复后按原顺序重放。缓冲文件中还有记录时，新记录也追加到缓冲文件，保证反馈总在对应的历史之后写入。
+    队列写满后提交的记录先暂存在内存中，由后台线程排在队列中剩余记录之后转存，只有后台线程写缓冲文件，顺序不会错乱
+    """
+
+    def __init__(
+        self,
+        table: str,
+        client: MySqLClient = None,
+        queue_size: int = config.DB_WRITE_QUEUE_SIZE,
+        batch_size: int = config.DB_WRITE_BATCH_SIZE,
+        flush_interval: float = config.DB_WRITE_FLUSH_INTERVAL,
+        spool_file: str = config.DB_SPOOL_FILE,
+        retry_interval: float = config.DB_RETRY_INTERVAL,
+    ):
+        self.table = table
+        self.client = client if client else MySqLClient()
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.retry_interval = max(0.0, retry_interval)
+        self.spool = Spool(spool_file)
+
+        # 表在运行期间被删除，下次写入前需要重新创建，启动时的建表由调用方完成
+        self.missing = False
+        # 数据库不可用时下次重试的时间
+        self.retry_at = 0.0
+
+        # 队列写满后提交的记录，非空时新记录也追加到这里，保持提交顺序
+        self.overflow = deque()
+        self.order_lock = threading.Lock()
+
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=100)
+        self.written = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.last_error = ""
+        self.logged_at = time.time()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit_history(self, row: tuple) -> None:
+        """提交一条已校验的对话历史，参见 dbclient.history_row"""
+        self._submit(("history", *row))
+
+    def submit_feedback(self, row: tuple) -> None:
+        """提交一条已校验的用户反馈，参见 dbclient.feedback_row"""
+        self._submit(("feedback", *row))
+
+    def _submit(self, item: tuple) -> None:
+        with self.order_lock:
+            if not self.overflow:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    pass
+
+            # 队列已满说明写入跟不上，不阻塞页面，由后台线程转存到缓冲文件
+            self.overflow.append(item)
+
+    def _take(self) -> list[tuple]:
+        """取出一批记录，拿到第一条后最多再等待 flush_interval 秒凑满一批"""
+        # 缓冲文件中还有待重放的记录或有溢出的记录时不等待新记录
+        wait = 0 if (self.spool.size > 0 and self._available()) or self.overflow else 1
+        try:
+            items = [self.queue.get(timeout=wait)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                items.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return items
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self.retry_at
+
+    def _write(self, items: list[tuple]) -> None:
+        """写入一批记录，数据库不可用时抛出异常"""
+        if self.missing:
+            if not create_table(table=self.table, client=self.client):
+                raise Exception(f"创建表 {self.table} 失败")
+            self.missing = False
+
+        histories = [x[1:] for x in items if x[0] == "history"]
+        feedbacks = [x[1:] for x in items if x[0] == "feedback"]
+
+        start = time.perf_counter()
+        try:
+            write_batch(self.table, histories, feedbacks, self.client)
+        except DATA_ERRORS as e:
+            if isinstance(e, err.ProgrammingError) and e.args and e.args[0] == 1146:
+                # 表被删除，重新建表后再写入
+                self.missing = True
+                raise
+
+            if len(items) == 1:
+                # 无法写入的记录只记录日志后丢弃，避免阻塞后续写入
+                with self.lock:
+                    self.dropped += 1
+                logger.error(f"丢弃无法写入的记录，类型: {items[0][0]}, 错误信息: {e}")
+                return
+
+            # 逐条写入，找出有问题的记录
+            for item in items:
+                self._write([item])
+            return
+
+        with self.lock:
+            self.latencies.append((time.perf_counter() - start) * 1000)
+            self.written += len(items)
+
+    def _drain(self) -> list[tuple]:
+        """按提交顺序取出队列和溢出列表中的全部记录，需持有 order_lock"""
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        items.extend(self.overflow)
+        self.overflow.clear()
+        return items
+
+    def _spool_overflow(self) -> None:
+        """队列写满后提交的记录排在队列中剩余记录之后，一起转存到缓冲文件"""
+        with self.order_lock:
+            if not self.overflow:
+                return
+
+            items = self._drain()
+            self._spool(items)
+        logger.warning(f"写入队列已满，{len(items)} 条记录按顺序转存到本地缓冲文件")
+
+    def _spool(self, items: list[tuple]) -> None:
+        try:
+            self.spool.append(items)
+            with self.lock:
+                self.spooled += len(items)
+        except Exception as e:
+            with self.lock:
+                self.dropped += len(items)
+            logger.error(f"写入本地缓冲文件失败，丢弃 {len(items)} 条记录，错误信息: {e}")
+
+    def _fail(self, e: Exception) -> None:
+        self.retry_at = time.monotonic() + self.retry_interval
+        self.last_error = str(e)
+        logger.error(f"数据库不可用，记录暂存到本地缓冲文件，{self.retry_interval} 秒后重试，错误信息: {e}")
+
+    def _replay(self) -> None:
+        """重放缓冲文件中的记录，每次一批"""
+        last_id, items = self.spool.peek(self.batch_size)
+        if not items:
+            return
+
+        try:
+            self._write(items)
+        except Exception as e:
+            self._fail(e)
+            return
+
+        self.spool.remove(last_id)
+        if self.spool.size == 0:
+            logger.info("本地缓冲文件中的记录已全部写入数据库")
+
+    def _flush(self, items: list[tuple]) -> None:
+        if self.spool.size > 0 or not self._available():
+            self._spool(items)
+            return
+
+        try:
+            self._write(items)
+        except Exception as e:
+            self._fail(e)
+            self._spool(items)
+
+    def _run(self) -> None:
+        while not self.stopped.is_set():
+            items = self._take()
+
+            if self.spool.size > 0 and self._available():
+                self._replay()
+
+            if items:
+                self._flush(items)
+
+            # 先写出已取出的记录，再转存溢出的记录，保证顺序
+            self._spool_overflow()
+            self._log_stats()
+
+        # 退出前写入队列和溢出列表中剩余的记录
+        with self.order_lock:
+            items = self._drain()
+        if items:
+            self._flush(items)
+
+    def _log_stats(self) -> None:
+        interval = config.DB_STATS_LOG_INTERVAL
+        if interval <= 0 or time.time() - self.logged_at < interval:
+            return
+
+        self.logged_at = time.time()
+        logger.info(f"后台写入统计: {json.dumps(self.stats(), ensure_ascii=False)}")
+
+    def stats(self) -> dict:
+        """队列深度、缓冲文件中的记录数和最近批量写入的耗时（毫秒）"""
+        with self.lock:
+            last = self.latencies[-1] if self.latencies else 0
+            latencies = sorted(self.latencies)
+            written, spooled, dropped = self.written, self.spooled, self.dropped
+
+        latency = {}
+        if latencies:
+            latency = {
+                "last": round(last, 1),
+                "p50": round(latencies[len(latencies) // 2], 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                "max": round(latencies[-1], 1),
+            }
+
+        return {
+            "queue": self.queue.qsize(),
+            "overflow": len(self.overflow),
+            "spool": self.spool.size,
+            "available": self._available(),
+            "written": written,
+            "spooled": spooled,
+            "dropped": dropped,
+            "flush_latency_ms": latency,
+            "last_error": self.last_error,
+        }
+
+    def close(self, timeout: float = 10) -> None:
+        """停止后台线程，剩余记录写入数据库或缓冲文件"""
+        self.stopped.set()
+        self.thread.join(timeout)
+
+
+@utils.singleton
+def get_writer(table: str, client: MySqLClient = None) -> WriteBehindWriter:
+    return WriteBehindWriter(table=table, client=client)
@@ -3,14 +3,18 @@
 # @Author  : wzdnzd
 # @Time    : 2024-02-28
 
+import json
 import time
 import uuid
 from dataclasses import dataclass
+from typing import Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from config import LLM_CONNECT_TIMEOUT, LLM_POOL_SIZE, LLM_READ_TIMEOUT
 from tools.logger import logger
-from tools.utils import trim
+from tools.utils import singleton, trim
 
 
 @dataclass
@@ -37,17 +41,23 @@ class ChatResponse(object):
     model: str = ""
 
 
-def chat(url: str, messages: list[dict], apikey: str = "", retry: int = 3, **kwargs) -> ChatResponse:
-    """聊天"""
-    goon, url, error = True, trim(url), ""
+@singleton
+def get_session() -> requests.Session:
+    """复用到后端接口的 keep-alive 连接，避免每次提问都重新建立 TCP 连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=LLM_POOL_SIZE, pool_maxsize=LLM_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def prepare(url: str, messages: list[dict], apikey: str = "", **kwargs) -> tuple[str, dict, dict, str]:
+    """校验参数并生成请求头和请求体，返回 (url, headers, payload, error)"""
+    url, error = trim(url), ""
     if not url:
-        goon, error = False, "URL 不能为空"
+        error = "URL 不能为空"
     elif not messages:
-        goon, error = False, "消息不能为空"
-
-    if not goon:
-        logger.error(error)
-        return ChatResponse(success=False, error=error)
+        error = "消息不能为空"
 
     headers = {"Content-Type": "application/json"}
     apikey = trim(apikey)
@@ -57,10 +67,17 @@ def chat(url: str, messages: list[dict], apikey: str = "", retry: int = 3, **kwa
     payload = {"messages": messages}
     payload.update(kwargs)
 
+    return url, headers, payload, error
+
+
+def post(url: str, headers: dict, payload: dict, retry: int = 3, stream: bool = False) -> tuple[requests.Response, str]:
+    """发送请求，连接失败时重试，返回状态码为 200 的响应或错误信息"""
     response, retry = None, max(0, retry) + 1
+    timeout = (LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+
     while retry > 0 and response is None:
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = get_session().post(url, json=payload, headers=headers, timeout=timeout, stream=stream)
             break
         except Exception as e:
             logger.error(e)
@@ -68,23 +85,22 @@ def chat(url: str, messages: list[dict], apikey: str = "", retry: int = 3, **kwa
         retry -= 1
 
     if response is None:
-        goon, error = False, "请求失败，已达最大重试次数"
+        return None, "请求失败，已达最大重试次数"
     elif response.status_code != 200:
-        goon, error = False, f"请求失败，错误码：{response.status_code}"
+        response.close()
+        return None, f"请求失败，错误码：{response.status_code}"
+
+    return response, ""
 
-    if not goon:
-        logger.error(error)
-        return ChatResponse(success=False, error=error)
 
-    data = response.json()
+def parse(data: dict, model: str = "") -> ChatResponse:
+    """解析非流式响应"""
     success = data.get("success", False)
     if not success:
-        error = f"请求失败，错误信息：{data.get('msg', '未知错误')}"
-        logger.error(error)
-        return ChatResponse(success=False, error=error)
+        return ChatResponse(success=False, error=f"请求失败，错误信息：{data.get('msg', '未知错误')}")
 
     result = data.get("result", {})
-    model = result.get("model", kwargs.get("model", ""))
+    model = result.get("model", model)
     created = result.get("created", int(time.time()))
     message_id = result.get("id", f"chatcmpl-{str(uuid.uuid4())}")
 
@@ -96,3 +112,131 @@ def chat(url: str, messages: list[dict], apikey: str = "", retry: int = 3, **kwa
         role = message.get("role", "assistant")
 
     return ChatResponse(id=message_id, content=content, created=created, role=role, model=model)
+
+
+def chat(url: str, messages: list[dict], apikey: str = "", retry: int = 3, **kwargs) -> ChatResponse:
+    """聊天"""
+    url, headers, payload, error = prepare(url, messages, apikey, **kwargs)
+    if error:
+        logger.error(error)
+        return ChatResponse(success=False, error=error)
+
+    response, error = post(url, headers, payload, retry)
+    if error:
+        logger.error(error)
+        return ChatResponse(success=False, error=error)
+
+    result = parse(response.json(), kwargs.get("model", ""))
+    if not result.success:
+        logger.error(result.error)
+
+    return result
+
+
+class ChatStream(object):
+    """
+    流式聊天的文本增量迭代器，可直接传给 st.write_stream
+
+    迭代结束后通过 response 获取完整的 ChatResponse，出错时 response.success 为 False，content 为已收到的部分内容
+    """
+
+    def __init__(self, url: str, headers: dict, payload: dict, retry: int = 3, error: str = ""):
+        self.url = url
+        self.headers = headers
+        self.payload = payload
+        self.retry = retry
+        self.error = error
+        self.response = None
+
+    def __iter__(self) -> Iterator[str]:
+        if self.error:
+            logger.error(self.error)
+            self.response = ChatResponse(success=False, error=self.error)
+            return
+
+        response, error = post(self.url, self.headers, self.payload, self.retry, stream=True)
+        if error:
+            logger.error(error)
+            self.response = ChatResponse(success=False, error=error)
+            return
+
+        model = self.payload.get("model", "")
+
+        # 后端不支持流式时按普通响应处理
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            try:
+                self.response = parse(response.json(), model)
+            finally:
+                response.close()
+
+            if self.response.success and self.response.content:
+                yield self.response.content
+            elif not self.response.success:
+                logger.error(self.response.error)
+            return
+
+        message_id, created, role = f"chatcmpl-{str(uuid.uuid4())}", int(time.time()), "assistant"
+        contents, error, finished = [], "", False
+        try:
+            # 数据到达即处理，不等待凑满缓冲区；SSE 固定为 UTF-8，按字节读取避免 requests 把 text/* 默认按 ISO-8859-1 解码
+            for line in response.iter_lines(chunk_size=None):
+                line = line.decode("utf-8").strip() if line else ""
+                if not line.startswith("data:"):
+                    continue
+
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    finished = True
+                    break
+
+                chunk = json.loads(data)
+                if "success" in chunk:
+                    if not chunk.get("success"):
+                        error = f"请求失败，错误信息：{chunk.get('msg', '未知错误')}"
+                        break
+                    chunk = chunk.get("result") or {}
+
+                message_id = chunk.get("id") or message_id
+                created = chunk.get("created") or created
+                model = chunk.get("model") or model
+
+                choices = chunk.get("choices")
+                if not isinstance(choices, list) or not choices:
+                    continue
+
+                delta = choices[0].get("delta") or choices[0].get("message") or {}
+                role = delta.get("role") or role
+                text = delta.get("content") or ""
+
+                # 只有收到 [DONE] 或 finish_reason 才算完整，连接被正常关闭也可能是回答被截断
+                if choices[0].get("finish_reason"):
+                    finished = True
+                if text:
+                    contents.append(text)
+                    yield text
+        except Exception as e:
+            error = f"读取流式响应失败：{e}"
+        finally:
+            response.close()
+
+            # 调用方提前停止迭代，或后端在回答结束前关闭了连接
+            if not finished and not error:
+                error = "流式响应未完成"
+            if error:
+                logger.error(error)
+            self.response = ChatResponse(
+                success=not error,
+                error=error,
+                id=message_id,
+                content="".join(contents),
+                created=created,
+                role=role,
+                model=model,
+            )
+
+
+def stream_chat(url: str, messages: list[dict], apikey: str = "", retry: int = 3, **kwargs) -> ChatStream:
+    """流式聊天，请求在开始迭代时才发送"""
+    url, headers, payload, error = prepare(url, messages, apikey, **kwargs)
+    payload["stream"] = True
+    return ChatStream(url=url, headers=headers, payload=payload, retry=retry, error=error)
@@ -3,12 +3,13 @@
 # @Author  : wzdnzd
 # @Time    : 2024-02-28
 
+import json
 import random
 import time
 import uuid
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 POEMS = [
     "白日依山尽，黄河入海流。",
@@ -74,6 +75,15 @@ class ChatChoice(object):
     logprobs: float = None
 
 
+@dataclass
+class ChatChunkChoice(object):
+    finish_reason: str = None
+
+    index: int = 0
+
+    delta: ChatMessage = None
+
+
 @dataclass
 class ChatUsage(object):
     completion_tokens: int = 0
@@ -110,6 +120,19 @@ class ChatCompletion(object):
     object: str = "chat.completion"
 
 
+@dataclass
+class ChatCompletionChunk(object):
+    created: int = 0
+
+    model: str = "Qwen-14B"
+
+    id: str = ""
+
+    choices: list[ChatChunkChoice] = field(default_factory=list)
+
+    object: str = "chat.completion.chunk"
+
+
 @dataclass
 class CommonResult(object):
     success: bool = True
@@ -125,9 +148,40 @@ app = Flask(__name__)
 app.config["JSON_SORT_KEYS"] = False
 
 
+# 流式响应时每个分块之间的间隔（秒），模拟模型逐字生成
+STREAM_INTERVAL = 0.05
+
+
+def stream(content: str):
+    """按 SSE 格式逐段返回内容，每个分块与非流式响应一样包装在 CommonResult 中，以 [DONE] 结束"""
+    message_id, created = f"chatcmpl-{str(uuid.uuid4())}", int(time.time())
+
+    def event(delta: ChatMessage, finish_reason: str = None) -> str:
+        choice = ChatChunkChoice(finish_reason=finish_reason, delta=delta)
+        chunk = ChatCompletionChunk(created=created, id=message_id, choices=[choice])
+        return f"data: {json.dumps(asdict(CommonResult(result=chunk)), ensure_ascii=False)}\n\n"
+
+    yield event(ChatMessage(role="assistant", content=""))
+
+    i = 0
+    while i < len(content):
+        size = random.randint(1, 3)
+        time.sleep(STREAM_INTERVAL)
+        yield event(ChatMessage(role=None, content=content[i : i + size]))
+        i += size
+
+    yield event(ChatMessage(role=None, content=""), finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
 @app.route("/v1/chat/completions", methods=["POST"])
 def chat():
     content = random.choice(POEMS)
+
+    body = request.get_json(silent=True) or {}
+    if body.get("stream", False):
+        return Response(stream_with_context(stream(content)), mimetype="text/event-stream")
+
     message = ChatMessage(content=content)
     completion = ChatCompletion(id=f"chatcmpl-{str(uuid.uuid4())}", choices=[ChatChoice(message=message)])
     return jsonify(CommonResult(result=completion))
@@ -3,14 +3,32 @@
 # @Author  : wzdnzd
 # @Time    : 2024-02-28
 
+import time
 import uuid
 
 import streamlit as st
 
 import llm
-from config import API_KEY, LLM_API, MODEL_NAME, STRICT_FEEDBACK
+from cache import get_cache
+from config import (
+    API_KEY,
+    CACHE_ENABLED,
+    CONTEXT_BUDGET,
+    CONTEXT_COUNT_TOKENS,
+    CONTEXT_SUMMARY,
+    CONTEXT_SUMMARY_SIZE,
+    LLM_API,
+    LLM_STREAM,
+    MODEL_NAME,
+    RESTORE_PAGE_SIZE,
+    SHOW_STATS,
+    STRICT_FEEDBACK,
+    SYSTEM_PROMPTS,
+)
+from context import ChatContext, count_chars, estimate_tokens, llm_summarizer
 from database.config import DB_TABLENAME
-from database.dbclient import MySqLClient, create_table, save_feedback, save_history
+from database.dbclient import MySqLClient, create_table, feedback_row, history_row, load_conversation
+from database.writer import get_writer
 from history import ChatHistory
 from streamlit_feedback import streamlit_feedback
 from tools import utils
@@ -18,31 +36,45 @@ from tools.logger import logger
 
 st.set_page_config(page_title="鼎磐小助手", layout="centered", page_icon="🔥")
 
-# 对话历史记录
-CACHES = []
-
 # 数据库客户端
 DB_CLIENT = MySqLClient()
 
-# 如果表不存在则创建
+# 如果表不存在则创建，同时补充旧版本缺少的索引
 create_table(table=DB_TABLENAME, client=DB_CLIENT)
 
+# 后台写入对话历史和反馈，表在运行期间被删除时重新创建
+DB_WRITER = get_writer(table=DB_TABLENAME, client=DB_CLIENT)
+
+# 重复问题的答案缓存，启动时从对话历史表加载
+ANSWER_CACHE = get_cache(table=DB_TABLENAME, client=DB_CLIENT) if CACHE_ENABLED else None
 
-def get_text(role, content):
-    jsoncon = {"role": role, "content": content}
-    CACHES.append(jsoncon)
-    return CACHES
 
+def get_context() -> ChatContext:
+    """当前会话的对话上下文，每个会话独立"""
+    if "context" not in st.session_state:
+        counter = estimate_tokens if CONTEXT_COUNT_TOKENS else count_chars
+        summarizer = llm_summarizer(LLM_API, API_KEY, CONTEXT_SUMMARY_SIZE) if CONTEXT_SUMMARY else None
+        st.session_state["context"] = ChatContext(
+            budget=CONTEXT_BUDGET, pinned=SYSTEM_PROMPTS, counter=counter, summarizer=summarizer
+        )
 
-def get_length(text):
-    return 0 if not text else sum([len(content["content"]) for content in text])
+    return st.session_state["context"]
 
 
-def check_length(text):
-    while get_length(text) > 8000:
-        del text[0]
+def cached_answer(question: str) -> llm.ChatResponse | None:
+    """会话中的第一个问题命中缓存时直接返回历史回答，追问依赖上下文，不使用缓存"""
+    if not ANSWER_CACHE or st.session_state["chat_history"]:
+        return None
 
-    return text
+    entry = ANSWER_CACHE.lookup(question)
+    if not entry:
+        return None
+
+    response = llm.ChatResponse(
+        id=f"chatcmpl-{str(uuid.uuid4())}", content=entry.answer, created=int(time.time()), model=entry.model
+    )
+    ANSWER_CACHE.link(response.id, entry)
+    return response
 
 
 def handler_feedback(feedback: dict, message_id: str, strict: bool = False) -> tuple[bool, str, str]:
@@ -61,20 +93,18 @@ def handler_feedback(feedback: dict, message_id: str, strict: bool = False) -> t
     if strict and fb_score == -1 and not fb_detail:
         return False, "亲，别忘了填写反馈内容~", "😱"
 
-    success, error = save_feedback(
-        table=DB_TABLENAME,
-        message_id=message_id,
-        fb_score=fb_score,
-        fb_detail=fb_detail,
-        client=DB_CLIENT,
-        strict=strict,
-    )
-
-    icon = "🎉" if success else "😭"
-    if not success:
+    row, error = feedback_row(message_id=message_id, fb_score=fb_score, fb_detail=fb_detail, strict=strict)
+    if not row:
         logger.error(f"保存反馈失败，message_id: {message_id}, score: {score}, text: {text}, error: {error}")
+        return False, error, "😭"
+
+    # 反馈由后台线程写入数据库，数据库暂时不可用时先保存在本地
+    DB_WRITER.submit_feedback(row)
 
-    return success, error, icon
+    # 负反馈的回答不再作为缓存返回
+    if ANSWER_CACHE and fb_score < 0:
+        ANSWER_CACHE.invalidate(message_id)
+    return True, "提交成功，感谢您的反馈", "🎉"
 
 
 def render(message: tuple | list) -> None:
@@ -115,49 +145,158 @@ def render(message: tuple | list) -> None:
             del st.session_state[f"feedback_submitted_{message_id}"]
 
 
-if "chat_history" not in st.session_state:
+def new_conversation() -> None:
+    """开始新的会话，会话 id 保存在页面地址中，刷新页面后可以恢复"""
+    conversation_id = str(uuid.uuid4())
     st.session_state["chat_history"] = []
-    st.session_state["conversation_id"] = str(uuid.uuid4())
+    st.session_state["conversation_id"] = conversation_id
+    st.session_state["history_cursor"] = None
+    get_context().clear()
+    st.query_params["cid"] = conversation_id
+
+
+def restore_message(history: ChatHistory) -> tuple:
+    """转换为页面中的消息，已反馈的消息恢复反馈状态"""
+    if history.fb_score:
+        score = "👍" if history.fb_score > 0 else "👎"
+        st.session_state[history.message_id] = {"score": score, "text": history.fb_detail}
+
+    return (history.question, history.answer, history.message_id)
+
+
+def restore_conversation(conversation_id: str) -> None:
+    """刷新页面后从数据库恢复会话最近的若干轮对话，更早的对话按需分页加载"""
+    histories, cursor = load_conversation(DB_TABLENAME, conversation_id, limit=RESTORE_PAGE_SIZE, client=DB_CLIENT)
+
+    context = get_context()
+    context.clear()
+    for history in histories:
+        context.append("user", history.question)
+        context.append("assistant", history.answer)
+
+    st.session_state["chat_history"] = [restore_message(history) for history in histories]
+    st.session_state["conversation_id"] = conversation_id
+    st.session_state["history_cursor"] = cursor
+
+
+def load_earlier() -> None:
+    """加载更早的一页对话，只用于显示，不加入上下文"""
+    histories, cursor = load_conversation(
+        DB_TABLENAME,
+        st.session_state["conversation_id"],
+        before=st.session_state["history_cursor"],
+        limit=RESTORE_PAGE_SIZE,
+        client=DB_CLIENT,
+    )
+
+    messages = [restore_message(history) for history in histories]
+    st.session_state["chat_history"] = messages + st.session_state["chat_history"]
+    st.session_state["history_cursor"] = cursor
+
+
+if "chat_history" not in st.session_state:
+    conversation_id = utils.trim(st.query_params.get("cid", ""))
+    if conversation_id and RESTORE_PAGE_SIZE > 0:
+        restore_conversation(conversation_id)
+    else:
+        new_conversation()
 
 
 if __name__ == "__main__":
     st.success("欢迎与【鼎磐小助手】进行交流")
+    if st.session_state.get("history_cursor") and st.button("加载更早的对话"):
+        load_earlier()
+
     user_input = st.chat_input("请输入你想咨询的问题，按回车键提交！")
     refresh = st.session_state["chat_history"] is not None and len(st.session_state["chat_history"]) > 0
 
     if user_input is not None or refresh:
         if user_input:
-            progress_bar = st.empty()
-            with st.spinner("内容已提交，鼎磐小助手正在作答中！"):
-                question = check_length(get_text("user", user_input))
-
-                response = llm.chat(url=LLM_API, messages=question, apikey=API_KEY)
+            context = get_context()
+            context.append("user", user_input)
+            question = context.build()
+
+            first = not st.session_state["chat_history"]
+            cached = cached_answer(user_input)
+            if cached:
+                response = cached
+                content = response.content
+                st.session_state["chat_history"].append((user_input, content, response.id))
+                for message in st.session_state["chat_history"]:
+                    render(message)
+            elif LLM_STREAM:
+                # 先渲染之前的对话，新的回答在占位容器中逐字显示，完成后替换为带反馈组件的完整消息
+                for message in st.session_state["chat_history"]:
+                    render(message)
+
+                placeholder = st.empty()
+                with placeholder.container():
+                    st.chat_message("user").write(user_input)
+                    stream = llm.stream_chat(url=LLM_API, messages=question, apikey=API_KEY)
+                    st.chat_message("assistant").write_stream(stream)
+
+                # 失败时保留已显示的部分回答，便于用户了解出错的位置
+                response = stream.response
                 if response.success:
-                    progress_bar.progress(100)
-                    content = get_text("assistant", response.content)[-1]["content"]
+                    placeholder.empty()
+                    content = response.content
                     st.session_state["chat_history"].append((user_input, content, response.id))
-
-                    # 渲染对话历史
-                    for message in st.session_state["chat_history"]:
-                        render(message)
-
-                    # 保存对话历史
-                    history = ChatHistory(
-                        conversation_id=st.session_state["conversation_id"],
+                    render(st.session_state["chat_history"][-1])
+            else:
+                progress_bar = st.empty()
+                with st.spinner("内容已提交，鼎磐小助手正在作答中！"):
+                    response = llm.chat(url=LLM_API, messages=question, apikey=API_KEY)
+                    if response.success:
+                        progress_bar.progress(100)
+                        content = response.content
+                        st.session_state["chat_history"].append((user_input, content, response.id))
+
+                        # 渲染对话历史
+                        for message in st.session_state["chat_history"]:
+                            render(message)
+
+            if response.success:
+                # 保存对话历史
+                history = ChatHistory(
+                    conversation_id=st.session_state["conversation_id"],
+                    message_id=response.id,
+                    question=user_input,
+                    answer=content,
+                    model=response.model or MODEL_NAME,
+                    created=response.created,
+                )
+                row = history_row(history)
+                if row:
+                    DB_WRITER.submit_history(row)
+
+                context.append("assistant", content)
+                if ANSWER_CACHE and first and not cached:
+                    ANSWER_CACHE.add(
                         message_id=response.id,
                         question=user_input,
                         answer=content,
-                        model=response.model or MODEL_NAME,
+                        model=history.model,
                         created=response.created,
+                        conversation_id=history.conversation_id,
                     )
-                    save_history(table=DB_TABLENAME, history=history, client=DB_CLIENT)
-
-                    with st.sidebar:
-                        if st.sidebar.button("清除对话历史"):
-                            st.session_state["chat_history"] = []
-                            st.session_state["conversation_id"] = str(uuid.uuid4())
-                else:
-                    st.info(f"对不起，我回答不了这个问题，错误信息：{response.error}")
+
+                with st.sidebar:
+                    if st.sidebar.button("清除对话历史"):
+                        new_conversation()
+            else:
+                # 撤销未得到回答的问题
+                context.pop()
+                st.info(f"对不起，我回答不了这个问题，错误信息：{response.error}")
         else:
             for message in st.session_state["chat_history"]:
                 render(message)
+
+    if SHOW_STATS:
+        with st.sidebar.expander("运行状态"):
+            st.caption("后台写入")
+            st.json(DB_WRITER.stats())
+            st.caption("数据库连接池")
+            st.json(DB_CLIENT.db.stats())
+            if ANSWER_CACHE:
+                st.caption("答案缓存")
+                st.json(ANSWER_CACHE.stats())
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# @Author  : wzdnzd
+# @Time    : 2026-10-19
+
+"""
+导出对话历史和用户反馈，用于标注和分析
+
+按 id 分页、使用服务端游标逐批读取，边读边写入文件，内存占用与导出的行数无关。
+
+用法（在项目根目录下执行）:
+    # 导出全部数据为 xlsx，格式由文件扩展名决定
+    python -m tools.export --output data/history_and_feedback.xlsx
+
+    # 导出 2024 年 3 月负反馈的数据为 csv
+    python -m tools.export --output data/negative.csv --start 2024-03-01 --end 2024-04-01 --score -1
+
+    # 导出指定模型的数据为 parquet
+    python -m tools.export --output data/qwen.parquet --model Qwen-14B
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+
+from database.config import DB_TABLENAME
+from database.dbclient import MySqLClient
+from tools import utils
+from tools.logger import logger
+
+# 读取的字段
+COLUMNS = ["id", "conversation_id", "message_id", "question", "answer", "model", "created", "fb_score", "fb_detail"]
+
+# 导出文件的表头，与 docs/history_and_feedback.xlsx 一致
+HEADERS = ["id", "conversation_id", "message_id", "question", "answer", "model", "timestamp", "score", "feedback"]
+
+
+def convert(row: tuple) -> list:
+    values = []
+    for value in row:
+        if isinstance(value, datetime):
+            value = value.strftime("%Y-%m-%d %H:%M:%S")
+        elif isinstance(value, (bytes, bytearray)):
+            value = utils.decode(value)
+        values.append(value)
+
+    return values
+
+
+class CsvWriter(object):
+    def __init__(self, filename: str):
+        # 带 BOM 以便 Excel 正确识别中文
+        self.file = open(filename, "w", encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(HEADERS)
+
+    def write(self, rows: list[list]) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class XlsxWriter(object):
+    # 单个工作表的最大行数，超出后写入新的工作表
+    MAX_ROWS = 1048576
+
+    # 单元格最多容纳的字符数
+    MAX_CELL_LENGTH = 32767
+
+    def __init__(self, filename: str):
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        self.filename = filename
+        self.illegal = ILLEGAL_CHARACTERS_RE
+
+        # 只写模式下行数据直接写入临时文件，不在内存中保留单元格对象
+        self.workbook = Workbook(write_only=True)
+        self.sheet, self.rows = None, 0
+        self.new_sheet()
+
+    def new_sheet(self) -> None:
+        index = len(self.workbook.worksheets)
+        self.sheet = self.workbook.create_sheet(title="history" if index == 0 else f"history_{index + 1}")
+        self.sheet.append(HEADERS)
+        self.rows = 1
+
+    def cell(self, value):
+        if isinstance(value, str):
+            return self.illegal.sub("", value)[: self.MAX_CELL_LENGTH]
+        return value
+
+    def write(self, rows: list[list]) -> None:
+        for row in rows:
+            if self.rows >= self.MAX_ROWS:
+                self.new_sheet()
+
+            self.sheet.append([self.cell(value) for value in row])
+            self.rows += 1
+
+    def close(self) -> None:
+        self.workbook.save(self.filename)
+
+
+class ParquetWriter(object):
+    def __init__(self, filename: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ("id", pa.int64()),
+                ("conversation_id", pa.string()),
+                ("message_id", pa.string()),
+                ("question", pa.string()),
+                ("answer", pa.string()),
+                ("model", pa.string()),
+                ("timestamp", pa.string()),
+                ("score", pa.int8()),
+                ("feedback", pa.string()),
+            ]
+        )
+        self.writer = pq.ParquetWriter(filename, self.schema, compression="zstd")
+
+    def write(self, rows: list[list]) -> None:
+        # 每批数据写为一个 row group
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pa.Table.from_arrays([list(c) for c in columns], schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "xlsx": XlsxWriter, "parquet": ParquetWriter}
+
+
+def build_filter(start: str, end: str, models: list[str], scores: list[int]) -> tuple[str, list]:
+    """生成过滤条件和对应的参数"""
+    conditions, param = [], []
+    if start:
+        conditions.append("`created` >= %s")
+        param.append(start)
+    if end:
+        conditions.append("`created` < %s")
+        param.append(end)
+    if models:
+        conditions.append(f"`model` IN ({', '.join(['%s'] * len(models))})")
+        param.extend(models)
+    if scores:
+        conditions.append(f"`fb_score` IN ({', '.join(['%s'] * len(scores))})")
+        param.extend(scores)
+
+    return " AND ".join(conditions), param
+
+
+def export(
+    filename: str,
+    fmt: str = "",
+    table: str = DB_TABLENAME,
+    start: str = "",
+    end: str = "",
+    models: list[str] = None,
+    scores: list[int] = None,
+    page_size: int = 10000,
+    fetch_size: int = 1000,
+    client: MySqLClient = None,
+) -> int:
+    """导出数据到文件，返回导出的行数"""
+    fmt = utils.trim(fmt).lower() or os.path.splitext(filename)[1].lstrip(".").lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的导出格式：{fmt}，可选：{', '.join(WRITERS)}")
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    where, param = build_filter(start, end, models or [], scores or [])
+    client = MySqLClient() if not client else client
+    writer, count, begin = WRITERS[fmt](filename), 0, time.time()
+
+    try:
+        for rows in client.iterate(table, COLUMNS, where, param, page_size=page_size, fetch_size=fetch_size):
+            writer.write([convert(row) for row in rows])
+            count += len(rows)
+
+            if count % (page_size * 10) < len(rows):
+                logger.info(f"已导出 {count} 行，耗时 {time.time() - begin:.1f} 秒")
+    finally:
+        writer.close()
+
+    logger.info(f"导出完成，共 {count} 行，耗时 {time.time() - begin:.1f} 秒，文件：{filename}")
+    return count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export chat histories and feedback")
+    parser.add_argument("--output", type=str, required=True, help="output file, format is inferred from extension")
+    parser.add_argument("--format", type=str, default="", choices=["", *WRITERS], help="output format")
+    parser.add_argument("--table", type=str, default=DB_TABLENAME, help="table name")
+    parser.add_argument("--start", type=str, default="", help="created at or after, e.g. 2024-03-01")
+    parser.add_argument("--end", type=str, default="", help="created before, e.g. 2024-04-01")
+    parser.add_argument("--model", type=str, action="append", default=[], help="model name, repeatable")
+    parser.add_argument("--score", type=int, action="append", default=[], choices=[-1, 0, 1], help="repeatable")
+    parser.add_argument("--page-size", type=int, default=10000, help="rows per query")
+    parser.add_argument("--fetch-size", type=int, default=1000, help="rows fetched and written per batch")
+    args = parser.parse_args()
+
+    try:
+        export(
+            filename=args.output,
+            fmt=args.format,
+            table=args.table,
+            start=args.start,
+            end=args.end,
+            models=args.model,
+            scores=args.score,
+            page_size=args.page_size,
+            fetch_size=args.fetch_size,
+        )
+    except Exception as e:
+        logger.error(f"导出失败，错误信息: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
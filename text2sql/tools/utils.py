@@ -19,6 +19,14 @@ def trim(content: str) -> str:
     return ""
 
 
+def decode(content) -> str:
+    """数据库连接使用 use_unicode=False，文本字段以 bytes 返回"""
+    if isinstance(content, (bytes, bytearray)):
+        return content.decode("utf-8", errors="ignore")
+
+    return trim(content)
+
+
 def is_blank(content: str, strip=False) -> bool:
     return not trim(content) if strip else not content
 